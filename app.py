@@ -4,9 +4,9 @@ Streamlit Frontend for Yoliday LLP Chatbot Assignment
 Features:
 - Takes User ID and Groq API Key as input
 - Sends user queries to FastAPI backend (/generate)
-- Displays AI-generated casual and formal responses
-- Shows chat history from Supabase via /history endpoint
-- Supports reloading past conversations
+- Streams AI-generated casual and formal responses as they are produced (/generate/stream)
+- Shows chat history from Supabase via /history endpoint, cached and synced incrementally
+- Supports reloading past conversations (fetched one at a time via /history/{id})
 - Provides logout functionality
 """
 
@@ -14,9 +14,12 @@ Features:
 # Importing libraries
 import streamlit as st
 import requests
-from datetime import datetime
+import json
 import time
 import re
+from frontend.history_cache import HistoryCache
+from frontend.history_view import HistoryView, parse_date_isoformat
+from frontend.api_client import ApiClient
 
 
 
@@ -28,6 +31,20 @@ def is_valid_user_id(user_id):
     return re.match(pattern, user_id) is not None
 
 
+# Parse a Server-Sent Events stream into (event, data) pairs
+def iter_sse(response):
+    event, data = None, None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            data = json.loads(line[len("data: "):])
+        elif not line and event is not None:
+            yield event, data
+            event, data = None, None
+
+
+
 # Authentication Form (if session not set)
 if "user_id" not in st.session_state:
     st.markdown("### Enter your User ID and GROQ API Key to continue")
@@ -106,11 +123,10 @@ if "messages" not in st.session_state:
 if "awaiting_response" not in st.session_state:
     st.session_state.awaiting_response = False
 
-if 'history_loaded' not in st.session_state:
-    st.session_state.history_loaded = False
-
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+if 'history_cache' not in st.session_state:
+    st.session_state.history_cache = HistoryCache()
+if 'history_view' not in st.session_state:
+    st.session_state.history_view = HistoryView()
 
 
 if "selected_history" in st.session_state:
@@ -138,22 +154,49 @@ if "selected_history" in st.session_state:
     st.stop()
 
 
+# Shared backend client, reused across reruns so connections stay alive
+@st.cache_resource
+def get_api_client():
+    return ApiClient.from_env()
+
+
+api = get_api_client()
+
+
 # Load and display history logic
+def fetch_history_page(params):
+    return api.get_history_page(st.session_state.user_id, params)
+
+
+def search_history(text):
+    try:
+        return api.search_history(st.session_state.user_id, {"q": text, "limit": 20, "fields": "id,query,created_at"})
+    except requests.exceptions.RequestException as req_err:
+        st.error(f"Search failed: {req_err}")
+        return {"output": [], "total": 0}
+
+
+def fetch_history_entry(entry_id):
+    return api.get_history_entry(st.session_state.user_id, entry_id)
+
+
 def load_history():
     try:
-        print(f"https://yoliday-chatbot-assignment.onrender.com/history?user_id={st.session_state.user_id}")
-        response = requests.get(f"https://yoliday-chatbot-assignment.onrender.com/history?user_id={st.session_state.user_id}")
-        print(response)
-        print("RESPONSE: ",response.json())
-        data = response.json()
-        st.session_state.chat_history = data["output"]
-        st.session_state.history_loaded = True
+        # Full load the first time, afterwards only chats newer than the last one seen
+        st.session_state.history_cache.sync(fetch_history_page)
     except Exception as e:
             print(f"ERROR: {e}")
             st.error(f"Request failed: {e}")
             # Don't append error response to chat
             st.session_state.awaiting_response = False
-            st.rerun()
+
+
+def load_older_history():
+    try:
+        st.session_state.history_cache.load_more(fetch_history_page)
+        st.session_state.history_view.show_more()
+    except Exception as e:
+        st.error(f"Request failed: {e}")
 
 
 
@@ -195,29 +238,57 @@ if not st.session_state.awaiting_response:
 elif st.session_state.awaiting_response:
     prompt = st.session_state.messages[-1]["text"]  # last user input
     print("PROMPT: ",prompt)
+
+    # Placeholders that are filled in token by token as the answer streams in
+    with st.chat_message("ai"):
+        cols = st.columns(2)
+        with cols[1]:
+            st.markdown("### 😄 Casual Response")
+            casual_box = st.empty()
+        with cols[0]:
+            st.markdown("### 🎓 Formal Response")
+            formal_box = st.empty()
+    boxes = {"casual": casual_box, "formal": formal_box}
+
     with st.spinner("Thinking..."):
         payload = {
             "user_id": st.session_state.user_id,
             "query": prompt,
-            "groq_api_key": st.session_state.groq_api_key
+            "groq_api_key": st.session_state.groq_api_key,
+            "conversation": st.session_state.get("conversation_mode", False),
         }
         print(payload)
 
         try:
-            response = requests.post("https://yoliday-chatbot-assignment.onrender.com/generate", json=payload)
-            response.raise_for_status()
-            data = response.json()
-            print("DATA: ",data)
-            ai_response = (
-                data.get("output")
-            )
-            # final_response = f"""Casual Response: {ai_response['casual_response']}\n\nFormal Response: {ai_response['formal_response']}"""
+            ai_response = None
+            texts = {"casual": "", "formal": ""}
+            with api.stream_generate(payload) as response:
+                response.raise_for_status()
+                for event, data in iter_sse(response):
+                    if event == "token":
+                        texts[data["section"]] += data["text"]
+                        boxes[data["section"]].markdown(texts[data["section"]])
+                    elif event == "reset":
+                        # The draft is being refined; clear it before the refined text streams in
+                        texts = {"casual": "", "formal": ""}
+                        for box in boxes.values():
+                            box.empty()
+                    elif event == "done":
+                        ai_response = data["output"]
+                    elif event == "error":
+                        if data["status"] == 401:
+                            st.error("Authentication failed: Invalid Groq API Key. Redirecting...")
+                            time.sleep(2)
+                            st.session_state.pop("user_id", None)
+                            st.rerun()
+                        raise RuntimeError(data["detail"])
+
             print(ai_response)
             st.session_state.messages.append({"role": "ai", "text": [ai_response['casual_response'],ai_response['formal_response']]})
             
             #Reset flag to re enable output
             st.session_state.awaiting_response = False
-            st.session_state.history_loaded = False
+            st.session_state.history_cache.mark_stale()
 
             # Trigger rerun to show input again
             st.rerun()
@@ -236,29 +307,14 @@ elif st.session_state.awaiting_response:
 
 
 
-# Preprocessing the tiemstamp info for sorting
-def parse_date_isoformat(date_str):
-    if '.' in date_str:
-        date_part, micro_part = date_str.split('.')
-        # micro_part may end with 'Z' or timezone info - handle only microseconds here
-        microseconds = micro_part[:6].ljust(6, '0')  # pad to 6 digits
-        rest = micro_part[6:]  # possible timezone info
-        fixed_date_str = f"{date_part}.{microseconds}{rest}"
-    else:
-        fixed_date_str = date_str
-    return datetime.fromisoformat(fixed_date_str)
-
 # Retrieving previous chats of user
-def set_selected_history(index):
+def set_selected_history(entry_id):
     try:
-        response = requests.get(f"https://yoliday-chatbot-assignment.onrender.com/history?user_id={st.session_state.user_id}")
-        response.raise_for_status()
-        all_chats = response.json()
-        selected=all_chats['output'][index]
+        # Served from the local cache when this chat was opened before
+        selected = dict(st.session_state.history_cache.get_detail(entry_id, fetch_history_entry))
         if 'created_at' in selected:
             selected['created_at'] = parse_date_isoformat(selected['created_at'])
 
-        # print(all_chats)
         st.session_state.selected_history = selected
         print(selected)
 
@@ -273,41 +329,54 @@ def set_selected_history(index):
 with st.sidebar:
     if st.button("Logout"):
         # Clear user session state
-        for key in ["user_id", "groq_api_key", "messages", "awaiting_response", "history_loaded", "chat_history", "selected_history"]:
+        for key in ["user_id", "groq_api_key", "messages", "awaiting_response", "history_cache", "history_view", "selected_history"]:
             if key in st.session_state:
                 del st.session_state[key]
         st.rerun()
 
+    st.toggle("Follow-up mode", key="conversation_mode", help="Use your earlier chats as context for this question")
+
     st.markdown("---")  # separator line
+    search_text = st.text_input("Search chats", key="history_search", placeholder="Search your chats").strip()
+    if search_text:
+        results = search_history(search_text)
+        st.caption(f"{results['total']} matching chats" if results.get("total") is not None else "Matching chats")
+        for chat in results["output"]:
+            st.button(
+                chat["query"],
+                key=f"search_{chat['id']}",
+                on_click=set_selected_history,
+                args=(chat['id'],)
+            )
+        st.markdown("---")
+
     st.text("All history")
-    if not st.session_state.history_loaded:
+    history_cache = st.session_state.history_cache
+    if not history_cache.loaded or history_cache.stale:
         load_history()
 
-    
-
-    # Get indices for today's chats
-    today_indices = [idx for idx, chat in enumerate(st.session_state.chat_history) if parse_date_isoformat(chat['created_at']).date() == datetime.today().date()]
-
-    # Get indices for older chats
-    older_indices = [idx for idx, chat in enumerate(st.session_state.chat_history) if parse_date_isoformat(chat['created_at']).date() != datetime.today().date()]
+    # Groups are rebuilt only when the cached history changes, and only a window is rendered
+    history_view = st.session_state.history_view
+    history_view.refresh(history_cache.records, history_cache.version)
+
+    for label, chats in history_view.visible():
+        st.markdown(f'<h3>{label}</h3>', unsafe_allow_html=True)
+        for chat in chats:
+            st.button(
+                chat["query"],
+                key=f"history_{chat['id']}",
+                on_click=set_selected_history,
+                args=(chat['id'],)
+            )
 
-    st.markdown('<h3>Today</h3>', unsafe_allow_html=True)
-    for idx in today_indices:
-        chat = st.session_state.chat_history[idx]
-        st.button(
-            chat["query"],
-            key=f"history_{idx}",
-            on_click=set_selected_history,
-            args=(idx,)
-        )
-
-    st.markdown('<h3>Older Chats</h3>', unsafe_allow_html=True)
-    for idx in older_indices:
-        chat = st.session_state.chat_history[idx]
-        st.button(
-            chat["query"],
-            key=f"history_{idx}_old",
-            on_click=set_selected_history,
-            args=(idx,)
-        )
+    if history_view.has_hidden:
+        st.button("Show more", key="history_show_more", on_click=history_view.show_more)
+    elif history_cache.has_more:
+        st.button("Load more", key="history_load_more", on_click=load_older_history)
 
+    retry_delay = history_cache.next_retry()
+    if retry_delay is not None:
+        # The latest chat is still being saved in the background; check again a few
+        # times with backoff, then leave it to the next interaction
+        time.sleep(retry_delay)
+        st.rerun()
@@ -1,56 +1,600 @@
-from fastapi import FastAPI, HTTPException, Response, Request
+from fastapi import FastAPI, HTTPException, Response, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
+import asyncio
+import base64
+from datetime import datetime
+import hashlib
+import importlib
 import json
-from langchain_groq import ChatGroq
-import groq
-from utils.prompts import build_prompt, build_refine_prompt
-from schemas import getInput 
+import math
+from utils.prompts import create_prompt_registry, prompt_version, prompt_fingerprint
+from utils.cache import create_response_cache, normalize_query
+from utils.parsing import SectionStreamParser, parse_model_output
+from utils.models import ModelRegistry
+from utils.router import create_model_router
+from utils.context import ConversationContext, estimate_tokens
+from utils.ratelimit import KeyedPacer, TokenBucketLimiter
+from utils.singleflight import SingleFlight
+from utils.store import create_shared_store
+from utils.search import create_search_index
+from schemas import getInput, BatchInput, JobInput
+from utils.metrics import StrategyMetrics
+from utils.tracing import metrics, span, record_tokens, logger, configure_logging, RequestTracingMiddleware
+from utils.profiler import SamplingProfiler
+from utils.lazy import lazy_import, is_loaded
+from utils.admission import AdmissionController, AdmissionMiddleware, Overloaded, drain_on_signals
+from utils.jobs import JobRunner, JobError, job_view
+from utils.compression import CompressionMiddleware
+from utils.budget import create_output_budget, finish_reason, TokenUsage, TRUNCATED
+from utils.responses import FastJSONResponse, etag, etag_matches
 from db import crud
-import re
+from db.storage import create_history_store
+from db.jobs import create_job_store
+from db.writer import WriteBehindQueue
+from contextlib import asynccontextmanager
+import config
+from typing import Literal, Optional
+import time
 
 
 load_dotenv()
 
+# Loaded on first use (or by the startup warm-up), keeping cold start short; see utils/lazy.py.
+groq = lazy_import("groq")
 
-app = FastAPI()
 
+# Chat history storage (Supabase or local SQLite); see db/storage.py.
+history_store = create_history_store(config)
 
+# Per-user history search index, kept current as rows are inserted; see utils/search.py.
+search_index = create_search_index(config)
 
 
-def extract_json(text: str) -> dict:
+async def flush_history_rows(rows: list):
+    """Inserts queued history rows and adds the stored records to the search index."""
+    result = await history_store.add_rows(rows)
+    if isinstance(result, list):
+        search_index.add_rows(result)
+    return result
+
+
+# History inserts are flushed in the background; see db/writer.py.
+write_queue = WriteBehindQueue(
+    flush_history_rows,
+    config.PERSISTENCE_SPOOL_PATH,
+    max_size=config.PERSISTENCE_QUEUE_SIZE,
+    batch_size=config.PERSISTENCE_BATCH_SIZE,
+    flush_interval=config.PERSISTENCE_FLUSH_INTERVAL,
+    max_retries=config.PERSISTENCE_MAX_RETRIES,
+)
+
+
+# Dependencies reported by /ready, and whether the startup warm-up has finished with them.
+readiness = {"warmup": "disabled" if not config.WARMUP_ON_STARTUP else "pending", "error": None}
+
+
+async def warm_up():
+    """
+    Loads the model client library and connects the history store in the
+    background after startup, so the first real request does not pay for them.
+    The imports run in a thread to keep the event loop answering meanwhile.
+    """
+
+    readiness["warmup"] = "running"
+    try:
+        with span("warm_up", config.MODEL_NAME):
+            await asyncio.to_thread(importlib.import_module, "langchain_groq")
+            await history_store.connect()
+        readiness["warmup"] = "done"
+    except Exception as e:
+        readiness.update(warmup="failed", error=str(e))
+        logger.warning("warm-up failed", extra={"fields": {"error": str(e)}})
+
+
+# Bounds accepted generate work per worker; rejects with 503 when saturated or draining.
+admission = AdmissionController(config.ADMISSION_MAX_IN_FLIGHT, config.ADMISSION_MAX_QUEUE, config.ADMISSION_QUEUE_TIMEOUT)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listener = configure_logging(config.LOG_LEVEL)
+    drain_on_signals(admission)
+    if config.PERSISTENCE_WRITE_BEHIND:
+        await write_queue.start()
+    await job_runner.start()
+    warm_up_task = asyncio.create_task(warm_up()) if config.WARMUP_ON_STARTUP else None
+    yield
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    # Finish (or fail) background jobs first, since they persist through the write queue
+    await job_runner.stop(config.DRAIN_TIMEOUT)
+    # Drain pending history rows before the process exits
+    await write_queue.stop()
+    await history_store.close()
+    profiler.stop()
+    log_listener.stop()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+app.add_middleware(
+    AdmissionMiddleware, controller=admission, paths=("/generate", "/generate/stream", "/generate/batch"),
+    # A batch of BATCH_MAX_QUERIES paced at BATCH_RATE_LIMIT can legitimately outlast REQUEST_DEADLINE
+    deadline=config.REQUEST_DEADLINE, deadline_paths=("/generate", "/generate/stream"),
+)
+if config.COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware, minimum_size=config.COMPRESSION_MIN_SIZE, encodings=config.COMPRESSION_ENCODINGS)
+app.add_middleware(RequestTracingMiddleware)
+
+# Caps concurrent upstream LLM calls; excess requests wait on the event loop.
+llm_semaphore = asyncio.Semaphore(config.LLM_CONCURRENCY)
+
+strategy_metrics = StrategyMetrics()
+
+response_cache = create_response_cache(config) if config.CACHE_ENABLED else None
+
+# ChatGroq clients reused per (API key, model); see utils/models.py.
+model_registry = ModelRegistry(config.MODEL_REGISTRY_SIZE, config.MODEL_IDLE_TTL)
+
+# Versioned prompt templates, compiled once; PROMPT_VERSIONS pins or A/B tests versions.
+prompt_registry = create_prompt_registry(config)
+
+# Per-style answer lengths, stated in the prompt and enforced with max_tokens; see utils/budget.py.
+output_budget = create_output_budget(config)
+
+# Draft/refine model chains with fallback and latency-aware ordering; see utils/router.py.
+model_router = create_model_router(config)
+
+# Prior turns assembled into the prompt for conversation mode; see utils/context.py.
+conversation_context = ConversationContext(config.CONVERSATION_TOKEN_BUDGET, config.CONVERSATION_RECENT_TURNS)
+
+# Rate limits and single-flight coordination; shared across workers with SHARED_STORE_BACKEND=redis.
+shared_store = create_shared_store(config)
+key_limiter = TokenBucketLimiter(shared_store, config.RATE_LIMIT_PER_KEY / 60, config.RATE_LIMIT_KEY_BURST, "key:")
+user_limiter = TokenBucketLimiter(shared_store, config.RATE_LIMIT_PER_USER / 60, config.RATE_LIMIT_USER_BURST, "user:")
+single_flight = SingleFlight(shared_store, wait_timeout=config.SINGLE_FLIGHT_WAIT)
+
+def leader_errors() -> tuple:
+    """Upstream errors caused by one caller's key, which coalesced callers should not inherit."""
+    return (groq.AuthenticationError, groq.PermissionDeniedError, groq.RateLimitError)
+
+RATE_LIMITED = metrics.counter("rate_limited_total", "Requests answered with 429, by limit.", ("scope",))
+MODEL_CALLS = metrics.counter("model_calls_total", "Model calls by phase, model and outcome.", ("phase", "model", "outcome"))
+PROMPT_GENERATIONS = metrics.counter("prompt_generations_total", "Model generations by prompt template version.", ("version",))
+MODEL_FALLBACKS = metrics.counter("model_fallbacks_total", "Calls moved to the next model in the chain, by the model that failed.", ("phase", "model", "reason"))
+
+# Toggled at runtime through /debug/profiler when PROFILER_ENABLED is set.
+profiler = SamplingProfiler()
+
+# Existing in-process stats, read at scrape time by /metrics.
+def cache_lookup_counts() -> dict:
+    if response_cache is None:
+        return {}
+    snapshot = response_cache.snapshot()
+    return {(outcome,): snapshot[outcome] for outcome in ("exact_hits", "similar_hits", "misses")}
+
+
+metrics.gauge("response_cache_lookups", "Response cache lookups by outcome since start.", cache_lookup_counts, ("outcome",))
+metrics.gauge("write_queue_depth", "History rows waiting in the write-behind queue.", lambda: {(): write_queue.snapshot()["queue_depth"]})
+metrics.gauge(
+    "single_flight_requests", "Generations led vs. coalesced onto an identical in-flight query.",
+    lambda: {(kind,): single_flight.stats[kind] for kind in ("leaders", "coalesced", "remote_waits")},
+    ("kind",),
+)
+metrics.gauge(
+    "model_latency_p95_seconds", "Recent p95 latency of successful calls, used for routing.",
+    lambda: {(phase, m["name"]): m["p95"] for phase, models in model_router.snapshot().items() for m in models},
+    ("phase", "model"),
+)
+metrics.gauge(
+    "conversation_summary_lookups", "Per-turn summary cache lookups in conversation mode.",
+    lambda: {("hit",): conversation_context.stats["summary_hits"], ("miss",): conversation_context.stats["summary_misses"]},
+    ("outcome",),
+)
+metrics.gauge(
+    "search_index_size", "Users, records and distinct terms held by the local history search index.",
+    lambda: {(kind,): count for kind, count in search_index.snapshot().items()},
+    ("kind",),
+)
+metrics.gauge(
+    "admission_requests", "Generate requests holding or waiting for an admission slot.",
+    lambda: {("in_flight",): admission.in_flight, ("waiting",): admission.waiting},
+    ("state",),
+)
+metrics.gauge(
+    "admission_rejections", "Generate requests turned away or cut off since start, by reason.",
+    lambda: {(reason,): admission.stats[key] for reason, key in (
+        ("saturated", "rejected_saturated"), ("queue_timeout", "rejected_queue_timeout"),
+        ("draining", "rejected_draining"), ("deadline", "deadline_exceeded"),
+    )},
+    ("reason",),
+)
+metrics.gauge(
+    "jobs_in_progress", "Background generation jobs waiting in the queue or running.",
+    lambda: {("queued",): job_runner.queue_depth, ("running",): job_runner.snapshot()["running"]},
+    ("state",),
+)
+metrics.gauge("model_registry_size", "ChatGroq clients held by the model registry.", lambda: {(): model_registry.snapshot()["size"]})
+
+
+def is_complete_response(response_dict: dict) -> bool:
+    """
+    Quality check for a parsed model response: both styles present as non-empty strings.
+    """
+
+    return all(
+        isinstance(response_dict.get(key), str) and response_dict[key].strip()
+        for key in ("casual_response", "formal_response")
+    )
+
+
+def model_params() -> dict:
+    """Per-call model parameters: the output budget's `max_tokens`, when bounded."""
+    return {"max_tokens": output_budget.max_tokens} if output_budget.max_tokens else {}
+
+
+async def invoke_model(model, prompt: str, timeout: float = None):
+    async with llm_semaphore:
+        # The timeout starts once a slot is free, so queueing does not count against the model
+        return await asyncio.wait_for(model.ainvoke(prompt, **model_params()), timeout)
+
+
+def fallback_reason(error: Exception) -> Optional[str]:
+    """
+    Why a failed model call should move on to the next model in the chain, or
+    None if the error would not go away with another model (e.g. a bad key).
+    """
+
+    if isinstance(error, (TimeoutError, groq.APITimeoutError)):
+        return "timeout"
+    if isinstance(error, groq.RateLimitError):
+        return "rate_limited"
+    if isinstance(error, (groq.APIConnectionError, groq.InternalServerError)):
+        return "server_error"
+    if isinstance(error, groq.NotFoundError) or (isinstance(error, groq.BadRequestError) and "decommission" in str(error).lower()):
+        return "unavailable"
+    return None
+
+
+def discard_clients(api_key: str):
+    for name in model_router.model_names:
+        model_registry.discard(api_key, name)
+
+
+def rate_limits(api_key: str, user_id: str) -> tuple:
+    """The `(scope, label, limiter, key)` buckets a generate request for this API key and user draws from."""
+    return (
+        ("api_key", "API key", key_limiter, hashlib.sha256(api_key.encode()).hexdigest()),
+        ("user", "user", user_limiter, user_id),
+    )
+
+
+async def enforce_rate_limits(api_key: str, user_id: str):
+    """
+    Takes a token from the caller's API-key and user buckets.
+
+    Raises:
+        HTTPException: 429 with `Retry-After` when either bucket is empty.
+    """
+
+    for scope, label, limiter, key in rate_limits(api_key, user_id):
+        retry_after = await limiter.check(key)
+        if retry_after:
+            RATE_LIMITED.inc(scope=scope)
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many requests for this {label}. Please retry in {math.ceil(retry_after)}s.",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+
+async def wait_for_rate_limits(api_key: str, user_id: str):
+    """
+    Takes a token from the caller's API-key and user buckets, waiting for each
+    to refill instead of failing. Used for the items of a batch after the first.
+    """
+
+    for _, _, limiter, key in rate_limits(api_key, user_id):
+        while retry_after := await limiter.check(key):
+            await asyncio.sleep(retry_after)
+
+
+def upstream_retry_after(error: "groq.RateLimitError") -> str:
+    """
+    The `Retry-After` Groq sent with a 429, defaulting to one second.
+    """
+
+    return error.response.headers.get("retry-after", "1")
+
+
+async def parse_output(text: str) -> dict:
+    # Parsing is linear in the reply, but a long reply is still too slow for the event loop
+    with span("parse", config.MODEL_NAME):
+        return await asyncio.to_thread(parse_model_output, text)
+
+
+async def call_model(api_key: str, prompt: str, phase: str, usage: TokenUsage = None):
+    """
+    Calls the phase's models in router order until one succeeds, each with its
+    own timeout, inside an `llm_<phase>` span that records token usage. The
+    successful call is added to `usage`.
+
+    Raises:
+        Exception: The last model's error when every model fails, or the first
+            error that another model would not fix.
     """
-    Cleans and parses a string containing JSON content.
 
-    This function removes Markdown-style code block wrappers (e.g., ```json)
-    and converts the remaining string into a Python dictionary.
+    candidates = model_router.candidates(phase, api_key)
+    for position, spec in enumerate(candidates):
+        model = model_registry.get(api_key, spec["name"])
+        start = time.perf_counter()
+        try:
+            with span(f"llm_{phase}", spec["name"]) as fields:
+                response = await invoke_model(model, prompt, spec["timeout"])
+                counts = record_tokens(response, phase, spec["name"])
+                truncated = finish_reason(response) == "length"
+                fields.update(counts, truncated=truncated)
+        except Exception as e:
+            reason = fallback_reason(e)
+            MODEL_CALLS.inc(phase=phase, model=spec["name"], outcome=reason or "error")
+            if reason is None:
+                raise
+            model_router.record(phase, spec["name"], reason, api_key=api_key)
+            if position == len(candidates) - 1:
+                raise
+            MODEL_FALLBACKS.inc(phase=phase, model=spec["name"], reason=reason)
+            logger.warning("model fallback", extra={"fields": {"phase": phase, "model": spec["name"], "reason": reason}})
+            continue
+        model_router.record(phase, spec["name"], "ok", time.perf_counter() - start)
+        MODEL_CALLS.inc(phase=phase, model=spec["name"], outcome="ok")
+        if truncated:
+            TRUNCATED.inc(phase=phase, model=spec["name"])
+        if usage is not None:
+            usage.add(phase, counts, prompt, response.content, truncated)
+        return response
+
+
+async def run_strategy(api_key: str, query: str, strategy: str, prompts: dict, context: str = ""):
+    """
+    Runs the draft/refine pipeline according to the chosen generation strategy.
 
     Args:
-        text (str): The raw string response from the model containing JSON.
+        api_key (str): Groq API key used for every model in the route.
+        query (str): The user's topic.
+        strategy (str): One of `single`, `refine` or `refine-if-invalid`.
+        prompts (dict): `{"draft", "refine"}` templates, from `prompt_registry.select_all`.
+        context (str): Earlier conversation turns for the draft prompt, if any.
 
     Returns:
-        dict: Parsed JSON content as a dictionary.
+        tuple: (parsed response dict, `TokenUsage` of the model calls made).
 
     Raises:
-        ValueError: If the string does not contain valid JSON.
+        ValueError: If the final model output cannot be parsed or fails validation.
     """
 
+    usage = TokenUsage()
+    with span("build_prompt", config.MODEL_NAME, template=prompts["draft"].id):
+        prompt = prompts["draft"].render(query=query, context=context, length=output_budget.instruction())
+    initial_response = await call_model(api_key, prompt, "draft", usage)
+
+    if strategy == "single":
+        return await parse_output(initial_response.content), usage
+
+    draft = None
     try:
-        cleaned = re.sub(r"^```json|```$", "", text.strip(), flags=re.MULTILINE).strip()
-        return json.loads(cleaned)
-    except json.JSONDecodeError:
-        raise ValueError("Invalid JSON response from model")
+        draft = await parse_output(initial_response.content)
+        if strategy == "refine-if-invalid" and is_complete_response(draft):
+            return draft, usage
+    except ValueError:
+        pass
+
+    with span("build_prompt", config.MODEL_NAME, template=prompts["refine"].id):
+        prompt = prompts["refine"].render(input_json=refine_input(initial_response.content, draft), length=output_budget.instruction())
+    refined_response = await call_model(api_key, prompt, "refine", usage)
+    return await parse_output(refined_response.content), usage
+
+
+def refine_input(raw: str, draft: dict = None) -> str:
+    """
+    The draft as sent to the refine step: minified JSON when it parsed, so
+    indentation, markdown fences and chatter around it are not sent back to
+    the model. An unparseable draft is sent as it is, for the refine step to repair.
+    """
+
+    if draft is None:
+        return raw
+    return json.dumps(draft, ensure_ascii=False, separators=(",", ":"))
+
+
+def record_usage(strategy: str, latency: float, usage: TokenUsage):
+    """Records a generated response's token usage in the strategy metrics, the token histogram and a `token usage` log line."""
+    strategy_metrics.record(strategy, latency, usage.total_tokens, usage.calls, usage.output_tokens, usage.truncated)
+    usage.observe(strategy)
+    logger.info("token usage", extra={"fields": {
+        "strategy": strategy, "duration_ms": round(latency * 1000, 3), "max_tokens": output_budget.max_tokens, **usage.fields(),
+    }})
+
+
+def get_cache_namespace(strategy: str, prompts: dict) -> str:
+    # The fingerprint keeps an edited template from serving answers cached under its old text
+    # and the output budget changes the answers' length
+    return f"{prompt_version(prompts, strategy)}.{prompt_fingerprint(prompts, strategy)}:{config.MODEL_NAME}:{strategy}:{output_budget.key}"
+
+
+def flight_key(query: str, cache_namespace: str) -> str:
+    return f"{cache_namespace}|{normalize_query(query)}"
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_model(api_key: str, prompt: str, phase: str, usage: TokenUsage):
+    """
+    Streams one model call, yielding SSE `token` events tagged with the section
+    (casual/formal) each piece of text belongs to.
+
+    Models are tried in router order like `call_model`, but only until the
+    first chunk arrives: each model's timeout applies to its first chunk, and
+    once text has been sent a failure is raised rather than retried.
+
+    The successful call is added to `usage`. The final yielded item is a
+    `(raw_text,)` tuple rather than an event.
+    """
+
+    candidates = model_router.candidates(phase, api_key)
+    for position, spec in enumerate(candidates):
+        model = model_registry.get(api_key, spec["name"])
+        parser = SectionStreamParser()
+        counts = {}
+        truncated = False
+        started = False
+        start = time.perf_counter()
+        try:
+            with span(f"llm_{phase}", spec["name"], stream=True) as fields:
+                async with llm_semaphore:
+                    chunks = model.astream(prompt, **model_params()).__aiter__()
+                    while True:
+                        try:
+                            next_chunk = chunks.__anext__()
+                            chunk = await (next_chunk if started else asyncio.wait_for(next_chunk, spec["timeout"]))
+                        except StopAsyncIteration:
+                            break
+                        started = True
+                        if getattr(chunk, "usage_metadata", None):
+                            # Groq reports usage once, on the final chunk
+                            counts = record_tokens(chunk, phase, spec["name"])
+                            fields.update(counts)
+                        truncated = truncated or finish_reason(chunk) == "length"
+                        for section, text in parser.feed(chunk.content):
+                            yield sse_event("token", {"phase": phase, "section": section, "text": text})
+        except Exception as e:
+            reason = fallback_reason(e)
+            MODEL_CALLS.inc(phase=phase, model=spec["name"], outcome=reason or "error")
+            if reason is None:
+                raise
+            model_router.record(phase, spec["name"], reason, api_key=api_key)
+            if started or position == len(candidates) - 1:
+                raise
+            MODEL_FALLBACKS.inc(phase=phase, model=spec["name"], reason=reason)
+            logger.warning("model fallback", extra={"fields": {"phase": phase, "model": spec["name"], "reason": reason}})
+            continue
+        model_router.record(phase, spec["name"], "ok", time.perf_counter() - start)
+        MODEL_CALLS.inc(phase=phase, model=spec["name"], outcome="ok")
+        if truncated:
+            TRUNCATED.inc(phase=phase, model=spec["name"])
+        usage.add(phase, counts, prompt, parser.buffer, truncated)
+        yield (parser.buffer,)
+        return
+
+
+async def persist_entry(user_id: str, query: str, response_dict: dict, version: str):
+    """
+    Saves a generated response to the user's history, with the `version` of
+    the prompt templates that produced it.
+
+    With the write-behind queue running, the row is queued and the call returns
+    immediately. Otherwise (disabled, or the app was started without its
+    lifespan) it is inserted inline.
+    """
+
+    row = {
+        "user_id": user_id,
+        "query": query,
+        "casual_response": response_dict['casual_response'],
+        "formal_response": response_dict['formal_response'],
+        "prompt_version": version,
+    }
+    with span("persist", config.MODEL_NAME, queued=write_queue.running):
+        if write_queue.running:
+            await write_queue.enqueue(row)
+            return
+
+        crud_response = await history_store.add_entry(user_id, query, row['casual_response'], row['formal_response'], version)
+    # The new record's id is not known here, so the user's index is rebuilt on their next search
+    search_index.invalidate(user_id)
+    if isinstance(crud_response, Exception):
+        logger.warning("history insert failed", extra={"fields": {"error": str(crud_response)}})
+
+
+async def load_context(user_id: str, query: str) -> str:
+    """
+    Fetches the user's latest turns and assembles them into a token-budgeted
+    context block for `query`. A failed history read falls back to no context.
+    """
+
+    with span("build_context", config.MODEL_NAME) as fields:
+        rows = await history_store.get_history_page(
+            user_id, config.CONVERSATION_HISTORY_TURNS, fields=("id", "query", "casual_response", "created_at"),
+        )
+        if isinstance(rows, Exception):
+            logger.warning("conversation history read failed", extra={"fields": {"error": str(rows)}})
+            return ""
+        context = conversation_context.build(rows, query)
+        fields.update(turns=len(rows), context_tokens=estimate_tokens(context))
+    return context
+
+
+async def generate_response(api_key: str, query: str, strategy: str, prompts: dict, context: str = "") -> dict:
+    """
+    Returns the response for `query`, from the response cache when possible,
+    otherwise by running `strategy` against the model and caching the result.
+    Answers that depend on conversation `context` bypass the cache and
+    single-flight, since another user's identical query means something else.
+    Cache entries are scoped to the selected prompt template versions.
+    """
+
+    cache_namespace = get_cache_namespace(strategy, prompts)
+    cacheable = response_cache is not None and not context
+    if cacheable:
+        with span("cache_lookup", config.MODEL_NAME) as fields:
+            response_dict, fields["hit"] = await response_cache.get(query, cache_namespace)
+        if response_dict is not None:
+            return response_dict
+
+    async def produce():
+        start = time.perf_counter()
+        response_dict, usage = await run_strategy(api_key, query, strategy, prompts, context)
+        record_usage(strategy, time.perf_counter() - start, usage)
+        PROMPT_GENERATIONS.inc(version=prompt_version(prompts, strategy))
+        # A truncated answer parses, but ends mid-sentence; it is served once and not reused
+        if cacheable and is_complete_response(response_dict) and not usage.final_truncated:
+            await response_cache.set(query, cache_namespace, response_dict)
+        return response_dict
+
+    if context or not config.SINGLE_FLIGHT_ENABLED:
+        return await produce()
+
+    async def lookup():
+        return (await response_cache.get(query, cache_namespace))[0] if response_cache is not None else None
+
+    return await single_flight.run(flight_key(query, cache_namespace), produce, lookup, retry_on=leader_errors())
 
 
 @app.post("/generate")
-def generate(user_input: getInput):
+async def generate(user_input: getInput):
     """
     Generates AI responses (casual and formal) for a user-provided query.
 
     This endpoint accepts a query and a GROQ API key, invokes the ChatGroq
     model to generate and refine responses, and stores the interaction in the database.
+    Model calls and the database insert are awaited, so no worker thread is held
+    during the round trips; at most `LLM_CONCURRENCY` model calls run at once.
+    The draft/refine behaviour follows `user_input.strategy`, falling back to
+    the server's `GENERATION_STRATEGY`. Responses are served from the response
+    cache when the same (or a sufficiently similar) query was answered with the
+    same prompt template versions, model and strategy; cache hits are still saved
+    to history. Template versions come from `PROMPT_VERSIONS` (stable per user
+    when A/B testing) and are stored with the history row.
+    Concurrent identical queries share one generation, and requests are rate
+    limited per API key and per user. Each model call goes through the model
+    router, which falls back to the next configured model on timeouts, 5xx,
+    rate limits or unavailable models. With `conversation` set, the user's
+    earlier turns are summarized into the prompt under `CONVERSATION_TOKEN_BUDGET`.
 
     Args:
-        user_input (getInput): Pydantic model containing `user_id`, `query`, and `groq_api_key`.
+        user_input (getInput): Pydantic model containing `user_id`, `query`, `groq_api_key`
+            and an optional `strategy`.
 
     Returns:
         dict: JSON response containing the AI-generated `casual_response` and `formal_response`.
@@ -58,63 +602,802 @@ def generate(user_input: getInput):
     Raises:
         HTTPException: 
             - 401 if authentication with Groq fails.
+            - 429 with `Retry-After` if the key or user is over its rate limit, or Groq rate limits the key.
             - 500 for any other unexpected errors.
+            - 503 with `Retry-After` if the worker is saturated or shutting down, and 504 past
+              `REQUEST_DEADLINE` (both from the admission middleware, see utils/admission.py).
     """
 
+    await enforce_rate_limits(user_input.groq_api_key, user_input.user_id)
     try:
-        model = ChatGroq(model_name='Gemma2-9b-It', api_key=user_input.groq_api_key)
-        prompt = build_prompt(user_input.query)
-        initial_response = model.invoke(prompt)
+        strategy = user_input.strategy or config.GENERATION_STRATEGY
+        prompts = prompt_registry.select_all(user_input.user_id)
+        context = await load_context(user_input.user_id, user_input.query) if user_input.conversation else ""
 
-        refinement_prompt = build_refine_prompt(initial_response.content)
-        refined_response = model.invoke(refinement_prompt)
-        
-        response_dict = extract_json(refined_response.content)
+        response_dict = await generate_response(user_input.groq_api_key, user_input.query, strategy, prompts, context)
 
-        crud_response = crud.add_entry(user_input.user_id, user_input.query, response_dict['casual_response'], response_dict['formal_response'])
-        print(crud_response)
+        await persist_entry(user_input.user_id, user_input.query, response_dict, prompt_version(prompts, strategy))
         return {"output": response_dict}
 
     except groq.AuthenticationError as e:
+        discard_clients(user_input.groq_api_key)
         # Send error to frontend with HTTP 401
         raise HTTPException(status_code=401, detail="Invalid Groq API Key. Please check and try again.")
+
+    except groq.RateLimitError as e:
+        raise HTTPException(status_code=429, detail="Groq rate limit reached for this API key. Please retry shortly.",
+                            headers={"Retry-After": upstream_retry_after(e)})
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
 
+@app.post("/generate/stream")
+async def generate_stream(user_input: getInput):
+    """
+    Streaming variant of `/generate` using Server-Sent Events.
+
+    Emits `token` events (`{"phase", "section", "text"}`) as the model produces
+    the casual and formal answers. If the strategy requires a refine pass, a
+    `reset` event is sent before the refined tokens so the client can clear
+    the draft. Once the response is parsed and handed off for saving, a `done` event carries
+    `{"output": {...}}`; failures are reported as an `error` event with a
+    `status` and `detail` (plus `retry_after` for upstream rate limits). If an
+    identical query is already being generated by `/generate` or a batch, its
+    result is sent as `shared` tokens instead of calling the model again.
+
+    Args:
+        user_input (getInput): Same payload as `/generate`.
+
+    Returns:
+        StreamingResponse: `text/event-stream` of the events above.
+
+    Raises:
+        HTTPException: 
+            - 429 with `Retry-After` if the key or user is over its rate limit.
+            - 503 with `Retry-After` if the worker is saturated or shutting down. Past
+              `REQUEST_DEADLINE` the stream ends with an `error` event with status 504.
+    """
+
+    await enforce_rate_limits(user_input.groq_api_key, user_input.user_id)
+
+    async def events():
+        try:
+            strategy = user_input.strategy or config.GENERATION_STRATEGY
+            prompts = prompt_registry.select_all(user_input.user_id)
+            cache_namespace = get_cache_namespace(strategy, prompts)
+            context = await load_context(user_input.user_id, user_input.query) if user_input.conversation else ""
+            cacheable = response_cache is not None and not context
+
+            response_dict = None
+            if cacheable:
+                with span("cache_lookup", config.MODEL_NAME) as fields:
+                    response_dict, fields["hit"] = await response_cache.get(user_input.query, cache_namespace)
+                if response_dict is not None:
+                    yield sse_event("token", {"phase": "cache", "section": "casual", "text": response_dict["casual_response"]})
+                    yield sse_event("token", {"phase": "cache", "section": "formal", "text": response_dict["formal_response"]})
+
+            in_flight = single_flight.in_flight(flight_key(user_input.query, cache_namespace)) if response_dict is None and not context else None
+            if in_flight is not None:
+                try:
+                    response_dict = await single_flight.follow(in_flight)
+                    yield sse_event("token", {"phase": "shared", "section": "casual", "text": response_dict["casual_response"]})
+                    yield sse_event("token", {"phase": "shared", "section": "formal", "text": response_dict["formal_response"]})
+                except leader_errors():
+                    response_dict = None
+
+            if response_dict is None:
+                start = time.perf_counter()
+                usage = TokenUsage()
+                with span("build_prompt", config.MODEL_NAME, template=prompts["draft"].id):
+                    prompt = prompts["draft"].render(query=user_input.query, context=context, length=output_budget.instruction())
+                async for item in stream_model(user_input.groq_api_key, prompt, "draft", usage):
+                    if isinstance(item, tuple):
+                        raw, = item
+                    else:
+                        yield item
+
+                try:
+                    response_dict = await parse_output(raw)
+                    needs_refine = strategy == "refine" or (strategy == "refine-if-invalid" and not is_complete_response(response_dict))
+                except ValueError:
+                    if strategy == "single":
+                        raise
+                    needs_refine = True
+
+                if needs_refine:
+                    yield sse_event("reset", {"phase": "refine"})
+                    prompt = prompts["refine"].render(input_json=refine_input(raw, response_dict), length=output_budget.instruction())
+                    async for item in stream_model(user_input.groq_api_key, prompt, "refine", usage):
+                        if isinstance(item, tuple):
+                            refined_raw, = item
+                        else:
+                            yield item
+                    response_dict = await parse_output(refined_raw)
+
+                record_usage(strategy, time.perf_counter() - start, usage)
+                PROMPT_GENERATIONS.inc(version=prompt_version(prompts, strategy))
+                if cacheable and is_complete_response(response_dict) and not usage.final_truncated:
+                    await response_cache.set(user_input.query, cache_namespace, response_dict)
+
+            await persist_entry(user_input.user_id, user_input.query, response_dict, prompt_version(prompts, strategy))
+            yield sse_event("done", {"output": response_dict})
+
+        except groq.AuthenticationError:
+            discard_clients(user_input.groq_api_key)
+            yield sse_event("error", {"status": 401, "detail": "Invalid Groq API Key. Please check and try again."})
+
+        except groq.RateLimitError as e:
+            yield sse_event("error", {"status": 429, "detail": "Groq rate limit reached for this API key. Please retry shortly.",
+                                      "retry_after": upstream_retry_after(e)})
+
+        except Exception as e:
+            yield sse_event("error", {"status": 500, "detail": f"Unexpected error: {str(e)}"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Batch items on one API key share a concurrency cap and pacing, however many batches are running.
+batch_pacer = KeyedPacer(config.BATCH_CONCURRENCY, config.BATCH_RATE_LIMIT)
+
+
+@app.post("/generate/batch")
+async def generate_batch(batch: BatchInput):
+    """
+    Generates responses for many queries in one request.
+
+    Items are fanned out to the model with at most `BATCH_CONCURRENCY` in flight
+    and started no faster than `BATCH_RATE_LIMIT` per second, across all
+    batches on the same API key (on top of the global `LLM_CONCURRENCY` cap).
+    Every item takes a rate-limit token; items after the first wait for their
+    buckets to refill. Each item succeeds or fails independently;
+    all successful items are saved with a single bulk insert once the batch
+    finishes, or once it is cut short (e.g. the client disconnects), in which
+    case the items finished so far are saved.
+
+    Args:
+        batch (BatchInput): `user_id`, `queries`, `groq_api_key`, optional `strategy`
+            and `stream`.
+
+    Returns:
+        dict: `"output"`, a list of `{"index", "query", "status", "output" | "error"}`
+            in input order, and `"persisted"`, the number of records saved.
+        With `stream=true`, the same items are sent as NDJSON lines in completion
+        order, followed by a final `{"persisted": n}` line.
+
+    Raises:
+        HTTPException: 
+            - 422 if more than `BATCH_MAX_QUERIES` queries are sent.
+            - 429 with `Retry-After` if the key or user is already over its
+              rate limit when the batch arrives.
+    """
+
+    if len(batch.queries) > config.BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=422, detail=f"At most {config.BATCH_MAX_QUERIES} queries per batch")
+    await enforce_rate_limits(batch.groq_api_key, batch.user_id)
+
+    strategy = batch.strategy or config.GENERATION_STRATEGY
+    prompts = prompt_registry.select_all(batch.user_id)
+    pacing_key = hashlib.sha256(batch.groq_api_key.encode()).hexdigest()
+
+    async def run_item(index: int, query: str) -> dict:
+        async with batch_pacer.slot(pacing_key):
+            try:
+                if index:
+                    # The first item's token was taken by enforce_rate_limits
+                    await wait_for_rate_limits(batch.groq_api_key, batch.user_id)
+                response_dict = await generate_response(batch.groq_api_key, query, strategy, prompts)
+                return {"index": index, "query": query, "status": "ok", "output": response_dict}
+            except groq.AuthenticationError:
+                discard_clients(batch.groq_api_key)
+                return {"index": index, "query": query, "status": "error", "error": "Invalid Groq API Key. Please check and try again."}
+            except groq.RateLimitError as e:
+                return {"index": index, "query": query, "status": "error", "error": f"Groq rate limit reached; retry after {upstream_retry_after(e)}s"}
+            except Exception as e:
+                return {"index": index, "query": query, "status": "error", "error": f"Unexpected error: {str(e)}"}
+
+    async def persist(results) -> int:
+        entries = [
+            {"query": r["query"], "casual_response": r["output"]["casual_response"], "formal_response": r["output"]["formal_response"],
+             "prompt_version": prompt_version(prompts, strategy)}
+            for r in results if r["status"] == "ok"
+        ]
+        if not entries:
+            return 0
+        with span("persist", config.MODEL_NAME, rows=len(entries)):
+            crud_response = await history_store.add_entries(batch.user_id, entries)
+        if isinstance(crud_response, Exception):
+            logger.warning("history bulk insert failed", extra={"fields": {"error": str(crud_response)}})
+            return 0
+        if isinstance(crud_response, list):
+            search_index.add_rows(crud_response)
+        return len(entries)
+
+    tasks = [asyncio.create_task(run_item(i, q)) for i, q in enumerate(batch.queries)]
+
+    async def persist_finished():
+        # Keep the items that did finish when the batch is cut short; shielded so
+        # a second cancellation cannot drop the insert halfway
+        for task in tasks:
+            task.cancel()
+        finished = [task.result() for task in tasks if task.done() and not task.cancelled()]
+        await asyncio.shield(persist(finished))
+
+    if not batch.stream:
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            await persist_finished()
+            raise
+        return {"output": results, "persisted": await persist(results)}
+
+    async def lines():
+        persisted = None
+        try:
+            results = []
+            for task in asyncio.as_completed(tasks):
+                result = await task
+                results.append(result)
+                yield json.dumps(result) + "\n"
+            persisted = await persist(results)
+            yield json.dumps({"persisted": persisted}) + "\n"
+        finally:
+            if persisted is None:
+                await persist_finished()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+async def run_generation_job(job: dict, api_key: str) -> dict:
+    """Runs a background job through the same generate and persist pipeline as `/generate`."""
+
+    prompts = prompt_registry.select_all(job["user_id"])
+    context = await load_context(job["user_id"], job["query"]) if job["conversation"] else ""
+    try:
+        response_dict = await generate_response(api_key, job["query"], job["strategy"], prompts, context)
+    except groq.AuthenticationError:
+        discard_clients(api_key)
+        raise JobError(401, "Invalid Groq API Key. Please check and try again.")
+    except groq.RateLimitError as e:
+        raise JobError(429, f"Groq rate limit reached; retry after {upstream_retry_after(e)}s")
+
+    await persist_entry(job["user_id"], job["query"], response_dict, prompt_version(prompts, job["strategy"]))
+    return response_dict
+
+
+# Background generation jobs behind POST /jobs; state in JOBS_BACKEND, see utils/jobs.py.
+job_runner = JobRunner(
+    create_job_store(config),
+    run_generation_job,
+    workers=config.JOBS_WORKERS,
+    max_queue=config.JOBS_MAX_QUEUE,
+    timeout=config.JOBS_TIMEOUT,
+    ttl=config.JOBS_TTL,
+    callback_timeout=config.JOBS_CALLBACK_TIMEOUT,
+    callback_retries=config.JOBS_CALLBACK_RETRIES,
+    callback_secret=config.JOBS_CALLBACK_SECRET,
+    callback_hosts=config.JOBS_CALLBACK_HOSTS,
+)
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(job_input: JobInput, response: Response):
+    """
+    Queues a generation in the background and returns at once, for clients that
+    cannot hold a connection open for the whole `/generate` call.
+
+    The job runs the same pipeline as `/generate` (strategy, prompt versions,
+    cache, conversation mode, history row) on a pool of `JOBS_WORKERS` tasks.
+    Poll `GET /jobs/{id}` for its status. If `callback_url` is set, the
+    finished job is also POSTed there as JSON. That body is signed with
+    `JOBS_CALLBACK_SECRET` as an `X-Signature-256` header.
+
+    Args:
+        job_input (JobInput): The `/generate` payload plus an optional `callback_url`.
+
+    Returns:
+        dict: `"output"`, the queued job (`id`, `status`, timestamps); 202 with a `Location` header.
+
+    Raises:
+        HTTPException: 
+            - 400 if `callback_url` is not on `JOBS_CALLBACK_HOSTS`, or (without
+              that list) does not resolve to public addresses only.
+            - 429 with `Retry-After` if the key or user is over its rate limit.
+            - 503 with `Retry-After` if `JOBS_MAX_QUEUE` jobs are already waiting.
+    """
+
+    await enforce_rate_limits(job_input.groq_api_key, job_input.user_id)
+    try:
+        job = await job_runner.submit(
+            job_input.user_id, job_input.query, job_input.strategy or config.GENERATION_STRATEGY, job_input.groq_api_key,
+            job_input.conversation, str(job_input.callback_url) if job_input.callback_url else None,
+        )
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail="Too many queued jobs. Please retry shortly.",
+                            headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+    response.headers["Location"] = f"/jobs/{job['id']}"
+    return {"output": job_view(job)}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, user_id: str):
+    """
+    Returns a background job: `status` (`queued`, `running`, `succeeded` or
+    `failed`), timestamps, and once finished the `output` (as from `/generate`)
+    or an `error` with `status` and `detail`. With a callback, `callback` reports its delivery.
+
+    Raises:
+        HTTPException: 404 if the job does not exist, has expired or belongs to another user.
+    """
+
+    try:
+        job = await job_runner.store.get(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+    if job is None or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"output": job_view(job)}
+
+
+def encode_cursor(row: dict) -> str:
+    """
+    Encodes the `(created_at, id)` keyset position of a history row as an opaque cursor.
+    """
+
+    raw = json.dumps([row["created_at"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def parse_timestamp(value: str, name: str) -> str:
+    """
+    Checks that `value` is an ISO timestamp before it reaches a database
+    filter, where arbitrary text could change the filter itself.
+
+    Raises:
+        ValueError: If `value` is not an ISO timestamp.
+    """
+
+    try:
+        datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name}")
+    return value
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Decodes a cursor produced by `encode_cursor`. Cursors come back from the
+    client, so both parts are validated: an ISO timestamp and an integer id.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+
+    try:
+        created_at, entry_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(entry_id, int) or isinstance(entry_id, bool):
+        raise ValueError("Invalid cursor")
+    return parse_timestamp(created_at, "cursor"), entry_id
+
+
+def parse_fields(fields: Optional[str]) -> tuple:
+    """
+    Parses a comma-separated `fields` projection, validating it against the `prompts` columns.
+
+    Raises:
+        ValueError: If an unknown column is requested.
+    """
+
+    if not fields:
+        return crud.HISTORY_FIELDS
+    requested = tuple(field.strip() for field in fields.split(",") if field.strip())
+    unknown = [field for field in requested if field not in crud.HISTORY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+
 @app.get("/history")
-def history(user_id: str):
+async def history(
+    request: Request,
+    user_id: str,
+    limit: int = Query(config.HISTORY_PAGE_SIZE, ge=1, le=config.HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    since: Optional[str] = None,
+):
+    """
+    Retrieves one page of chat history for a specific user.
+
+    Records are ordered by most recent first and paginated with a keyset cursor on
+    `(created_at, id)`, so deep pages cost the same as the first one. `fields`
+    restricts the returned columns (e.g. `id,query,created_at` for the sidebar);
+    `id` and `created_at` are always included. `since` returns only records
+    created after the given timestamp, for incremental client sync.
+
+    The response carries an `ETag` of its body. A request whose `If-None-Match`
+    matches it gets an empty 304, so polling an unchanged history costs no payload.
+
+    Args:
+        request (Request): Read for its `If-None-Match` header.
+        user_id (str): The unique identifier for the user.
+        limit (int): Page size.
+        cursor (str, optional): `next_cursor` from the previous page.
+        fields (str, optional): Comma-separated list of columns to return.
+        since (str, optional): ISO timestamp; only newer records are returned.
+
+    Returns:
+        Response: `"output"` with the page of records and `"next_cursor"` (None on the last page),
+            or 304 without a body when the client's copy is current.
+
+    Raises:
+        HTTPException: 
+            - 400 for an invalid cursor or `since` timestamp.
+            - 422 for an unknown field.
+            - 500 if the database query fails.
+    """
+
+    try:
+        columns = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        before = decode_cursor(cursor) if cursor else None
+        since = parse_timestamp(since, "since") if since else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        rows = await history_store.get_history_page(user_id, limit + 1, before, columns, since)
+        if isinstance(rows, Exception):
+            raise rows
+
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        page = FastJSONResponse({'output':rows[:limit], 'next_cursor':next_cursor})
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    tag = etag(page.body)
+    if etag_matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers={"ETag": tag})
+    page.headers["ETag"] = tag
+    return page
+
+
+# Users whose search index is being loaded, so concurrent searches load it once.
+search_loads = {}
+
+
+async def ensure_search_index(user_id: str):
+    """
+    Loads the user's history (up to `SEARCH_MAX_DOCS` records) into the local
+    search index on their first search. Later inserts from this worker are
+    added incrementally; once the index is `SEARCH_INDEX_REFRESH` seconds old,
+    the history is read again and only the records it lacks (e.g. inserts made
+    by other workers) are indexed and embedded.
+
+    Raises:
+        Exception: If the history cannot be read.
+    """
+
+    if search_index.is_loaded(user_id):
+        return
+    lock = search_loads.setdefault(user_id, asyncio.Lock())
+    try:
+        async with lock:
+            if search_index.is_loaded(user_id):
+                return
+            with span("search_load", config.MODEL_NAME) as fields:
+                # Rows flushed while the pages below are read are indexed as well
+                search_index.begin_load(user_id)
+                rows, before = [], None
+                while len(rows) < config.SEARCH_MAX_DOCS:
+                    limit = min(config.HISTORY_MAX_PAGE_SIZE, config.SEARCH_MAX_DOCS - len(rows))
+                    page = await history_store.get_history_page(user_id, limit, before)
+                    if isinstance(page, Exception):
+                        search_index.invalidate(user_id)
+                        raise page
+                    rows.extend(page)
+                    if len(page) < limit:
+                        break
+                    before = (page[-1]["created_at"], page[-1]["id"])
+                # Embedding thousands of records takes seconds; keep it off the event loop
+                await asyncio.to_thread(search_index.load, user_id, rows)
+                fields["rows"] = len(rows)
+    finally:
+        if search_loads.get(user_id) is lock and not lock.locked():
+            del search_loads[user_id]
+
+
+def encode_search_cursor(offset: int) -> str:
+    """
+    Encodes the offset of the next page of search results as an opaque cursor.
+    """
+
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode()
+
+
+def decode_search_cursor(cursor: str) -> int:
+    """
+    Decodes a cursor produced by `encode_search_cursor`.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+
+    try:
+        offset = int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["offset"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if offset < 0:
+        raise ValueError("Invalid cursor")
+    return offset
+
+
+@app.get("/history/search")
+async def search_history(
+    user_id: str,
+    q: str = Query(..., min_length=1, max_length=500),
+    mode: Literal["keyword", "semantic", "hybrid"] = "keyword",
+    limit: int = Query(config.HISTORY_PAGE_SIZE, ge=1, le=config.HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
     """
-    Retrieves chat history for a specific user.
+    Searches a user's chat history.
 
-    This endpoint returns all past queries and responses associated with the given user,
-    ordered by the most recent first.
+    `keyword` mode ranks records by BM25 over the question and both answers;
+    `semantic` ranks by embedding similarity and `hybrid` blends the two
+    (both need `SEARCH_EMBEDDER`). With `SEARCH_BACKEND=database` only keyword
+    search is available; it runs on the storage backend's full-text index
+    (Postgres or SQLite FTS5), newest first, and `total` is not reported.
 
     Args:
         user_id (str): The unique identifier for the user.
+        q (str): Search text.
+        mode (str): `keyword`, `semantic` or `hybrid`.
+        limit (int): Page size.
+        cursor (str, optional): `next_cursor` from the previous page.
+        fields (str, optional): Comma-separated list of columns to return.
 
     Returns:
-        dict: A dictionary containing a list of past chat records under the key `"output"`.
+        dict: `"output"` with the page of records (each with a `"score"` when ranked
+        locally), `"next_cursor"` (None on the last page) and `"total"`.
 
     Raises:
         HTTPException: 
+            - 422 for an invalid cursor, unknown field or unsupported mode.
             - 500 if the database query fails.
     """
 
     try:
-        history = crud.get_history(user_id) 
-        print(history)   
-        return {'output':history}
+        columns = parse_fields(fields)
+        offset = decode_search_cursor(cursor) if cursor else 0
+        if mode != "keyword" and (config.SEARCH_BACKEND != "local" or search_index.embedder is None):
+            raise ValueError(f"Search mode '{mode}' is not enabled")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    try:
+        if config.SEARCH_BACKEND in ("database", "postgres"):
+            with span("search", config.MODEL_NAME, backend="database"):
+                rows = await history_store.search(user_id, q, limit + 1, offset, columns)
+            if isinstance(rows, Exception):
+                raise rows
+            next_cursor = encode_search_cursor(offset + limit) if len(rows) > limit else None
+            return {'output':rows[:limit], 'next_cursor':next_cursor, 'total':None}
 
+        await ensure_search_index(user_id)
+        with span("search", config.MODEL_NAME, backend="local", mode=mode) as span_fields:
+            page, total = search_index.search(user_id, q, mode, limit, offset)
+            span_fields["matches"] = total
+
+        keep = dict.fromkeys(("id", "created_at") + columns)
+        output = [{**{key: row.get(key) for key in keep}, "score": round(score, 4)} for score, row in page]
+        next_cursor = encode_search_cursor(offset + limit) if offset + limit < total else None
+        return {'output':output, 'next_cursor':next_cursor, 'total':total}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/history/{entry_id}")
+async def history_entry(entry_id: int, user_id: str):
+    """
+    Retrieves a single chat record belonging to the user.
+
+    Args:
+        entry_id (int): The record's `id`.
+        user_id (str): The unique identifier for the user.
+
+    Returns:
+        dict: The record under the key `"output"`.
+
+    Raises:
+        HTTPException: 
+            - 404 if the record does not exist for this user.
+            - 500 if the database query fails.
+    """
+
+    entry = await history_store.get_entry(user_id, entry_id)
+    if isinstance(entry, Exception):
+        raise HTTPException(status_code=500, detail=str(entry))
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    return FastJSONResponse({'output':entry})
+
+
+@app.get("/metrics/generation")
+async def generation_metrics():
+    """
+    Returns per-strategy request counts, LLM calls, token usage and latency percentiles.
+    """
+
+    return {"output": strategy_metrics.snapshot()}
+
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    """
+    Returns response cache hit/miss counters.
+    """
+
+    if response_cache is None:
+        return {"output": {"enabled": False}}
+    return {"output": {"enabled": True, **response_cache.snapshot()}}
+
+
+@app.get("/metrics/models")
+async def model_metrics():
+    """
+    Returns model client registry hits, misses, evictions and size.
+    """
+
+    return {"output": model_registry.snapshot()}
+
+
+@app.get("/metrics/routing")
+async def routing_metrics():
+    """
+    Returns each phase's model chain in configuration order, with recent p95
+    latency, sample count, cooldown state and call outcomes per model.
+    """
+
+    return {"output": {"routing": config.MODEL_ROUTING, "order": {phase: [m["name"] for m in model_router.candidates(phase)] for phase in ("draft", "refine")}, **model_router.snapshot()}}
+
+
+@app.get("/metrics/prompts")
+async def prompt_metrics():
+    """
+    Returns the registered prompt template versions (with their fingerprints)
+    and the version selection in effect for each template.
+    """
+
+    return {"output": prompt_registry.snapshot()}
+
+
+@app.get("/metrics/persistence")
+async def persistence_metrics():
+    """
+    Returns write-behind queue depth, flush counts and latency, failures and spooled rows.
+    """
+
+    return {"output": {"write_behind": write_queue.running, **write_queue.snapshot()}}
+
+
+@app.get("/metrics/jobs")
+async def jobs_metrics():
+    """
+    Returns background job counts: queue depth, running, succeeded and failed jobs and callback deliveries.
+    """
+
+    return {"output": {"backend": config.JOBS_BACKEND, **job_runner.snapshot()}}
+
+
+@app.get("/metrics/admission")
+async def admission_metrics():
+    """
+    Returns admission control state: in-flight and queued generate requests, rejections and deadline cut-offs.
+    """
+
+    return {"output": {**admission.snapshot(), "request_deadline": config.REQUEST_DEADLINE}}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Prometheus text exposition: per-stage and per-route latency histograms,
+    token counters and cache/queue/registry gauges.
+    """
+
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def require_profiler():
+    if not config.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@app.post("/debug/profiler/start")
+async def start_profiler(interval: float = Query(0.01, gt=0, le=1)):
+    """
+    Starts the sampling profiler (404 unless `PROFILER_ENABLED` is set).
+    """
+
+    require_profiler()
+    profiler.start(interval)
+    return {"output": {"running": profiler.running}}
+
+
+@app.post("/debug/profiler/stop")
+async def stop_profiler(limit: int = Query(50, ge=1)):
+    """
+    Stops the sampling profiler and returns the most frequent collapsed stacks.
+    """
+
+    require_profiler()
+    await asyncio.to_thread(profiler.stop)
+    return {"output": profiler.report(limit)}
+
+
+@app.get("/debug/profiler")
+async def profiler_report(limit: int = Query(50, ge=1)):
+    """
+    Returns the samples collected so far without stopping the profiler.
+    """
+
+    require_profiler()
+    return {"output": profiler.report(limit)}
+
+
 @app.api_route("/health", methods=["GET", "HEAD"])
-def health(request: Request):
+async def health(request: Request):
     if request.method == "HEAD":
         return Response(status_code=200)
     return {"status": "ok"}
+
+
+@app.api_route("/ready", methods=["GET", "HEAD"])
+async def ready(request: Request):
+    """
+    Readiness check. Unlike `/health`, which answers as soon as the process is
+    up, this returns 503 until the startup warm-up has loaded the model client
+    library and connected the history store (and the write-behind queue is
+    running, when enabled). With `WARMUP_ON_STARTUP=false` dependencies load on
+    first use, so only the queue is checked. Once the worker starts draining
+    for shutdown it reports `draining`, so load balancers stop routing to it.
+
+    Returns:
+        dict: `"status"` (`ready`, `starting`, `draining` or `failed`), the warm-up state and per-dependency `"checks"`.
+    """
+
+    checks = {
+        "model_client": is_loaded("langchain_groq"),
+        "database": history_store.ready,
+        "write_queue": write_queue.running or not config.PERSISTENCE_WRITE_BEHIND,
+    }
+    if readiness["warmup"] == "failed":
+        status = "failed"
+    elif admission.draining:
+        status = "draining"
+    elif checks["write_queue"] and (readiness["warmup"] in ("done", "disabled")):
+        status = "ready"
+    else:
+        status = "starting"
+
+    status_code = 200 if status == "ready" else 503
+    if request.method == "HEAD":
+        return Response(status_code=status_code)
+    body = {"status": status, "warmup": readiness["warmup"], "checks": checks}
+    if readiness["error"]:
+        body["error"] = readiness["error"]
+    return JSONResponse(body, status_code=status_code)
@@ -0,0 +1,121 @@
+"""
+benchmarks/bench_async_generate.py
+
+Compares concurrent `/generate` throughput of the original thread-bound
+pipeline (sync endpoint, `model.invoke`, blocking insert) against the async
+pipeline in `backend.py` (`ainvoke`, awaited insert, bounded concurrency).
+
+Both variants talk to the same local stub LLM over HTTP; persistence is
+replaced by an in-process sleep of the same duration so no database is needed.
+
+Usage:
+    python benchmarks/bench_async_generate.py --requests 200 --concurrency 100 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx
+from fastapi import FastAPI
+from langchain_groq import ChatGroq
+
+from benchmarks.stub_llm import StubLLMServer
+
+
+DB_LATENCY = 0.02
+
+
+def build_legacy_app() -> FastAPI:
+    """Recreates the pre-async endpoint: a sync `def` holding a worker thread per request."""
+    from utils.parsing import extract_json
+    from utils.prompts import build_prompt, build_refine_prompt
+    from db import crud
+
+    legacy = FastAPI()
+
+    @legacy.post("/generate")
+    def generate(user_input: dict):
+        model = ChatGroq(model_name="Gemma2-9b-It", api_key=user_input["groq_api_key"])
+        initial_response = model.invoke(build_prompt(user_input["query"]))
+        refined_response = model.invoke(build_refine_prompt(initial_response.content))
+        response_dict = extract_json(refined_response.content)
+        crud.add_entry(user_input["user_id"], user_input["query"], response_dict["casual_response"], response_dict["formal_response"])
+        return {"output": response_dict}
+
+    return legacy
+
+
+async def drive(app, total: int, concurrency: int) -> dict:
+    payload = {"user_id": "bench", "query": "Explain blockchain", "groq_api_key": "stub-key"}
+    gate = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120) as client:
+        async def one():
+            nonlocal errors
+            async with gate:
+                start = time.perf_counter()
+                response = await client.post("/generate", json=payload)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(total)])
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "throughput": total / elapsed,
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.5, help="stub LLM latency per call in seconds")
+    args = parser.parse_args()
+
+    def blocking_insert(*args, **kwargs):
+        time.sleep(DB_LATENCY)
+        return True
+
+    async def async_insert(*args, **kwargs):
+        await asyncio.sleep(DB_LATENCY)
+        return True
+
+    with StubLLMServer(latency=args.latency) as server:
+        os.environ["GROQ_BASE_URL"] = server.url
+        os.environ["LLM_CONCURRENCY"] = str(args.concurrency)
+        # Every request sends the same query from one key; measure the model path, not caching,
+        # coalescing or rate limiting
+        for setting in ("CACHE_ENABLED", "SINGLE_FLIGHT_ENABLED"):
+            os.environ[setting] = "false"
+        for setting in ("RATE_LIMIT_PER_KEY", "RATE_LIMIT_PER_USER"):
+            os.environ[setting] = "0"
+        import backend
+
+        with patch("db.crud.add_entry", new=blocking_insert), patch("db.crud.add_entry_async", new=async_insert):
+            results = {
+                "sync (before)": asyncio.run(drive(build_legacy_app(), args.requests, args.concurrency)),
+                "async (after)": asyncio.run(drive(backend.app, args.requests, args.concurrency)),
+            }
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, stub latency {args.latency}s x2 calls")
+    print(f"{'variant':<16}{'req/s':>10}{'p50 (s)':>10}{'p95 (s)':>10}{'errors':>8}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['throughput']:>10.1f}{r['p50']:>10.2f}{r['p95']:>10.2f}{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+benchmarks/bench_cold_start.py
+
+Measures cold start of the backend as a scale-to-zero host sees it: a fresh
+`uvicorn backend:app` process is launched and polled until `/health` answers
+(time to live) and until `/ready` answers 200 (time until the startup warm-up
+has loaded the model client library and the database client). The import time
+of `backend` alone, from `python -X importtime`, is reported too.
+
+Usage:
+    python benchmarks/bench_cold_start.py --runs 5
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def import_time_ms() -> float:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend"], cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    for line in result.stderr.splitlines():
+        if line.rstrip().endswith("| backend"):
+            return int(line.split("|")[1]) / 1000
+    raise RuntimeError("backend not found in -X importtime output")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, deadline: float) -> float:
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url, timeout=0.5).status_code == 200:
+                return time.perf_counter()
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(url)
+
+
+def cold_start(timeout: float) -> tuple:
+    port = free_port()
+    env = {**os.environ, "LOG_LEVEL": "WARNING", "PERSISTENCE_WRITE_BEHIND": "false"}
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        live = wait_for(f"http://127.0.0.1:{port}/health", start + timeout)
+        ready = wait_for(f"http://127.0.0.1:{port}/ready", start + timeout)
+        return live - start, ready - start
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    imports = [import_time_ms() for _ in range(args.runs)]
+    starts = [cold_start(args.timeout) for _ in range(args.runs)]
+
+    print(f"{args.runs} runs (median)")
+    print(f"import backend:        {statistics.median(imports):8.0f} ms")
+    print(f"process to /health:    {statistics.median(s[0] for s in starts) * 1000:8.0f} ms")
+    print(f"process to /ready:     {statistics.median(s[1] for s in starts) * 1000:8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
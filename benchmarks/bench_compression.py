@@ -0,0 +1,98 @@
+"""
+benchmarks/bench_compression.py
+
+Measures `/history` bytes on the wire and serialization time against page size.
+
+For each page size it reports the time to render the page, the body size with
+each content coding and the time to compress it. Rendering is timed two ways:
+FastAPI's default path (`jsonable_encoder` then `json.dumps` in `JSONResponse`)
+and `FastJSONResponse` (orjson when installed). The body is what the endpoint
+sends with no `Content-Encoding`. Compressed sizes are the `CompressionMiddleware`
+output for that body; codings whose library is missing are left out. A
+revalidation answered 304 sends no body.
+
+Rows are generated from a fixed vocabulary, so they compress roughly like real
+prose rather than like repeated filler text.
+
+Usage:
+    python benchmarks/bench_compression.py --sizes 10 50 200
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from utils.compression import available_encoders
+from utils.responses import FastJSONResponse
+
+
+WORDS = (
+    "the a of to and in is that for it as with on be this by are or from an at which model answer question data "
+    "system learning time example user value network process result language research energy change human world "
+    "different important however because between through during without within general specific approach method "
+    "information structure function support problem solution quantum climate economy history science technology"
+).split()
+
+
+def make_rows(count: int, response_chars: int = 1500, seed: int = 0) -> list:
+    rng = random.Random(seed)
+
+    def prose(chars):
+        text = []
+        while sum(len(word) + 1 for word in text) < chars:
+            text.append(rng.choice(WORDS))
+        return " ".join(text).capitalize() + "."
+
+    return [
+        {
+            "id": count - i,
+            "user_id": "bench",
+            "query": prose(60),
+            "casual_response": prose(response_chars // 3),
+            "formal_response": prose(response_chars),
+            "prompt_version": "draft=1,refine=1",
+            "created_at": f"2025-01-{1 + i // 1440 % 28:02d}T{i // 60 % 24:02d}:{i % 60:02d}:00.123456+00:00",
+        }
+        for i in range(count)
+    ]
+
+
+def timed(fn, repeats: int) -> tuple:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    encoders = available_encoders()
+    print(f"{'rows':>5}  {'stdlib render':>14}  {'fast render':>12}  {'identity':>10}"
+          + "".join(f"  {name + ' (time)':>22}" for name in encoders))
+    for size in args.sizes:
+        page = {"output": make_rows(size), "next_cursor": None}
+        _, stdlib_time = timed(lambda: JSONResponse(jsonable_encoder(page)).body, args.repeats)
+        body, fast_time = timed(lambda: FastJSONResponse(page).body, args.repeats)
+
+        cells = []
+        for encode in encoders.values():
+            compressed, encode_time = timed(lambda: encode(body), args.repeats)
+            cells.append(f"{len(compressed) / 1024:>8.1f} KiB ({encode_time * 1000:>6.2f} ms)")
+        print(f"{size:>5}  {stdlib_time * 1000:>11.3f} ms  {fast_time * 1000:>9.3f} ms  {len(body) / 1024:>6.1f} KiB"
+              + "".join(f"  {cell:>22}" for cell in cells))
+    print("A 304 revalidation of an unchanged page sends 0 bytes of body.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+benchmarks/bench_history_pagination.py
+
+Measures `/history` payload size and latency against history length, comparing
+the full record (what the old unpaginated endpoint returned per row, for every
+row) with a paginated page and the sidebar projection (`id,query,created_at`).
+
+The "full history" column walks every page at the maximum page size, which
+transfers the same rows the old `select("*")` endpoint returned in one body.
+
+Usage:
+    python benchmarks/bench_history_pagination.py --sizes 100 1000 5000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx
+
+from benchmarks.fake_supabase import FakeAsyncSupabase
+
+
+async def fetch(client, url: str, all_pages: bool) -> int:
+    """Fetches `url` (and, if `all_pages`, every following page); returns total bytes received."""
+    total, cursor = 0, None
+    while True:
+        response = await client.get(url + (f"&cursor={cursor}" if cursor else ""))
+        response.raise_for_status()
+        total += len(response.content)
+        cursor = response.json()["next_cursor"]
+        if cursor is None or not all_pages:
+            return total
+
+
+async def measure(client, url: str, all_pages: bool, repeats: int) -> tuple:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        size_bytes = await fetch(client, url, all_pages)
+    return size_bytes, (time.perf_counter() - start) / repeats
+
+
+async def run(sizes, repeats: int):
+    import backend
+    import config
+
+    # name -> (url, walk every page)
+    variants = {
+        "full history": (f"/history?user_id=bench&limit={config.HISTORY_MAX_PAGE_SIZE}", True),
+        "page of 50": ("/history?user_id=bench&limit=50", False),
+        "sidebar page": ("/history?user_id=bench&limit=50&fields=id,query,created_at", False),
+    }
+
+    print(f"{'rows':>6}  " + "".join(f"{name:>26}" for name in variants))
+    for size in sizes:
+        fake = FakeAsyncSupabase()
+        fake.seed("bench", size)
+        cells = []
+        with patch("db.crud.get_async_supabase", new=fake.get_client):
+            transport = httpx.ASGITransport(app=backend.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for url, all_pages in variants.values():
+                    size_bytes, latency = await measure(client, url, all_pages, repeats)
+                    cells.append(f"{size_bytes / 1024:>10.1f} KiB {latency * 1000:>8.2f} ms")
+        print(f"{size:>6}  " + "".join(f"{cell:>26}" for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.repeats))
+
+
+if __name__ == "__main__":
+    main()
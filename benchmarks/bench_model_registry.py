@@ -0,0 +1,79 @@
+"""
+benchmarks/bench_model_registry.py
+
+Measures per-request overhead of building a new `ChatGroq` client for every
+request versus reusing one from `ModelRegistry`, with calls going to the local
+stub LLM (zero artificial latency, so the numbers are client overhead plus a
+loopback round trip).
+
+Usage:
+    python benchmarks/bench_model_registry.py --requests 200 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from langchain_groq import ChatGroq
+
+from benchmarks.stub_llm import StubLLMServer
+from utils.models import ModelRegistry
+
+
+MODEL = "Gemma2-9b-It"
+
+
+async def run(get_model, total: int, concurrency: int) -> dict:
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with gate:
+            start = time.perf_counter()
+            model = get_model(f"stub-key-{i % 4}")
+            await model.ainvoke("Explain blockchain")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(total)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "throughput": total / elapsed,
+        "mean_ms": 1000 * sum(latencies) / len(latencies),
+        "p95_ms": 1000 * latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    registry = ModelRegistry()
+    variants = {
+        "new client per request": lambda api_key: ChatGroq(model_name=MODEL, api_key=api_key),
+        "ModelRegistry": lambda api_key: registry.get(api_key, MODEL),
+    }
+
+    with StubLLMServer(latency=0) as server:
+        os.environ["GROQ_BASE_URL"] = server.url
+
+        async def run_all():
+            return {name: await run(get_model, args.requests, args.concurrency) for name, get_model in variants.items()}
+
+        results = asyncio.run(run_all())
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, 4 distinct API keys")
+    print(f"{'variant':<24}{'req/s':>10}{'mean (ms)':>12}{'p95 (ms)':>12}")
+    for name, r in results.items():
+        print(f"{name:<24}{r['throughput']:>10.1f}{r['mean_ms']:>12.1f}{r['p95_ms']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
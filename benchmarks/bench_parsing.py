@@ -0,0 +1,70 @@
+"""
+benchmarks/bench_parsing.py
+
+Micro-benchmark of model-output parsing: the original regex + `json.loads`
+extractor versus `utils.parsing.parse_model_output`, over the malformed-output
+corpus in `tests/malformed_outputs.json`. Reports how many corpus entries each
+parser recovers and the mean time per call on clean and malformed inputs.
+
+Usage:
+    python benchmarks/bench_parsing.py --number 2000
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.parsing import parse_model_output
+
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "..", "tests", "malformed_outputs.json")
+
+
+def legacy_extract_json(text: str) -> dict:
+    try:
+        cleaned = re.sub(r"^```json|```$", "", text.strip(), flags=re.MULTILINE).strip()
+        return json.loads(cleaned)
+    except json.JSONDecodeError:
+        raise ValueError("Invalid JSON response from model")
+
+
+def recovered(parse, case) -> bool:
+    try:
+        result = parse(case["raw"])
+    except ValueError:
+        return case["expected"] is None
+    return case["expected"] is not None and {k: result.get(k) for k in case["expected"]} == case["expected"]
+
+
+def mean_us(parse, inputs, number: int) -> float:
+    def run():
+        for text in inputs:
+            try:
+                parse(text)
+            except ValueError:
+                pass
+    return timeit.timeit(run, number=number) / (number * len(inputs)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = json.load(open(CORPUS_PATH, encoding="utf-8"))
+    clean = [case["raw"] for case in corpus if case["name"] in ("clean", "code_fence")]
+    malformed = [case["raw"] for case in corpus if case["name"] not in ("clean", "code_fence")]
+
+    print(f"{'parser':<22}{'recovered':>12}{'clean (us)':>14}{'malformed (us)':>16}")
+    for name, parse in [("legacy regex+loads", legacy_extract_json), ("parse_model_output", parse_model_output)]:
+        ok = sum(recovered(parse, case) for case in corpus)
+        print(f"{name:<22}{f'{ok}/{len(corpus)}':>12}{mean_us(parse, clean, args.number):>14.1f}{mean_us(parse, malformed, args.number):>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
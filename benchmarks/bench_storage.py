@@ -0,0 +1,116 @@
+"""
+benchmarks/bench_storage.py
+
+Compares the history storage backends (`db/storage.py`) on the operations
+the backend performs: single inserts, a page of history (full rows and the
+sidebar projection), a deep page via the keyset cursor, and lookup by id.
+
+The Supabase store runs against the in-memory fake with `--db-latency`
+seconds of simulated round trip per query (a same-region Supabase call is
+typically 10-40 ms); the SQLite store runs against a real database file in
+WAL mode. Operations are issued from `--concurrency` tasks at once.
+
+Usage:
+    python benchmarks/bench_storage.py --rows 5000 --ops 500 --concurrency 20 --db-latency 0.02
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fake_supabase import FakeAsyncSupabase
+from db.sqlite_store import SQLiteHistoryStore
+from db.storage import SupabaseHistoryStore
+
+
+SIDEBAR = ("id", "query", "created_at")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def timed(operation, ops: int, concurrency: int) -> dict:
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with gate:
+            start = time.perf_counter()
+            result = await operation(i)
+            latencies.append(time.perf_counter() - start)
+            if isinstance(result, Exception):
+                raise result
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(ops)])
+    elapsed = time.perf_counter() - start
+    return {"throughput": ops / elapsed, "p50_ms": percentile(latencies, 0.5) * 1000, "p95_ms": percentile(latencies, 0.95) * 1000}
+
+
+async def seed(store, rows: int):
+    body = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 30)[:1500]
+    for start in range(0, rows, 500):
+        await store.add_entries("bench", [
+            {"query": f"Explain topic number {i}", "casual_response": body[:500], "formal_response": body}
+            for i in range(start, min(rows, start + 500))
+        ])
+
+
+async def run_store(store, args) -> dict:
+    await store.connect()
+    await seed(store, args.rows)
+    deep = (await store.get_history_page("bench", args.rows // 2, fields=SIDEBAR))[-1]
+    before = (deep["created_at"], deep["id"])
+
+    operations = {
+        "insert": lambda i: store.add_entry(f"user{i % 50}", f"Question {i}", "casual", "formal"),
+        "page (full rows)": lambda i: store.get_history_page("bench", 50),
+        "page (sidebar)": lambda i: store.get_history_page("bench", 50, fields=SIDEBAR),
+        "deep page": lambda i: store.get_history_page("bench", 50, before, SIDEBAR),
+        "get by id": lambda i: store.get_entry("bench", 1 + i % args.rows),
+    }
+    return {name: await timed(operation, args.ops, args.concurrency) for name, operation in operations.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--ops", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--pool-size", type=int, default=4)
+    args = parser.parse_args()
+
+    fake = FakeAsyncSupabase(latency=args.db_latency)
+    with patch("db.crud.get_async_supabase", new=fake.get_client):
+        supabase_results = asyncio.run(run_store(SupabaseHistoryStore(), args))
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteHistoryStore(os.path.join(directory, "history.db"), args.pool_size)
+
+        async def sqlite_run():
+            try:
+                return await run_store(store, args)
+            finally:
+                await store.close()
+
+        sqlite_results = asyncio.run(sqlite_run())
+
+    print(f"{args.rows} rows, {args.ops} ops per operation, concurrency {args.concurrency}, "
+          f"Supabase round trip {args.db_latency * 1000:.0f} ms (simulated), SQLite pool {args.pool_size}")
+    print(f"{'operation':<18}{'supabase req/s':>16}{'p95 (ms)':>10}{'sqlite req/s':>14}{'p95 (ms)':>10}")
+    for name in supabase_results:
+        remote, local = supabase_results[name], sqlite_results[name]
+        print(f"{name:<18}{remote['throughput']:>16.0f}{remote['p95_ms']:>10.1f}{local['throughput']:>14.0f}{local['p95_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+benchmarks/fake_supabase.py
+
+In-memory stand-in for the async Supabase client, covering the query builder
+calls made by `db/crud.py` against the `prompts` table. Used by benchmarks to
+measure backend behaviour without a network database.
+
+Usage:
+    fake = FakeAsyncSupabase()
+    fake.seed("bench", 1000)
+    with patch("db.crud.get_async_supabase", new=fake.get_client):
+        ...
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+import itertools
+import re
+
+
+_KEYSET = re.compile(r'created_at\.lt\."(?P<ts>[^"]+)",and\(created_at\.eq\."(?P=ts)",id\.lt\.(?P<id>\d+)\)')
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    def __init__(self, table, latency):
+        self._table = table
+        self._latency = latency
+        self._columns = None
+        self._filters = []
+        self._orders = []
+        self._limit = None
+        self._insert = None
+
+    def select(self, columns="*"):
+        self._columns = None if columns == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def insert(self, rows):
+        self._insert = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def eq(self, column, value):
+        self._filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gt(self, column, value):
+        self._filters.append(lambda row: row.get(column) > value)
+        return self
+
+    def or_(self, expression):
+        match = _KEYSET.fullmatch(expression)
+        if match is None:
+            raise NotImplementedError(f"Unsupported or_ filter: {expression}")
+        ts, entry_id = match["ts"], int(match["id"])
+        self._filters.append(lambda row: (row["created_at"], row["id"]) < (ts, entry_id))
+        return self
+
+    def order(self, column, desc=False):
+        self._orders.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    async def execute(self):
+        if self._latency:
+            await asyncio.sleep(self._latency)
+
+        if self._insert is not None:
+            inserted = [self._table.add(row) for row in self._insert]
+            return _Result(inserted)
+
+        rows = [row for row in self._table.rows if all(f(row) for f in self._filters)]
+        for column, desc in reversed(self._orders):
+            rows.sort(key=lambda row: row[column], reverse=desc)
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        if self._columns is not None:
+            rows = [{c: row.get(c) for c in self._columns} for row in rows]
+        else:
+            rows = [dict(row) for row in rows]
+        return _Result(rows)
+
+
+class FakeTable:
+    def __init__(self):
+        self.rows = []
+        self._ids = itertools.count(1)
+
+    def add(self, row):
+        row = dict(row)
+        row.setdefault("id", next(self._ids))
+        row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+        self.rows.append(row)
+        return row
+
+
+class FakeAsyncSupabase:
+    """
+    Minimal async Supabase client holding tables in memory.
+
+    Args:
+        latency (float): Simulated round-trip time added to every `execute()`.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables = {}
+
+    def table(self, name):
+        return FakeQuery(self.tables.setdefault(name, FakeTable()), self.latency)
+
+    async def get_client(self):
+        return self
+
+    def seed(self, user_id: str, count: int, response_chars: int = 1500):
+        """Inserts `count` realistic-sized records for `user_id`, one minute apart."""
+        table = self.tables.setdefault("prompts", FakeTable())
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        body = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * (response_chars // 56 + 1))[:response_chars]
+        for i in range(count):
+            table.add({
+                "user_id": user_id,
+                "query": f"Explain topic number {i}",
+                "casual_response": body[: response_chars // 3],
+                "formal_response": body,
+                "created_at": (start + timedelta(minutes=i)).isoformat(),
+            })
@@ -0,0 +1,171 @@
+"""
+benchmarks/load_test.py
+
+Offline end-to-end load test of the backend.
+
+The FastAPI app runs in-process (including its lifespan, so the write-behind
+queue is active). `ChatGroq` talks to the local stub LLM over HTTP and the
+Supabase `prompts` table is replaced by the in-memory fake. Workers drive a
+mix of `/generate` and `/history` requests at the target concurrency and the
+run reports latency percentiles, throughput and error rate per endpoint.
+
+Pass `--json` to write machine-readable results, and `--max-p95` /
+`--max-error-rate` to exit non-zero when a run regresses past a threshold.
+
+Usage:
+    python benchmarks/load_test.py --concurrency 50 --duration 20 --stub-latency 0.5
+    python benchmarks/load_test.py --unique-queries --error-rate 0.05 --max-error-rate 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx
+
+from benchmarks.fake_supabase import FakeAsyncSupabase
+from benchmarks.stub_llm import StubLLMServer
+
+
+TOPICS = [
+    "Explain blockchain", "Explain quantum computing", "What is machine learning",
+    "How does TCP work", "Explain photosynthesis", "What is inflation",
+    "Explain black holes", "How do vaccines work", "What is a compiler", "Explain DNS",
+]
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    """`samples` is a list of (endpoint, latency, ok)."""
+    report = {}
+    for endpoint in sorted({s[0] for s in samples}):
+        latencies = sorted(s[1] for s in samples if s[0] == endpoint)
+        errors = sum(1 for s in samples if s[0] == endpoint and not s[2])
+        report[endpoint] = {
+            "requests": len(latencies),
+            "throughput": len(latencies) / elapsed,
+            "error_rate": errors / len(latencies),
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        }
+    return report
+
+
+async def drive(app, args) -> tuple:
+    rng = random.Random(args.seed)
+    samples = []
+    counter = 0
+    deadline = time.monotonic() + args.duration
+
+    def next_request():
+        nonlocal counter
+        counter += 1
+        user_id = f"user{rng.randrange(args.users)}"
+        if rng.random() < args.generate_ratio:
+            query = f"{rng.choice(TOPICS)} #{counter}" if args.unique_queries else rng.choice(TOPICS)
+            return "/generate", ("POST", "/generate", {"json": {"user_id": user_id, "query": query, "groq_api_key": "stub-key"}})
+        return "/history", ("GET", "/history", {"params": {"user_id": user_id, "limit": 50, "fields": "id,query,created_at"}})
+
+    async def worker(client):
+        while time.monotonic() < deadline and (not args.requests or counter < args.requests):
+            endpoint, (method, url, kwargs) = next_request()
+            start = time.perf_counter()
+            backoff = 0
+            try:
+                response = await client.request(method, url, **kwargs)
+                ok = response.status_code < 400
+                if response.status_code == 503:
+                    # Shed by admission control; back off as a well-behaved client would
+                    backoff = float(response.headers.get("retry-after", 1))
+            except httpx.HTTPError:
+                ok = False
+            samples.append((endpoint, time.perf_counter() - start, ok))
+            if backoff:
+                await asyncio.sleep(min(backoff, max(0, deadline - time.monotonic())))
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=args.timeout) as client:
+            # Measure steady state, as behind a readiness probe, not the startup warm-up
+            while (await client.get("/ready")).json()["status"] == "starting" and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            start = time.perf_counter()
+            await asyncio.gather(*[worker(client) for _ in range(args.concurrency)])
+            elapsed = time.perf_counter() - start
+
+    return samples, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 = run for --duration)")
+    parser.add_argument("--generate-ratio", type=float, default=0.7, help="fraction of requests that are /generate")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--unique-queries", action="store_true", help="make every query unique so the response cache never hits")
+    parser.add_argument("--stub-latency", type=float, default=0.3)
+    parser.add_argument("--token-rate", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--db-latency", type=float, default=0.02, help="simulated Supabase round trip")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--rate-limits", action="store_true", help="keep the per-key/per-user rate limits from the environment")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--max-p95", type=float, help="fail if any endpoint's p95 (s) exceeds this")
+    parser.add_argument("--max-error-rate", type=float, help="fail if any endpoint's error rate exceeds this")
+    args = parser.parse_args()
+
+    fake = FakeAsyncSupabase(latency=args.db_latency)
+    for user in range(args.users):
+        fake.seed(f"user{user}", 100)
+
+    with StubLLMServer(args.stub_latency, args.token_rate, args.error_rate, args.error_status) as server:
+        os.environ["GROQ_BASE_URL"] = server.url
+        os.environ.setdefault("LOG_LEVEL", "WARNING")  # per-span logs would dominate the run
+        if not args.rate_limits:
+            # All simulated users share one stub key, which the per-key limit would throttle
+            os.environ["RATE_LIMIT_PER_KEY"] = os.environ["RATE_LIMIT_PER_USER"] = "0"
+        import backend
+
+        with patch("db.crud.get_async_supabase", new=fake.get_client):
+            samples, elapsed = asyncio.run(drive(backend.app, args))
+
+    report = summarize(samples, elapsed)
+    total_errors = sum(1 for s in samples if not s[2])
+    print(f"{len(samples)} requests in {elapsed:.1f}s at concurrency {args.concurrency} "
+          f"({len(samples) / elapsed:.1f} req/s, error rate {total_errors / max(len(samples), 1):.2%})")
+    print(f"{'endpoint':<12}{'requests':>10}{'req/s':>9}{'errors':>9}{'p50 (s)':>10}{'p95 (s)':>10}{'p99 (s)':>10}")
+    for endpoint, r in report.items():
+        print(f"{endpoint:<12}{r['requests']:>10}{r['throughput']:>9.1f}{r['error_rate']:>9.2%}{r['p50']:>10.3f}{r['p95']:>10.3f}{r['p99']:>10.3f}")
+
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump({"args": vars(args), "elapsed": elapsed, "endpoints": report}, out, indent=2)
+
+    failed = [
+        endpoint for endpoint, r in report.items()
+        if (args.max_p95 is not None and r["p95"] > args.max_p95)
+        or (args.max_error_rate is not None and r["error_rate"] > args.max_error_rate)
+    ]
+    if failed:
+        print(f"Regression thresholds exceeded for: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+benchmarks/stub_llm.py
+
+A local stand-in for the Groq (OpenAI-compatible) chat completions API, used
+by the benchmarks and load tests so they run offline against a controlled
+upstream.
+
+Behaviour is configurable:
+    latency      Seconds before the first token (time to first token)
+    token_rate   Completion tokens per second after the first (0 = instant)
+    error_rate   Fraction of requests answered with `error_status` instead
+    error_status HTTP status used for injected errors (429 adds Retry-After)
+
+Requests whose bearer token is "invalid-key" get a 401, like a bad Groq key.
+A request's `max_tokens` cuts the completion short with `finish_reason: "length"`.
+Both plain and streaming (`"stream": true`, SSE) completions are supported.
+
+The Groq SDK honours the `GROQ_BASE_URL` environment variable, so pointing it
+at `StubLLMServer.url` routes every `ChatGroq` call here.
+
+Run standalone:
+    python benchmarks/stub_llm.py --port 8900 --latency 0.3 --token-rate 200 --error-rate 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+STUB_CONTENT = json.dumps({
+    "casual_response": "Blockchain is a shared notebook nobody can secretly erase.",
+    "formal_response": "A blockchain is an append-only, cryptographically linked ledger replicated across peers."
+})
+
+# Roughly four characters per token, like the real tokenizer on English text
+STUB_TOKENS = [STUB_CONTENT[i:i + 4] for i in range(0, len(STUB_CONTENT), 4)]
+
+
+def create_stub_app(latency: float = 0.5, token_rate: float = 0, error_rate: float = 0, error_status: int = 500, seed: int = None) -> FastAPI:
+    """
+    Builds the stub FastAPI app serving `/openai/v1/chat/completions`.
+    """
+
+    stub = FastAPI()
+    rng = random.Random(seed)
+    stub.state.requests = 0
+
+    def completion(body: dict) -> tuple:
+        """The completion's tokens, cut at `max_tokens`, and the finish reason."""
+        limit = body.get("max_tokens") or len(STUB_TOKENS)
+        return STUB_TOKENS[:limit], "length" if limit < len(STUB_TOKENS) else "stop"
+
+    def usage(body: dict) -> dict:
+        prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4
+        completion_tokens = len(completion(body)[0])
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+    def chunk(body: dict, delta: dict, finish_reason=None, extra=None) -> str:
+        payload = {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            **(extra or {}),
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    @stub.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stub.state.requests += 1
+
+        if request.headers.get("authorization") == "Bearer invalid-key":
+            return JSONResponse({"error": {"message": "Invalid API Key", "type": "invalid_request_error", "code": "invalid_api_key"}}, status_code=401)
+
+        if error_rate and rng.random() < error_rate:
+            headers = {"retry-after": "1"} if error_status == 429 else {}
+            return JSONResponse({"error": {"message": "Injected stub error", "type": "server_error"}}, status_code=error_status, headers=headers)
+
+        await asyncio.sleep(latency)
+        per_token = 1 / token_rate if token_rate else 0
+        tokens, finish_reason = completion(body)
+
+        if body.get("stream"):
+            async def events():
+                yield chunk(body, {"role": "assistant", "content": ""})
+                for token in tokens:
+                    yield chunk(body, {"content": token})
+                    if per_token:
+                        await asyncio.sleep(per_token)
+                yield chunk(body, {}, finish_reason, {"x_groq": {"usage": usage(body)}})
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        if per_token:
+            await asyncio.sleep(per_token * len(tokens))
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": finish_reason,
+            }],
+            "usage": usage(body),
+        }
+
+    return stub
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class StubLLMServer:
+    """
+    Runs the stub app under uvicorn in a child process, so the stub does not
+    compete with the code under test for the GIL.
+
+    Usage:
+        with StubLLMServer(latency=0.5, token_rate=200) as server:
+            os.environ["GROQ_BASE_URL"] = server.url
+    """
+
+    def __init__(self, latency: float = 0.5, token_rate: float = 0, error_rate: float = 0, error_status: int = 500):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._args = [
+            sys.executable, os.path.abspath(__file__), "--port", str(self.port), "--latency", str(latency),
+            "--token-rate", str(token_rate), "--error-rate", str(error_rate), "--error-status", str(error_status),
+        ]
+        self._process = None
+
+    def __enter__(self):
+        self._process = subprocess.Popen(self._args, stdout=subprocess.DEVNULL)
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.2):
+                    return self
+            except OSError:
+                time.sleep(0.05)
+        self._process.kill()
+        raise RuntimeError("Stub LLM server did not start")
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.wait(timeout=5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the stub Groq-compatible LLM server.")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--token-rate", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=500)
+    args = parser.parse_args()
+    app = create_stub_app(args.latency, args.token_rate, args.error_rate, args.error_status)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
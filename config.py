@@ -0,0 +1,179 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Where chat history is stored (see db/storage.py): "supabase", or "sqlite" for a
+# local database file at SQLITE_PATH, served by a pool of SQLITE_POOL_SIZE connections.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "history.db")
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "4"))
+
+# Upper bound on concurrent upstream LLM calls per worker process. Requests
+# beyond this wait on the event loop instead of occupying worker threads.
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))
+
+# Admission control for /generate, /generate/stream and /generate/batch (see utils/admission.py), per
+# worker process: at most ADMISSION_MAX_IN_FLIGHT requests at once (0 = unlimited),
+# ADMISSION_MAX_QUEUE more waiting up to ADMISSION_QUEUE_TIMEOUT seconds, the rest
+# answered 503 with Retry-After. REQUEST_DEADLINE caps a request's total time in
+# seconds, cancelling its model calls (0 = no deadline); it does not apply to
+# /generate/batch, which is paced by BATCH_RATE_LIMIT instead.
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "90"))
+
+# Response compression (see utils/compression.py): bodies of at least
+# COMPRESSION_MIN_SIZE bytes are compressed with the first coding in
+# COMPRESSION_ENCODINGS the client accepts and whose library is installed
+# ("zstd" needs zstandard, "br" needs brotli). Streamed responses are not compressed.
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_ENCODINGS = tuple(name.strip() for name in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",") if name.strip())
+
+# Production server (serve.py): worker processes, bind address and how long a
+# worker waits for in-flight requests after SIGTERM before shutting down.
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "2"))
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", "8000"))
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))
+# Comma-separated proxy addresses (or "*") whose X-Forwarded-For / X-Forwarded-Proto
+# headers are trusted for the client address; requests from anywhere else keep their
+# socket address, so clients cannot spoof theirs.
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+# Groq model used for generation.
+MODEL_NAME = os.getenv("MODEL_NAME", "Gemma2-9b-It")
+
+# Model routing (see utils/router.py). Fallbacks are tried in order when a model
+# times out, returns 5xx, is rate limited or unavailable; entries are
+# "name[:timeout]". REFINE_MODEL_NAME sends the refine step to a smaller model
+# first. MODEL_ROUTES_FILE (JSON) replaces all of these when set.
+MODEL_FALLBACKS = os.getenv("MODEL_FALLBACKS", "llama-3.1-8b-instant")
+REFINE_MODEL_NAME = os.getenv("REFINE_MODEL_NAME", "")
+MODEL_ROUTES_FILE = os.getenv("MODEL_ROUTES_FILE", "")
+MODEL_TIMEOUT = float(os.getenv("MODEL_TIMEOUT", "30"))
+# "latency" prefers the model with the lowest recent p95; "ordered" keeps the configured order.
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "latency")
+# Seconds a failing model is moved to the back of the chain.
+MODEL_COOLDOWN = float(os.getenv("MODEL_COOLDOWN", "30"))
+
+# Prompt template versions (see utils/prompts.py), as "name=version[:weight],...;...".
+# Several weighted versions split users between them for A/B tests, e.g.
+# "draft=1:50,2:50". Templates not listed use their latest version.
+PROMPT_VERSIONS = os.getenv("PROMPT_VERSIONS", "")
+
+# Output length budgets in tokens (see utils/budget.py). Each style's budget is
+# stated in the prompt as a word limit, and their sum, with slack for the JSON
+# structure, is sent as the model's max_tokens. 0 leaves a style unbounded
+# (and then sends no max_tokens).
+CASUAL_MAX_TOKENS = int(os.getenv("CASUAL_MAX_TOKENS", "150"))
+FORMAL_MAX_TOKENS = int(os.getenv("FORMAL_MAX_TOKENS", "600"))
+
+# Default generation strategy for /generate:
+#   single            - one prompt call, no refinement
+#   refine            - draft then refine (two calls)
+#   refine-if-invalid - refine only when the draft fails to parse or is incomplete
+GENERATION_STRATEGY = os.getenv("GENERATION_STRATEGY", "refine")
+
+# Response cache in front of the model (see utils/cache.py).
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # "memory" or "redis"
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "86400"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+# Minimum trigram Jaccard similarity (over content words, see utils/cache.py) for a
+# paraphrase to reuse a cached answer; 0 disables the tier.
+CACHE_SIMILARITY_THRESHOLD = float(os.getenv("CACHE_SIMILARITY_THRESHOLD", "0"))
+
+# /history pagination.
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
+
+# Reused ChatGroq clients (see utils/models.py): max clients kept and idle eviction in seconds.
+MODEL_REGISTRY_SIZE = int(os.getenv("MODEL_REGISTRY_SIZE", "256"))
+MODEL_IDLE_TTL = float(os.getenv("MODEL_IDLE_TTL", "900"))
+
+# /generate/batch: max queries per request, plus concurrent items and item
+# start rate (items per second, 0 = unlimited) per API key, shared by all of
+# that key's batches in a worker.
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_RATE_LIMIT = float(os.getenv("BATCH_RATE_LIMIT", "5"))
+
+# Background generation jobs (POST /jobs, see utils/jobs.py): worker tasks per
+# process, queued jobs before POST /jobs answers 503, per-job timeout and how
+# long jobs are kept, in seconds. JOBS_BACKEND "sqlite" shares job state between the
+# workers on a host via JOBS_SQLITE_PATH; "memory" keeps it per worker process, so it
+# only suits a single worker (serve.py refuses it with more).
+JOBS_BACKEND = os.getenv("JOBS_BACKEND", "sqlite")
+JOBS_SQLITE_PATH = os.getenv("JOBS_SQLITE_PATH", "jobs.db")
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))
+JOBS_MAX_QUEUE = int(os.getenv("JOBS_MAX_QUEUE", "1000"))
+JOBS_TIMEOUT = float(os.getenv("JOBS_TIMEOUT", "300"))
+JOBS_TTL = float(os.getenv("JOBS_TTL", "86400"))
+# Completion callbacks: timeout and retries per delivery, the key signing the
+# body as X-Signature-256 (HMAC-SHA256; unset = unsigned), and the hosts callbacks
+# may go to (comma-separated; unset = any host resolving to public addresses only).
+JOBS_CALLBACK_TIMEOUT = float(os.getenv("JOBS_CALLBACK_TIMEOUT", "10"))
+JOBS_CALLBACK_RETRIES = int(os.getenv("JOBS_CALLBACK_RETRIES", "3"))
+JOBS_CALLBACK_SECRET = os.getenv("JOBS_CALLBACK_SECRET", "")
+JOBS_CALLBACK_HOSTS = tuple(host.strip() for host in os.getenv("JOBS_CALLBACK_HOSTS", "").split(",") if host.strip())
+
+# Write-behind persistence of history rows (see db/writer.py).
+PERSISTENCE_WRITE_BEHIND = os.getenv("PERSISTENCE_WRITE_BEHIND", "true").lower() == "true"
+PERSISTENCE_QUEUE_SIZE = int(os.getenv("PERSISTENCE_QUEUE_SIZE", "10000"))
+PERSISTENCE_BATCH_SIZE = int(os.getenv("PERSISTENCE_BATCH_SIZE", "50"))
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL", "0.5"))
+PERSISTENCE_MAX_RETRIES = int(os.getenv("PERSISTENCE_MAX_RETRIES", "3"))
+PERSISTENCE_SPOOL_PATH = os.getenv("PERSISTENCE_SPOOL_PATH", "persistence_spool.jsonl")
+
+# Conversation mode (see utils/context.py): how many past turns are fetched,
+# how many newest turns are quoted verbatim, and the token budget for all of it.
+CONVERSATION_HISTORY_TURNS = int(os.getenv("CONVERSATION_HISTORY_TURNS", "20"))
+CONVERSATION_RECENT_TURNS = int(os.getenv("CONVERSATION_RECENT_TURNS", "2"))
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "1500"))
+
+# Import the model client library and build the database client in the
+# background right after startup, instead of on the first request that needs them.
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+
+# Level of the structured JSON logs written by the backend (see utils/tracing.py).
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Expose the runtime sampling profiler under /debug/profiler (off in production).
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+
+# Coordination state for rate limits and single-flight generation (see utils/store.py):
+# "memory" coordinates within one process, "redis" across all workers.
+SHARED_STORE_BACKEND = os.getenv("SHARED_STORE_BACKEND", "memory")
+SHARED_STORE_URL = os.getenv("SHARED_STORE_URL", CACHE_REDIS_URL)
+
+# Token-bucket limits on generate requests, in requests per minute with a
+# burst allowance, per Groq API key and per user (0 = unlimited).
+RATE_LIMIT_PER_KEY = float(os.getenv("RATE_LIMIT_PER_KEY", "30"))
+RATE_LIMIT_KEY_BURST = int(os.getenv("RATE_LIMIT_KEY_BURST", "10"))
+RATE_LIMIT_PER_USER = float(os.getenv("RATE_LIMIT_PER_USER", "20"))
+RATE_LIMIT_USER_BURST = int(os.getenv("RATE_LIMIT_USER_BURST", "5"))
+
+# Identical in-flight queries share one generation; followers on other
+# workers wait up to this many seconds for the leader's result.
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+SINGLE_FLIGHT_WAIT = float(os.getenv("SINGLE_FLIGHT_WAIT", "30"))
+
+# History search (see utils/search.py). "local" ranks with an in-process index
+# built per user on first search; "database" uses the storage backend's
+# full-text search (Postgres `search` column, see README, or SQLite FTS5). SEARCH_EMBEDDER adds similarity ranking for semantic/hybrid
+# modes: "hashing" (built in), "sentence-transformers" (optional package) or "none".
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "local")
+SEARCH_EMBEDDER = os.getenv("SEARCH_EMBEDDER", "hashing")
+SEARCH_EMBEDDING_MODEL = os.getenv("SEARCH_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+SEARCH_INDEX_MAX_USERS = int(os.getenv("SEARCH_INDEX_MAX_USERS", "1000"))
+# Most records loaded into a user's local index.
+SEARCH_MAX_DOCS = int(os.getenv("SEARCH_MAX_DOCS", "5000"))
+# Each worker's local index only sees the inserts it made itself; after this
+# many seconds a search re-reads the user's newest records to pick up chats
+# saved by other workers (0 = never, enough with WEB_WORKERS=1).
+SEARCH_INDEX_REFRESH = float(os.getenv("SEARCH_INDEX_REFRESH", "30"))
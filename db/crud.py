@@ -1,13 +1,26 @@
-from db.database import supabase
+from db.database import supabase, get_async_supabase
 
-def add_entry(user_id, query, casual_response, formal_response):
+def entry_row(user_id, query, casual_response, formal_response, prompt_version=None):
+    """
+    Builds a `prompts` row. `prompt_version` (e.g. `draft@2+refine@1`, see
+    utils/prompts.py) is only set when known, so callers without it still work
+    against tables created before the column was added.
+    """
+
+    row = {
+        "user_id": user_id,
+        "query": query,
+        "casual_response": casual_response,
+        "formal_response": formal_response,
+    }
+    if prompt_version is not None:
+        row["prompt_version"] = prompt_version
+    return row
+
+
+def add_entry(user_id, query, casual_response, formal_response, prompt_version=None):
     try:
-        result = supabase.table("prompts").insert({
-            "user_id": user_id,
-            "query": query,
-            "casual_response": casual_response,
-            "formal_response": formal_response
-        }).execute()
+        result = supabase.table("prompts").insert(entry_row(user_id, query, casual_response, formal_response, prompt_version)).execute()
    
         return True
 
@@ -24,3 +37,115 @@ def get_history(user_id):
     except Exception as e:
         return e
 
+
+async def add_entry_async(user_id, query, casual_response, formal_response, prompt_version=None):
+    try:
+        client = await get_async_supabase()
+        result = await client.table("prompts").insert(entry_row(user_id, query, casual_response, formal_response, prompt_version)).execute()
+
+        return True
+
+    except Exception as e:
+        return e
+
+
+HISTORY_FIELDS = ("id", "user_id", "query", "casual_response", "formal_response", "prompt_version", "created_at")
+
+
+async def get_history_page_async(user_id, limit, before=None, fields=HISTORY_FIELDS, since=None):
+    """
+    Returns up to `limit` of the user's records, newest first, using keyset pagination.
+
+    `before` is the `(created_at, id)` of the last row of the previous page; only
+    rows strictly older than it are returned. `since` restricts the result to rows
+    created strictly after that timestamp, which lets clients sync only new chats.
+    `id` and `created_at` are always selected because the caller needs them to
+    build the next cursor.
+    """
+
+    try:
+        columns = ",".join(dict.fromkeys(("id", "created_at") + tuple(fields)))
+        client = await get_async_supabase()
+        query = client.table("prompts").select(columns).eq("user_id",user_id)
+        if since is not None:
+            query = query.gt("created_at",since)
+        if before is not None:
+            created_at, entry_id = before
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{int(entry_id)})')
+        result = await query.order("created_at",desc=True).order("id",desc=True).limit(limit).execute()
+
+        return (result.data)
+
+    except Exception as e:
+        return e
+
+
+async def get_entry_async(user_id, entry_id):
+    try:
+        client = await get_async_supabase()
+        result = await client.table("prompts").select("*").eq("user_id",user_id).eq("id",entry_id).limit(1).execute()
+
+        return (result.data[0] if result.data else None)
+
+    except Exception as e:
+        return e
+
+
+async def add_entries_async(user_id, entries):
+    """
+    Inserts several records for one user in a single request. Each entry is a
+    dict with `query`, `casual_response`, `formal_response` and optionally
+    `prompt_version`. Returns the inserted rows, including their `id` and
+    `created_at`.
+    """
+
+    try:
+        client = await get_async_supabase()
+        result = await client.table("prompts").insert([
+            {"user_id": user_id, **entry} for entry in entries
+        ]).execute()
+
+        return (result.data)
+
+    except Exception as e:
+        return e
+
+
+async def add_rows_async(rows):
+    """
+    Inserts complete `prompts` rows (each with its own `user_id`) in one request.
+    Used by the write-behind queue, which batches rows across users. Returns
+    the inserted rows, including their `id` and `created_at`.
+    """
+
+    try:
+        client = await get_async_supabase()
+        result = await client.table("prompts").insert(rows).execute()
+
+        return (result.data)
+
+    except Exception as e:
+        return e
+
+
+async def search_history_async(user_id, text, limit, offset=0, fields=HISTORY_FIELDS):
+    """
+    Full-text search of the user's records through the generated `search`
+    tsvector column (see the README for the migration), newest first.
+    `text` uses web-search syntax: words, "quoted phrases", `or`, `-excluded`.
+    """
+
+    try:
+        columns = ",".join(dict.fromkeys(("id", "created_at") + tuple(fields)))
+        client = await get_async_supabase()
+        result = await (
+            client.table("prompts").select(columns).eq("user_id",user_id)
+            .text_search("search", text, options={"type": "websearch", "config": "english"})
+            .order("created_at",desc=True).order("id",desc=True)
+            .range(offset, offset + limit - 1).execute()
+        )
+
+        return (result.data)
+
+    except Exception as e:
+        return e
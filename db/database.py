@@ -1,7 +1,57 @@
-from supabase import create_client
+import asyncio
 import os
+import threading
 from dotenv import load_dotenv
 load_dotenv()
 
-supabase = create_client(os.getenv("PROJECT_URL"),os.getenv("PROJECT_KEY"))
 
+class _LazyClient:
+    """
+    The sync Supabase client, created on first use rather than at import, so
+    importing `db.crud` does not pay for the `supabase` package and a client
+    build before the app can serve `/health`.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._client is not None
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from supabase import create_client
+                    self._client = create_client(os.getenv("PROJECT_URL"),os.getenv("PROJECT_KEY"))
+        return getattr(self._client, name)
+
+
+supabase = _LazyClient()
+
+
+_async_supabase = None
+_async_lock = asyncio.Lock()
+
+
+async def get_async_supabase():
+    """
+    Returns the shared async Supabase client, creating it on first use.
+
+    The async client lets the request path await inserts and selects on the
+    event loop instead of blocking a worker thread for the round trip.
+    """
+
+    global _async_supabase
+    if _async_supabase is None:
+        async with _async_lock:
+            if _async_supabase is None:
+                from supabase import acreate_client
+                _async_supabase = await acreate_client(os.getenv("PROJECT_URL"), os.getenv("PROJECT_KEY"))
+    return _async_supabase
+
+
+def async_client_ready() -> bool:
+    return _async_supabase is not None
@@ -0,0 +1,171 @@
+from abc import ABC, abstractmethod
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+
+# Job states, in the order a job moves through them
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+
+class JobStore(ABC):
+    """
+    Interface of the store holding background generation jobs (see utils/jobs.py).
+
+    A job is a dict with `id`, `user_id`, `query`, `strategy`, `conversation`,
+    `callback_url`, `status`, `output`, `error` and `callback`, plus
+    `created_at`, `started_at` and `finished_at` as Unix timestamps. The
+    caller's Groq API key is never part of it. Methods raise on failure.
+    """
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def create(self, job: dict):
+        """Stores a new job."""
+
+    @abstractmethod
+    async def update(self, job_id: str, **fields):
+        """Sets `fields` on the job."""
+
+    @abstractmethod
+    async def get(self, job_id: str):
+        """Returns the job, or None."""
+
+    @abstractmethod
+    async def purge(self, created_before: float) -> int:
+        """Deletes jobs created before the timestamp; returns how many."""
+
+
+class InMemoryJobStore(JobStore):
+    """
+    Jobs in a dict, visible only to this worker process.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+
+    async def create(self, job: dict):
+        self._jobs[job["id"]] = dict(job)
+
+    async def update(self, job_id: str, **fields):
+        self._jobs[job_id].update(fields)
+
+    async def get(self, job_id: str):
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    async def purge(self, created_before: float) -> int:
+        expired = [job_id for job_id, job in self._jobs.items() if job["created_at"] < created_before]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return len(expired)
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Jobs in a SQLite database file. Every worker process on the host sees
+    them, so `GET /jobs/{id}` works whichever worker gets the request. Each job
+    is one row. The state fields are columns and the rest is a JSON document.
+    Statements run on one connection in WAL mode, from a thread, one at a time.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._connection = None
+        self._lock = threading.Lock()
+
+    async def connect(self):
+        await asyncio.to_thread(self._open)
+
+    async def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    async def create(self, job: dict):
+        await self._run("INSERT INTO jobs (id, status, created_at, data) VALUES (?, ?, ?, ?)",
+                        (job["id"], job["status"], job["created_at"], json.dumps(job)))
+
+    async def update(self, job_id: str, **fields):
+        await asyncio.to_thread(self._update, job_id, fields)
+
+    async def get(self, job_id: str):
+        rows = await self._run("SELECT data FROM jobs WHERE id = ?", (job_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    async def purge(self, created_before: float) -> int:
+        return await asyncio.to_thread(self._execute, "DELETE FROM jobs WHERE created_at < ?", (created_before,), True)
+
+    def _open(self):
+        with self._lock:
+            if self._connection is None:
+                connection = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False, isolation_level=None)
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.executescript(self.SCHEMA)
+                self._connection = connection
+        return self._connection
+
+    async def _run(self, sql, params) -> list:
+        return await asyncio.to_thread(self._execute, sql, params)
+
+    def _execute(self, sql, params, rowcount: bool = False):
+        connection = self._open()
+        with self._lock:
+            cursor = connection.execute(sql, params)
+            return cursor.rowcount if rowcount else cursor.fetchall()
+
+    def _update(self, job_id: str, fields: dict):
+        connection = self._open()
+        with self._lock:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row is None:
+                    raise KeyError(job_id)
+                job = {**json.loads(row[0]), **fields}
+                connection.execute("UPDATE jobs SET status = ?, data = ? WHERE id = ?", (job["status"], json.dumps(job), job_id))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+
+def create_job_store(config) -> JobStore:
+    """
+    Builds the job store selected by `JOBS_BACKEND` in `config`.
+    """
+
+    if config.JOBS_BACKEND == "sqlite":
+        return SQLiteJobStore(config.JOBS_SQLITE_PATH)
+    if config.JOBS_BACKEND == "memory":
+        return InMemoryJobStore()
+    raise ValueError(f"Unknown JOBS_BACKEND {config.JOBS_BACKEND!r}")
+
+
+def new_job(job_id: str, user_id: str, query: str, strategy: str, conversation: bool = False, callback_url: str = None) -> dict:
+    return {
+        "id": job_id, "user_id": user_id, "query": query, "strategy": strategy, "conversation": conversation,
+        "callback_url": callback_url, "status": QUEUED, "output": None, "error": None, "callback": None,
+        "created_at": time.time(), "started_at": None, "finished_at": None,
+    }
@@ -0,0 +1,221 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import asyncio
+import queue
+import re
+import sqlite3
+import threading
+
+from db.crud import HISTORY_FIELDS
+from db.storage import HistoryStore
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prompts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT,
+    query TEXT NOT NULL,
+    casual_response TEXT NOT NULL,
+    formal_response TEXT NOT NULL,
+    prompt_version TEXT,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+);
+CREATE INDEX IF NOT EXISTS prompts_user_created ON prompts (user_id, created_at DESC, id DESC);
+"""
+
+# External-content FTS5 index over the text columns, kept in sync by triggers.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS prompts_fts USING fts5(
+    query, casual_response, formal_response, content='prompts', content_rowid='id', tokenize='porter'
+);
+CREATE TRIGGER IF NOT EXISTS prompts_fts_insert AFTER INSERT ON prompts BEGIN
+    INSERT INTO prompts_fts (rowid, query, casual_response, formal_response)
+    VALUES (new.id, new.query, new.casual_response, new.formal_response);
+END;
+CREATE TRIGGER IF NOT EXISTS prompts_fts_delete AFTER DELETE ON prompts BEGIN
+    INSERT INTO prompts_fts (prompts_fts, rowid, query, casual_response, formal_response)
+    VALUES ('delete', old.id, old.query, old.casual_response, old.formal_response);
+END;
+"""
+
+INSERT = (
+    "INSERT INTO prompts (user_id, query, casual_response, formal_response, prompt_version, created_at) "
+    f"VALUES (?, ?, ?, ?, ?, ?) RETURNING {', '.join(HISTORY_FIELDS)}"
+)
+
+
+def _columns(fields, table: str = "") -> str:
+    # Only known column names ever reach the SQL text
+    columns = dict.fromkeys(("id", "created_at") + tuple(fields))
+    unknown = [column for column in columns if column not in HISTORY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return ", ".join(table + column for column in columns)
+
+
+def _match_expression(text: str) -> str:
+    # Every word must match; quoting keeps FTS5 operators in user input literal
+    return " ".join('"' + word + '"' for word in re.findall(r"\w+", text))
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """
+    History in a local SQLite database, for offline runs and single-host deployments.
+
+    The database runs in WAL mode, so readers never wait for the writer, with
+    an index on `(user_id, created_at, id)` serving the keyset-paginated
+    history reads. Statements are parameterized and their SQL text is fixed
+    per projection, so each connection's statement cache keeps them prepared.
+    Queries run on a pool of `pool_size` connections, each used by one thread
+    of a matching executor at a time; writes are serialized in-process rather
+    than left to contend on SQLite's lock. Search uses an FTS5 index when the
+    SQLite build has it, and substring matching otherwise.
+    """
+
+    def __init__(self, path: str, pool_size: int = 4, busy_timeout: float = 5.0):
+        self.path = path
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self.has_fts = False
+        self._pool = queue.Queue()
+        self._executor = ThreadPoolExecutor(pool_size, thread_name_prefix="sqlite")
+        self._open_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._opened = False
+
+    @property
+    def ready(self) -> bool:
+        return self._opened
+
+    async def connect(self):
+        await self._run(lambda: None)
+
+    async def close(self):
+        await asyncio.to_thread(self._executor.shutdown)
+        with self._open_lock:
+            while not self._pool.empty():
+                self._pool.get_nowait().close()
+            self._opened = False
+        self._executor = ThreadPoolExecutor(self.pool_size, thread_name_prefix="sqlite")
+
+    async def add_entry(self, user_id, query, casual_response, formal_response, prompt_version=None):
+        result = await self._call(self._insert, [(user_id, query, casual_response, formal_response, prompt_version)])
+        return result if isinstance(result, Exception) else True
+
+    async def add_entries(self, user_id, entries):
+        return await self._call(self._insert, [
+            (user_id, e["query"], e["casual_response"], e["formal_response"], e.get("prompt_version")) for e in entries
+        ])
+
+    async def add_rows(self, rows):
+        return await self._call(self._insert, [
+            (r["user_id"], r["query"], r["casual_response"], r["formal_response"], r.get("prompt_version")) for r in rows
+        ])
+
+    async def get_history_page(self, user_id, limit, before=None, fields=HISTORY_FIELDS, since=None):
+        return await self._call(self._page, user_id, limit, before, fields, since)
+
+    async def get_entry(self, user_id, entry_id):
+        rows = await self._call(self._select, "SELECT * FROM prompts WHERE user_id = ? AND id = ? LIMIT 1", [user_id, int(entry_id)])
+        if isinstance(rows, Exception):
+            return rows
+        return rows[0] if rows else None
+
+    async def search(self, user_id, text, limit, offset=0, fields=HISTORY_FIELDS):
+        return await self._call(self._search, user_id, text, limit, offset, fields)
+
+    async def _call(self, fn, *args):
+        try:
+            return await self._run(fn, *args)
+        except Exception as e:
+            return e
+
+    async def _run(self, fn, *args):
+        def task():
+            self._open()
+            return fn(*args)
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, task)
+
+    def _open(self):
+        if self._opened:
+            return
+        with self._open_lock:
+            if self._opened:
+                return
+            for _ in range(self.pool_size):
+                connection = sqlite3.connect(
+                    self.path, timeout=self.busy_timeout, check_same_thread=False,
+                    isolation_level=None, cached_statements=256,
+                )
+                connection.row_factory = sqlite3.Row
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                self._pool.put(connection)
+            with self._connection() as connection:
+                connection.executescript(SCHEMA)
+                try:
+                    connection.executescript(FTS_SCHEMA)
+                    self.has_fts = True
+                except sqlite3.OperationalError:
+                    self.has_fts = False
+            self._opened = True
+
+    @contextmanager
+    def _connection(self):
+        connection = self._pool.get()
+        try:
+            yield connection
+        finally:
+            self._pool.put(connection)
+
+    def _page(self, user_id, limit, before, fields, since) -> list:
+        sql = f"SELECT {_columns(fields)} FROM prompts WHERE user_id = ?"
+        params = [user_id]
+        if since is not None:
+            sql += " AND created_at > ?"
+            params.append(since)
+        if before is not None:
+            sql += " AND (created_at, id) < (?, ?)"
+            params += [before[0], int(before[1])]
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit)
+        return self._select(sql, params)
+
+    def _search(self, user_id, text, limit, offset, fields) -> list:
+        if self.has_fts:
+            expression = _match_expression(text)
+            if not expression:
+                return []
+            sql = (
+                f"SELECT {_columns(fields, 'p.')} FROM prompts_fts JOIN prompts p ON p.id = prompts_fts.rowid "
+                "WHERE prompts_fts MATCH ? AND p.user_id = ? ORDER BY p.created_at DESC, p.id DESC LIMIT ? OFFSET ?"
+            )
+            return self._select(sql, [expression, user_id, limit, offset])
+
+        words = re.findall(r"\w+", text.lower())
+        if not words:
+            return []
+        like = " AND ".join("lower(query || ' ' || casual_response || ' ' || formal_response) LIKE ?" for _ in words)
+        sql = f"SELECT {_columns(fields)} FROM prompts WHERE user_id = ? AND {like} ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?"
+        return self._select(sql, [user_id, *[f"%{word}%" for word in words], limit, offset])
+
+    def _select(self, sql, params) -> list:
+        with self._connection() as connection:
+            return [dict(row) for row in connection.execute(sql, params)]
+
+    def _insert(self, values) -> list:
+        rows = []
+        with self._write_lock, self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, query, casual_response, formal_response, prompt_version in values:
+                    created_at = datetime.now(timezone.utc).replace(tzinfo=None).isoformat(timespec="microseconds")
+                    cursor = connection.execute(INSERT, (user_id, query, casual_response, formal_response, prompt_version, created_at))
+                    rows.append(dict(cursor.fetchone()))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return rows
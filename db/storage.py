@@ -0,0 +1,108 @@
+from abc import ABC, abstractmethod
+import asyncio
+import importlib
+
+from db import crud
+from db.crud import HISTORY_FIELDS
+
+
+class HistoryStore(ABC):
+    """
+    Interface of the chat history storage used by the backend.
+
+    Like the functions in `db/crud.py`, every method returns its result or, on
+    failure, the exception instead of raising it, so callers can degrade (log,
+    spool, answer 500) without a try block around each call. Rows are dicts
+    with the `prompts` columns listed in `HISTORY_FIELDS`; `created_at` is an
+    ISO timestamp string.
+    """
+
+    @property
+    @abstractmethod
+    def ready(self) -> bool:
+        """True once `connect` has succeeded."""
+
+    @abstractmethod
+    async def connect(self):
+        """Loads the driver and opens connections ahead of the first request."""
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def add_entry(self, user_id, query, casual_response, formal_response, prompt_version=None):
+        """Inserts one record; returns True."""
+
+    @abstractmethod
+    async def add_entries(self, user_id, entries):
+        """Inserts several records for one user; returns the inserted rows."""
+
+    @abstractmethod
+    async def add_rows(self, rows):
+        """Inserts complete rows, each with its own `user_id`; returns the inserted rows."""
+
+    @abstractmethod
+    async def get_history_page(self, user_id, limit, before=None, fields=HISTORY_FIELDS, since=None):
+        """
+        Returns up to `limit` of the user's records, newest first. `before` is the
+        `(created_at, id)` keyset position of the previous page's last row; `since`
+        keeps only rows created after that timestamp.
+        """
+
+    @abstractmethod
+    async def get_entry(self, user_id, entry_id):
+        """Returns the user's record with `entry_id`, or None."""
+
+    @abstractmethod
+    async def search(self, user_id, text, limit, offset=0, fields=HISTORY_FIELDS):
+        """Full-text search of the user's records, newest first; all words must match."""
+
+
+class SupabaseHistoryStore(HistoryStore):
+    """
+    History in the Supabase `prompts` table, through the async functions in `db/crud.py`.
+    """
+
+    def __init__(self):
+        self._connected = False
+
+    @property
+    def ready(self) -> bool:
+        return self._connected
+
+    async def connect(self):
+        # Import in a thread so the event loop keeps serving meanwhile
+        await asyncio.to_thread(importlib.import_module, "supabase")
+        await crud.get_async_supabase()
+        self._connected = True
+
+    async def add_entry(self, user_id, query, casual_response, formal_response, prompt_version=None):
+        return await crud.add_entry_async(user_id, query, casual_response, formal_response, prompt_version)
+
+    async def add_entries(self, user_id, entries):
+        return await crud.add_entries_async(user_id, entries)
+
+    async def add_rows(self, rows):
+        return await crud.add_rows_async(rows)
+
+    async def get_history_page(self, user_id, limit, before=None, fields=HISTORY_FIELDS, since=None):
+        return await crud.get_history_page_async(user_id, limit, before, fields, since)
+
+    async def get_entry(self, user_id, entry_id):
+        return await crud.get_entry_async(user_id, entry_id)
+
+    async def search(self, user_id, text, limit, offset=0, fields=HISTORY_FIELDS):
+        return await crud.search_history_async(user_id, text, limit, offset, fields)
+
+
+def create_history_store(config) -> HistoryStore:
+    """
+    Builds the history store selected by `STORAGE_BACKEND` in `config`.
+    """
+
+    if config.STORAGE_BACKEND == "sqlite":
+        from db.sqlite_store import SQLiteHistoryStore
+        return SQLiteHistoryStore(config.SQLITE_PATH, config.SQLITE_POOL_SIZE)
+    if config.STORAGE_BACKEND == "supabase":
+        return SupabaseHistoryStore()
+    raise ValueError(f"Unknown STORAGE_BACKEND {config.STORAGE_BACKEND!r}")
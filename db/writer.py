@@ -0,0 +1,200 @@
+from collections import deque
+from contextlib import contextmanager
+import asyncio
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: the spool is only guarded within the process
+    fcntl = None
+
+
+class WriteBehindQueue:
+    """
+    Moves history inserts off the request path.
+
+    Rows are put on a bounded in-process queue and a background task flushes
+    them in batches, whichever comes first of `batch_size` rows or
+    `flush_interval` seconds. A failed flush is retried with exponential
+    backoff; if it still fails, the batch is appended to a local JSONL spool
+    file, which is replayed after the next successful flush (and on startup).
+    When the queue is full, rows go straight to the spool so requests never wait
+    for the database. Every worker process shares the spool, so it is read and
+    written under an `fcntl` lock on `<spool_path>.lock`; a row is never
+    replayed twice or lost between one worker reading the file and removing it.
+    The lock file also holds the number of spooled rows, for `snapshot`. Spool
+    file I/O (locking, fsync) runs in a thread, off the event loop.
+
+    Args:
+        flush (callable): `async flush(rows) -> result | Exception`, e.g. `crud.add_rows_async`.
+        spool_path (str): Path of the JSONL spool file.
+    """
+
+    def __init__(self, flush, spool_path: str, max_size: int = 10000, batch_size: int = 50,
+                 flush_interval: float = 0.5, max_retries: int = 3, retry_backoff: float = 0.5):
+        self._flush = flush
+        self.spool_path = spool_path
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue = None
+        self._task = None
+        self._spool_lock = threading.Lock()
+        self._flush_latencies = deque(maxlen=1000)
+        self.stats = {"enqueued": 0, "flushed": 0, "flushes": 0, "failed_flushes": 0, "spooled": 0, "replayed": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        self._queue = asyncio.Queue(self.max_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops accepting rows and drains the queue (rows that cannot be written are spooled)."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def enqueue(self, row: dict):
+        self.stats["enqueued"] += 1
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            await asyncio.to_thread(self._spool, [row])
+
+    def snapshot(self) -> dict:
+        latencies = sorted(self._flush_latencies)
+        return {
+            **self.stats,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "spool_rows": self._spool_size(),
+            "flush_latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "flush_latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+    async def _run(self):
+        await self._replay_spool()
+        stopping = False
+        while not stopping:
+            batch = []
+            first = await self._queue.get()
+            if first is None:
+                stopping = True
+            else:
+                batch.append(first)
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        row = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    if row is None:
+                        stopping = True
+                        break
+                    batch.append(row)
+
+            if stopping:
+                # Drain whatever is left behind the sentinel
+                while not self._queue.empty():
+                    row = self._queue.get_nowait()
+                    if row is not None:
+                        batch.append(row)
+
+            for start in range(0, len(batch), self.batch_size):
+                if await self._flush_with_retries(batch[start:start + self.batch_size]):
+                    await self._replay_spool()
+
+    async def _flush_with_retries(self, rows) -> bool:
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            result = await self._flush(rows)
+            if not isinstance(result, Exception):
+                self._flush_latencies.append(time.perf_counter() - start)
+                self.stats["flushes"] += 1
+                self.stats["flushed"] += len(rows)
+                return True
+            self.stats["failed_flushes"] += 1
+            if attempt < self.max_retries:
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+        await asyncio.to_thread(self._spool, rows)
+        return False
+
+    @contextmanager
+    def _locked_spool(self):
+        """Holds the spool lock and yields the lock file, which records the spooled row count."""
+        with self._spool_lock:
+            with open(self.spool_path + ".lock", "a+", encoding="utf-8") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield lock_file
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_count(lock_file) -> int:
+        lock_file.seek(0)
+        try:
+            return int(lock_file.read().strip() or 0)
+        except ValueError:
+            return 0
+
+    @staticmethod
+    def _write_count(lock_file, count: int):
+        lock_file.truncate(0)
+        lock_file.write(str(count))
+        lock_file.flush()
+
+    def _spool(self, rows):
+        with self._locked_spool() as lock_file:
+            with open(self.spool_path, "a", encoding="utf-8") as spool:
+                for row in rows:
+                    spool.write(json.dumps(row) + "\n")
+                spool.flush()
+                os.fsync(spool.fileno())
+            self._write_count(lock_file, self._read_count(lock_file) + len(rows))
+        self.stats["spooled"] += len(rows)
+
+    def _take_spool(self) -> list:
+        with self._locked_spool() as lock_file:
+            if not os.path.exists(self.spool_path):
+                return []
+            with open(self.spool_path, encoding="utf-8") as spool:
+                rows = [json.loads(line) for line in spool if line.strip()]
+            os.remove(self.spool_path)
+            self._write_count(lock_file, 0)
+            return rows
+
+    def _spool_size(self) -> int:
+        # A few bytes kept current by `_spool` and `_take_spool`, so a metrics
+        # scrape never reads the spool itself or waits for its lock
+        try:
+            with open(self.spool_path + ".lock", encoding="utf-8") as lock_file:
+                return self._read_count(lock_file)
+        except OSError:
+            return 0
+
+    async def _replay_spool(self):
+        rows = await asyncio.to_thread(self._take_spool)
+        for start in range(0, len(rows), self.batch_size):
+            chunk = rows[start:start + self.batch_size]
+            result = await self._flush(chunk)
+            if isinstance(result, Exception):
+                # Still unreachable: put everything not yet written back on disk
+                await asyncio.to_thread(self._spool, rows[start:])
+                self.stats["spooled"] -= len(rows) - start
+                return
+            self.stats["replayed"] += len(chunk)
@@ -0,0 +1,102 @@
+"""
+HTTP client used by the Streamlit frontend to talk to the FastAPI backend.
+
+A single `requests.Session` is shared across reruns (see `get_api_client` in
+`app.py`), so TCP/TLS connections to the backend are kept alive and reused.
+Every call has connect/read timeouts, and idempotent GETs are retried with
+exponential backoff on connection errors and 502/503/504 responses. POSTs are
+never retried, since a retried `/generate` would create a duplicate chat.
+History pages are revalidated with `If-None-Match`, so an unchanged page comes
+back as an empty 304 and is served from the last copy.
+
+Configuration (environment variables):
+    BACKEND_URL          Base URL of the backend
+    API_CONNECT_TIMEOUT  Seconds to establish a connection (default 5)
+    API_READ_TIMEOUT     Seconds to wait between bytes of a response (default 60)
+    API_RETRIES          Retries for idempotent requests (default 3)
+"""
+
+from collections import OrderedDict
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+DEFAULT_BACKEND_URL = "https://yoliday-chatbot-assignment.onrender.com"
+
+
+class ApiClient:
+    def __init__(self, base_url: str, connect_timeout: float = 5, read_timeout: float = 60, retries: int = 3, backoff: float = 0.5, pool_size: int = 10):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # (ETag, body) of recent history pages, by query parameters. The client is
+        # shared by every Streamlit session, each rerunning in its own thread.
+        self._pages = OrderedDict()
+        self._max_pages = 32
+        self._pages_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ApiClient":
+        return cls(
+            os.getenv("BACKEND_URL", DEFAULT_BACKEND_URL),
+            connect_timeout=float(os.getenv("API_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("API_READ_TIMEOUT", "60")),
+            retries=int(os.getenv("API_RETRIES", "3")),
+        )
+
+    def get_history_page(self, user_id: str, params: dict) -> dict:
+        """GET /history; returns `{"output": [...], "next_cursor": ...}`."""
+        params = {"user_id": user_id, **params}
+        key = tuple(sorted(params.items()))
+        with self._pages_lock:
+            cached = self._pages.get(key)
+        conditional = {"headers": {"If-None-Match": cached[0]}} if cached else {}
+        response = self.session.get(f"{self.base_url}/history", params=params, timeout=self.timeout, **conditional)
+        if response.status_code == 304 and cached:
+            with self._pages_lock:
+                if key in self._pages:
+                    self._pages.move_to_end(key)
+            return cached[1]
+        response.raise_for_status()
+        page = response.json()
+        if response.headers.get("ETag"):
+            with self._pages_lock:
+                self._pages[key] = (response.headers["ETag"], page)
+                self._pages.move_to_end(key)
+                if len(self._pages) > self._max_pages:
+                    self._pages.popitem(last=False)
+        return page
+
+    def search_history(self, user_id: str, params: dict) -> dict:
+        """GET /history/search; returns `{"output": [...], "next_cursor": ..., "total": ...}`."""
+        response = self.session.get(f"{self.base_url}/history/search", params={"user_id": user_id, **params}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_history_entry(self, user_id: str, entry_id: int) -> dict:
+        """GET /history/{id}; returns the record."""
+        response = self.session.get(f"{self.base_url}/history/{entry_id}", params={"user_id": user_id}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["output"]
+
+    def stream_generate(self, payload: dict) -> requests.Response:
+        """POST /generate/stream; returns the open streaming response (use as a context manager)."""
+        return self.session.post(f"{self.base_url}/generate/stream", json=payload, stream=True, timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,121 @@
+"""
+Client-side cache of a user's chat history for the Streamlit frontend.
+
+The sidebar only needs `id, query, created_at` for each chat, so those rows are
+kept in `records` (newest first) and synced incrementally: the first page is
+loaded once, later calls fetch only chats newer than the newest one seen, and
+older pages are loaded on demand. `version` goes up whenever `records` changes,
+so views derived from them know when to rebuild. After a generation the
+cache stays `stale` until the new chat shows up, since the backend may save it
+a moment after answering (write-behind); `next_retry` spaces the re-syncs out
+and gives up after a few. Full records are fetched one at a time when a
+chat is opened and memoized in `details`.
+
+The cache does no I/O itself; callers pass functions that hit the backend:
+    fetch_page(params: dict) -> dict   # GET /history, returns {"output", "next_cursor"}
+    fetch_entry(entry_id: int) -> dict # GET /history/{id}, returns the record
+"""
+
+import time
+
+SIDEBAR_FIELDS = "id,query,created_at"
+
+
+class HistoryCache:
+    def __init__(self, page_size: int = 50, pending_timeout: float = 10, retry_delay: float = 0.5, max_retries: int = 4):
+        self.page_size = page_size
+        self.pending_timeout = pending_timeout
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self.retries = 0
+        self.records = []
+        self.details = {}
+        self.next_cursor = None
+        self.loaded = False
+        self.stale = False
+        self.pending = 0
+        self.pending_until = 0.0
+        self.version = 0
+
+    def load(self, fetch_page):
+        """Loads the first page of sidebar rows, replacing anything cached."""
+        data = fetch_page({"limit": self.page_size, "fields": SIDEBAR_FIELDS})
+        self.records = list(data["output"])
+        self.next_cursor = data.get("next_cursor")
+        self.loaded = True
+        self.version += 1
+
+    def sync(self, fetch_page):
+        """
+        Brings the cache up to date: a full load the first time, afterwards
+        only rows created after the newest cached one.
+        """
+        if not self.loaded or not self.records:
+            self.load(fetch_page)
+            self._settle(len(self.records))
+            return
+
+        newest = self.records[0]["created_at"]
+        params = {"limit": self.page_size, "fields": SIDEBAR_FIELDS, "since": newest}
+        new_rows = []
+        while True:
+            data = fetch_page(params)
+            new_rows.extend(data["output"])
+            if not data.get("next_cursor"):
+                break
+            params = {**params, "cursor": data["next_cursor"]}
+
+        known = {record["id"] for record in self.records}
+        new_rows = [row for row in new_rows if row["id"] not in known]
+        if new_rows:
+            self.records = new_rows + self.records
+            self.version += 1
+        self._settle(len(new_rows))
+
+    def load_more(self, fetch_page):
+        """Appends the next page of older rows, if there is one."""
+        if not self.next_cursor:
+            return
+        data = fetch_page({"limit": self.page_size, "fields": SIDEBAR_FIELDS, "cursor": self.next_cursor})
+        self.records.extend(data["output"])
+        self.next_cursor = data.get("next_cursor")
+        self.version += 1
+
+    @property
+    def has_more(self) -> bool:
+        return bool(self.next_cursor)
+
+    def mark_stale(self, expected: int = 1):
+        """
+        Flags that `expected` new chats are being saved (e.g. after a
+        generation). The cache stays stale until they appear in a sync, or
+        for at most `pending_timeout` seconds in case a save failed.
+        """
+        self.pending += expected
+        self.pending_until = time.monotonic() + self.pending_timeout
+        self.stale = True
+        self.retries = 0
+
+    def next_retry(self):
+        """
+        Seconds to wait before syncing a stale cache again, doubling from
+        `retry_delay`; None when the cache is fresh or `max_retries` retries
+        have been used, after which it syncs on the next user interaction.
+        """
+        if not self.stale or self.retries >= self.max_retries:
+            return None
+        delay = self.retry_delay * 2 ** self.retries
+        self.retries += 1
+        return delay
+
+    def _settle(self, new_rows: int):
+        self.pending = max(0, self.pending - new_rows)
+        self.stale = self.pending > 0 and time.monotonic() < self.pending_until
+        if not self.stale:
+            self.pending = 0
+
+    def get_detail(self, entry_id: int, fetch_entry) -> dict:
+        """Returns the full record for `entry_id`, fetching it only on first access."""
+        if entry_id not in self.details:
+            self.details[entry_id] = fetch_entry(entry_id)
+        return self.details[entry_id]
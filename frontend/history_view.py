@@ -0,0 +1,88 @@
+"""
+Sidebar view model over the cached chat history.
+
+Turns `HistoryCache.records` (newest first) into date groups for the sidebar
+(Today, Yesterday, This week, Older) and exposes only a window of them, so a
+rerun renders a bounded number of buttons however long the history is.
+
+Work happens only when the history changes (`HistoryCache.version`) or the
+date rolls over; reruns in between, e.g. one per keystroke, reuse the groups.
+Each timestamp is parsed once per chat and remembered, so new chats arriving
+through an incremental sync are the only ones parsed.
+"""
+
+from datetime import date, datetime, timedelta
+
+
+BUCKETS = ("Today", "Yesterday", "This week", "Older")
+
+
+def parse_date_isoformat(date_str: str) -> datetime:
+    """Parses a Supabase/SQLite timestamp, whose fractional seconds may have fewer than 6 digits."""
+    if '.' in date_str:
+        date_part, micro_part = date_str.split('.')
+        # micro_part may end with 'Z' or timezone info - handle only microseconds here
+        digits = len(micro_part) - len(micro_part.lstrip("0123456789"))
+        microseconds = micro_part[:min(digits, 6)].ljust(6, '0')  # pad to 6 digits
+        rest = micro_part[digits:]  # possible timezone info
+        fixed_date_str = f"{date_part}.{microseconds}{rest}"
+    else:
+        fixed_date_str = date_str
+    return datetime.fromisoformat(fixed_date_str.replace("Z", "+00:00"))
+
+
+def bucket_for(day: date, today: date) -> str:
+    if day >= today:
+        return "Today"
+    if day == today - timedelta(days=1):
+        return "Yesterday"
+    if day > today - timedelta(days=7):
+        return "This week"
+    return "Older"
+
+
+class HistoryView:
+    def __init__(self, window: int = 50):
+        self.window = window
+        self.limit = window
+        self.groups = []
+        self.total = 0
+        self._timestamps = {}  # chat id -> parsed created_at
+        self._key = None
+
+    def refresh(self, records: list, version: int, today: date = None):
+        """Regroups `records` if they changed (per `version`) or the date rolled over."""
+        today = today or date.today()
+        if self._key == (version, today):
+            return
+
+        timestamps, groups = {}, {}
+        for record in records:
+            created_at = self._timestamps.get(record["id"])
+            if created_at is None:
+                created_at = parse_date_isoformat(record["created_at"])
+            timestamps[record["id"]] = created_at
+            groups.setdefault(bucket_for(created_at.date(), today), []).append(record)
+
+        self._timestamps = timestamps
+        self.groups = [(label, groups[label]) for label in BUCKETS if label in groups]
+        self.total = len(records)
+        self._key = (version, today)
+
+    def visible(self) -> list:
+        """The groups cut down to the first `limit` chats overall, as `[(label, chats)]`."""
+        remaining, shown = self.limit, []
+        for label, chats in self.groups:
+            if remaining <= 0:
+                break
+            shown.append((label, chats[:remaining]))
+            remaining -= len(shown[-1][1])
+        return shown
+
+    @property
+    def has_hidden(self) -> bool:
+        """True if cached chats exist beyond the window."""
+        return self.total > self.limit
+
+    def show_more(self):
+        self.limit += self.window
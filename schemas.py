@@ -1,7 +1,32 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, HttpUrl
+from typing import Literal, Optional
 
 
 class getInput(BaseModel):
     user_id: str
     query: str
     groq_api_key: str
+    # Overrides the server's GENERATION_STRATEGY for this request when set.
+    strategy: Optional[Literal["single", "refine", "refine-if-invalid"]] = None
+    # Include earlier turns from the user's history as context for follow-up questions.
+    conversation: bool = False
+
+
+class JobInput(getInput):
+    # POSTed the job's result (as returned by GET /jobs/{id}) when the job finishes.
+    callback_url: Optional[HttpUrl] = None
+
+
+class BatchInput(BaseModel):
+    user_id: str
+    queries: list[str] = Field(min_length=1)
+    groq_api_key: str
+    strategy: Optional[Literal["single", "refine", "refine-if-invalid"]] = None
+    # Stream per-item results as NDJSON instead of returning them all at the end.
+    stream: bool = False
+
+
+class ModelOutput(BaseModel):
+    """Shape the model is prompted to return; extra keys are dropped."""
+    casual_response: str
+    formal_response: str
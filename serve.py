@@ -0,0 +1,58 @@
+"""
+serve.py
+
+Production entry point for the backend:
+
+    python serve.py --workers 4 --port 8000
+
+Runs `backend:app` under uvicorn with `WEB_WORKERS` worker processes sharing
+one listening socket. uvicorn restarts a worker that dies. Each worker runs
+its own event loop, so `LLM_CONCURRENCY` and the admission limits
+(`ADMISSION_*`) apply per worker. Use `SHARED_STORE_BACKEND=redis` so rate
+limits and single-flight coordination span all of them. Forwarded client
+addresses are only trusted from `FORWARDED_ALLOW_IPS` (the local proxy by default).
+
+SIGTERM starts a graceful drain in every worker:
+    * it stops accepting connections and turns away new generate requests with
+      503 and `Retry-After`;
+    * `/ready` answers 503;
+    * in-flight requests get up to `DRAIN_TIMEOUT` seconds to finish;
+    * the lifespan shutdown then flushes the write-behind queue.
+"""
+
+import argparse
+
+import uvicorn
+
+import config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=config.WEB_WORKERS)
+    parser.add_argument("--host", default=config.WEB_HOST)
+    parser.add_argument("--port", type=int, default=config.WEB_PORT)
+    parser.add_argument("--drain-timeout", type=float, default=config.DRAIN_TIMEOUT)
+    parser.add_argument("--log-level", default=config.LOG_LEVEL.lower())
+    parser.add_argument("--forwarded-allow-ips", default=config.FORWARDED_ALLOW_IPS)
+    args = parser.parse_args()
+    if args.workers > 1 and config.JOBS_BACKEND == "memory":
+        # Each worker would hold its own jobs, so a poll landing on another worker gets 404
+        parser.error("JOBS_BACKEND=memory keeps jobs per worker process; use JOBS_BACKEND=sqlite with more than one worker")
+
+    uvicorn.run(
+        "backend:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.drain_timeout,
+        log_level=args.log_level,
+        proxy_headers=True,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        # Requests are bounded by the admission controller; keep idle connections short
+        timeout_keep_alive=5,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -32,9 +32,9 @@ Test Coverage:
 
 Mocks:
 ------
-- `ChatGroq.invoke`: Mocked to simulate AI model responses.
-- `db.crud.add_entry`: Mocked to avoid actual DB insertions.
-- `db.crud.supabase`: Mocked to simulate Supabase query chaining and results.
+- `ChatGroq.ainvoke`: Mocked to simulate AI model responses.
+- `db.crud.add_entry_async`: Mocked to avoid actual DB insertions.
+- `db.crud.supabase` / `db.crud.get_async_supabase`: Mocked to simulate Supabase query chaining and results.
 
 Usage:
 ------
@@ -42,15 +42,22 @@ Run with pytest:
     pytest tests/alltests.py
 """
 
+import base64
 import json
+import asyncio
+import time
+import threading
+import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, patch, MagicMock
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import backend
 from backend import app
 from utils.prompts import build_prompt, build_refine_prompt
 from langchain_groq import ChatGroq
+import groq
 from db import crud
 
 # Initialize FastAPI test client
@@ -61,6 +68,51 @@ TEST_USER_ID = "abc123"
 TEST_QUERY = "Explain blockchain"
 
 
+def mock_async_supabase(rows):
+    """
+    Builds a fake async Supabase client whose query builder methods chain onto
+    one mock and whose `execute()` resolves to `rows`.
+    """
+    query = MagicMock()
+    for method in ("select", "eq", "gt", "or_", "order", "limit", "insert", "text_search", "range"):
+        getattr(query, method).return_value = query
+    query.execute = AsyncMock(return_value=MagicMock(data=rows))
+    mock_client = MagicMock()
+    mock_client.table.return_value = query
+    return mock_client, query
+
+
+@pytest.fixture(autouse=True)
+def reset_response_cache():
+    """Start every test with an empty response cache so model calls are not skipped."""
+    if backend.response_cache is not None:
+        asyncio.run(backend.response_cache.clear())
+    yield
+
+
+@pytest.fixture(autouse=True)
+def disable_rate_limits():
+    """Tests share one user and key; only the rate limit tests turn the limits on."""
+    with patch.object(backend.key_limiter, "rate", 0), patch.object(backend.user_limiter, "rate", 0):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def isolate_state_files(tmp_path):
+    """Running the app's lifespan opens the jobs database and the spool lock; keep them out of the repo."""
+    with patch.object(backend.job_runner.store, "path", str(tmp_path / "jobs.db")), \
+         patch.object(backend.write_queue, "spool_path", str(tmp_path / "persistence_spool.jsonl")):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def fresh_model_router():
+    """Cooldowns and latency samples from one test must not reorder models in the next."""
+    from utils.router import create_model_router
+    with patch.object(backend, "model_router", create_model_router(backend.config)):
+        yield
+
+
 def test_generate_endpoint_prompt_formatting():
     """Test the /generate endpoint to verify prompt formatting logic."""
     # Mock response for ChatGroq
@@ -69,7 +121,7 @@ def test_generate_endpoint_prompt_formatting():
         "formal_response": "A blockchain is a decentralized, immutable ledger that records transactions across a network."
     }
     
-    with patch.object(ChatGroq,"invoke",new=MagicMock()) as mock_model:
+    with patch.object(ChatGroq,"ainvoke",new=AsyncMock()) as mock_model:
         # Mock the initial and refinement responses
         mock_model.side_effect = [
             type("MockResponse", (), {"content": json.dumps(mock_response)}),  # Initial response
@@ -77,7 +129,7 @@ def test_generate_endpoint_prompt_formatting():
         ]
 
         # Mock add_entry to avoid database calls
-        with patch("db.crud.add_entry") as mock_add_entry:
+        with patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)) as mock_add_entry:
             # Send POST request to /generate
             response = client.post(
                 "/generate",
@@ -138,12 +190,10 @@ def test_history_valid_user_id():
         }
     ]
 
-    # Create a fake result object with mappings().all()
-    with patch("db.crud.supabase") as mock_supabase:
-        mock_table = MagicMock()
-        mock_table.select.return_value.eq.return_value.order.return_value.execute.return_value.data = mock_history
-        mock_supabase.table.return_value = mock_table
+    # Create a fake async client whose query chain resolves to the mock rows
+    mock_supabase, _ = mock_async_supabase(mock_history)
 
+    with patch("db.crud.get_async_supabase", new=AsyncMock(return_value=mock_supabase)):
         response = client.get("/history?user_id=abc123")
 
         assert response.status_code == 200
@@ -214,14 +264,14 @@ def test_complete_flow():
     }
 
     # Patch the ChatGroq model call
-    with patch.object(ChatGroq, "invoke", new=MagicMock()) as mock_model:
+    with patch.object(ChatGroq, "ainvoke", new=AsyncMock()) as mock_model:
         mock_model.side_effect = [
             type("MockResponse", (), {"content": json.dumps(mock_response)}),
             type("MockResponse", (), {"content": json.dumps(mock_response)}),
         ]
 
         # Patch the add_entry (doesn't need to do anything, just avoid real DB write)
-        with patch("db.crud.add_entry", new=MagicMock(return_value=True)) as mock_add:
+        with patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)) as mock_add:
             response = client.post("/generate", json={
                 "user_id": user_id,
                 "query": query,
@@ -241,15 +291,1743 @@ def test_complete_flow():
         "created_at": "2025-01-01T00:00:00"
     }]
 
-    # Patch the supabase client
-    with patch("db.crud.supabase") as mock_supabase:
-        mock_table = MagicMock()
-        mock_table.select.return_value.eq.return_value.order.return_value.execute.return_value.data = mock_history
-        mock_supabase.table.return_value = mock_table
+    # Patch the async supabase client
+    mock_supabase, _ = mock_async_supabase(mock_history)
 
+    with patch("db.crud.get_async_supabase", new=AsyncMock(return_value=mock_supabase)):
         history_response = client.get(f"/history?user_id={user_id}")
         assert history_response.status_code == 200
         data = history_response.json()
         assert "output" in data
         assert data["output"][0]["query"] == query
         assert data["output"][0]["casual_response"] == mock_response["casual_response"]
+
+
+def test_add_entry_async_success():
+    mock_table = MagicMock()
+    mock_table.insert.return_value.execute = AsyncMock(return_value=MagicMock(data=[{"id": 1}]))
+    mock_client = MagicMock()
+    mock_client.table.return_value = mock_table
+
+    with patch("db.crud.get_async_supabase", new=AsyncMock(return_value=mock_client)):
+        result = asyncio.run(crud.add_entry_async("user1", "query", "casual", "formal"))
+
+        mock_client.table.assert_called_once_with("prompts")
+        mock_table.insert.assert_called_once_with({
+            "user_id": "user1",
+            "query": "query",
+            "casual_response": "casual",
+            "formal_response": "formal"
+        })
+        assert result is True
+
+
+def test_generate_respects_llm_concurrency_limit():
+    mock_response = {"casual_response": "c", "formal_response": "f"}
+    state = {"active": 0, "peak": 0}
+
+    async def fake_ainvoke(self, prompt, *args, **kwargs):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        await asyncio.sleep(0.01)
+        state["active"] -= 1
+        return type("MockResponse", (), {"content": json.dumps(mock_response)})
+
+    async def run_batch():
+        return await asyncio.gather(*[
+            # Distinct queries, so single-flight does not coalesce them
+            backend.generate(backend.getInput(user_id=TEST_USER_ID, query=f"{TEST_QUERY} {i}", groq_api_key="mock_key"))
+            for i in range(6)
+        ])
+
+    with patch.object(backend, "llm_semaphore", asyncio.Semaphore(2)), \
+         patch.object(ChatGroq, "ainvoke", new=fake_ainvoke), \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)):
+        results = asyncio.run(run_batch())
+
+    assert all(r["output"] == mock_response for r in results)
+    assert state["peak"] == 2
+
+
+def test_generate_single_strategy_skips_refine():
+    mock_response = {"casual_response": "c", "formal_response": "f"}
+
+    with patch.object(ChatGroq, "ainvoke", new=AsyncMock()) as mock_model:
+        mock_model.return_value = type("MockResponse", (), {"content": json.dumps(mock_response)})
+
+        with patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)):
+            response = client.post("/generate", json={
+                "user_id": TEST_USER_ID, "query": TEST_QUERY, "groq_api_key": "mock_key", "strategy": "single"
+            })
+
+        assert response.status_code == 200
+        assert response.json()["output"] == mock_response
+        assert mock_model.call_count == 1
+
+
+def test_generate_refine_if_invalid_strategy():
+    valid = {"casual_response": "c", "formal_response": "f"}
+
+    with patch.object(ChatGroq, "ainvoke", new=AsyncMock()) as mock_model, \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)):
+        # A valid draft is returned as-is
+        mock_model.return_value = type("MockResponse", (), {"content": json.dumps(valid)})
+        response = client.post("/generate", json={
+            "user_id": TEST_USER_ID, "query": TEST_QUERY, "groq_api_key": "mock_key", "strategy": "refine-if-invalid"
+        })
+        assert response.status_code == 200
+        assert mock_model.call_count == 1
+
+        # An incomplete draft triggers the refine call
+        mock_model.reset_mock(return_value=True)
+        mock_model.side_effect = [
+            type("MockResponse", (), {"content": json.dumps({"casual_response": "c"})}),
+            type("MockResponse", (), {"content": json.dumps(valid)}),
+        ]
+        response = client.post("/generate", json={
+            "user_id": TEST_USER_ID, "query": "Explain proof of stake", "groq_api_key": "mock_key", "strategy": "refine-if-invalid"
+        })
+        assert response.status_code == 200
+        assert response.json()["output"] == valid
+        assert mock_model.call_count == 2
+
+
+def test_generate_invalid_strategy():
+    response = client.post("/generate", json={
+        "user_id": TEST_USER_ID, "query": TEST_QUERY, "groq_api_key": "mock_key", "strategy": "triple"
+    })
+    assert response.status_code == 422
+
+
+def test_generation_metrics_endpoint():
+    content = json.dumps({"casual_response": "c", "formal_response": "f"})
+    with patch.object(backend, "response_cache", None), \
+         patch.object(ChatGroq, "ainvoke", new=AsyncMock(return_value=MagicMock(content=content, usage_metadata=None))), \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)):
+        for strategy in ("single", "refine-if-invalid"):
+            assert client.post("/generate", json={
+                "user_id": TEST_USER_ID, "query": "Explain generation metrics", "groq_api_key": "mock_key", "strategy": strategy
+            }).status_code == 200
+
+    response = client.get("/metrics/generation")
+    assert response.status_code == 200
+    stats = response.json()["output"]
+    assert stats["single"]["requests"] >= 1
+    assert stats["single"]["llm_calls"] == stats["single"]["requests"]
+    assert "latency_p95" in stats["refine-if-invalid"]
+
+
+def test_generate_serves_exact_and_similar_cache_hits():
+    mock_response = {"casual_response": "c", "formal_response": "f"}
+
+    with patch.object(ChatGroq, "ainvoke", new=AsyncMock()) as mock_model, \
+         patch.object(backend.response_cache, "similarity_threshold", 0.85), \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)) as mock_add:
+        mock_model.return_value = type("MockResponse", (), {"content": json.dumps(mock_response)})
+
+        for query in ["Explain blockchain", "explain   Blockchain?", "Explain blockchains"]:
+            response = client.post("/generate", json={"user_id": TEST_USER_ID, "query": query, "groq_api_key": "mock_key"})
+            assert response.status_code == 200
+            assert response.json()["output"] == mock_response
+
+        # Only the first request reached the model (draft + refine), but every request was persisted
+        assert mock_model.call_count == 2
+        assert mock_add.call_count == 3
+
+    stats = client.get("/metrics/cache").json()["output"]
+    assert stats["exact_hits"] == 1
+    assert stats["similar_hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_response_cache_ttl_and_lru_eviction():
+    from utils.cache import InMemoryCacheBackend, ResponseCache
+
+    async def scenario():
+        cache = ResponseCache(InMemoryCacheBackend(max_entries=2), ttl=60, similarity_threshold=0)
+        await cache.set("first topic", "v1", {"n": 1})
+        await cache.set("second topic", "v1", {"n": 2})
+        await cache.get("first topic", "v1")
+        await cache.set("third topic", "v1", {"n": 3})
+
+        assert await cache.get("second topic", "v1") == (None, None)
+        assert await cache.get("first topic", "v1") == ({"n": 1}, "exact")
+        assert await cache.get("first topic", "v2") == (None, None)
+
+        expired = ResponseCache(InMemoryCacheBackend(), ttl=-1)
+        await expired.set("topic", "v1", {"n": 1})
+        assert await expired.get("topic", "v1") == (None, None)
+
+    asyncio.run(scenario())
+
+
+def test_response_cache_similarity_tier_needs_compatible_terms():
+    from utils.cache import InMemoryCacheBackend, ResponseCache
+
+    async def scenario(threshold):
+        cache = ResponseCache(InMemoryCacheBackend(), ttl=60, similarity_threshold=threshold)
+        for query in ["What caused WWI", "Is TCP faster than UDP", "Vaccines do not cause autism", "Explain blockchains"]:
+            await cache.set(query, "v1", {"query": query})
+        near_misses = ["What caused WWII", "Is UDP faster than TCP", "Vaccines do cause autism"]
+        paraphrases = ["explain blockchain", "What's a blockchain?", "Explain blockchain consensus"]
+        return [await cache.get(query, "v1") for query in near_misses], [(await cache.get(query, "v1"))[1] for query in paraphrases]
+
+    misses, tiers = asyncio.run(scenario(0.5))
+    assert misses == [(None, None)] * 3
+    assert tiers == ["similar", "similar", "similar"]
+    # The threshold limits how many words a paraphrase may add
+    assert asyncio.run(scenario(0.8))[1] == ["similar", "similar", None]
+
+
+def test_section_stream_parser_tags_sections_across_chunks():
+    from utils.parsing import SectionStreamParser
+
+    raw = json.dumps({"casual_response": 'Hi "friend"\nline', "formal_response": "Café text"}, ensure_ascii=True)
+    parser = SectionStreamParser()
+    pieces = []
+    for i in range(0, len(raw), 3):
+        pieces.extend(parser.feed(raw[i:i + 3]))
+
+    casual = "".join(text for section, text in pieces if section == "casual")
+    formal = "".join(text for section, text in pieces if section == "formal")
+    assert casual == 'Hi "friend"\nline'
+    assert formal == "Café text"
+    assert parser.buffer == raw
+
+
+def parse_sse(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_generate_stream_endpoint():
+    mock_response = {"casual_response": "Chill answer", "formal_response": "Formal answer"}
+    raw = json.dumps(mock_response)
+
+    async def fake_astream(self, prompt, *args, **kwargs):
+        for i in range(0, len(raw), 5):
+            yield type("MockChunk", (), {"content": raw[i:i + 5]})
+
+    with patch.object(ChatGroq, "astream", new=fake_astream), \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)) as mock_add:
+        response = client.post("/generate/stream", json={
+            "user_id": TEST_USER_ID, "query": TEST_QUERY, "groq_api_key": "mock_key", "strategy": "single"
+        })
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    tokens = [data for event, data in events if event == "token"]
+    assert "".join(t["text"] for t in tokens if t["section"] == "casual") == "Chill answer"
+    assert "".join(t["text"] for t in tokens if t["section"] == "formal") == "Formal answer"
+    assert events[-1] == ("done", {"output": mock_response})
+    mock_add.assert_called_once()
+
+
+def test_generate_stream_reports_auth_error():
+    import groq
+
+    async def failing_astream(self, prompt, *args, **kwargs):
+        raise groq.AuthenticationError("bad key", response=MagicMock(), body=None)
+        yield
+
+    with patch.object(ChatGroq, "astream", new=failing_astream):
+        response = client.post("/generate/stream", json={
+            "user_id": TEST_USER_ID, "query": TEST_QUERY, "groq_api_key": "bad_key"
+        })
+
+    events = parse_sse(response.text)
+    assert events[-1][0] == "error"
+    assert events[-1][1]["status"] == 401
+
+
+def test_history_pagination_and_projection():
+    rows = [
+        {"id": 3, "query": "c", "created_at": "2025-01-03T00:00:00"},
+        {"id": 2, "query": "b", "created_at": "2025-01-02T00:00:00"},
+        {"id": 1, "query": "a", "created_at": "2025-01-01T00:00:00"},
+    ]
+    mock_client, query = mock_async_supabase(rows)
+
+    with patch("db.crud.get_async_supabase", new=AsyncMock(return_value=mock_client)):
+        response = client.get("/history?user_id=abc123&limit=2&fields=query")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["output"] == rows[:2]
+        assert data["next_cursor"] == backend.encode_cursor(rows[1])
+        query.select.assert_called_with("id,created_at,query")
+        query.limit.assert_called_with(3)
+
+        response = client.get(f"/history?user_id=abc123&limit=2&cursor={data['next_cursor']}")
+        assert response.status_code == 200
+        query.or_.assert_called_once_with('created_at.lt."2025-01-02T00:00:00",and(created_at.eq."2025-01-02T00:00:00",id.lt.2)')
+
+    assert client.get("/history?user_id=abc123&fields=password").status_code == 422
+    assert client.get("/history?user_id=abc123&cursor=garbage").status_code == 400
+    # Cursors and `since` are checked before they reach the `or_()` / `gt()` filters
+    injected = base64.urlsafe_b64encode(json.dumps(['2025-01-02",id.gt.0,created_at.lt."9999', 2]).encode()).decode()
+    assert client.get(f"/history?user_id=abc123&cursor={injected}").status_code == 400
+    string_id = base64.urlsafe_b64encode(json.dumps(["2025-01-02T00:00:00", "2) or (1"]).encode()).decode()
+    assert client.get(f"/history?user_id=abc123&cursor={string_id}").status_code == 400
+    assert client.get("/history", params={"user_id": "abc123", "since": "2025-01-01,id.gt.0"}).status_code == 400
+
+
+def test_history_entry_endpoint():
+    record = {"id": 7, "query": "What is AI?", "casual_response": "c", "formal_response": "f", "created_at": "2025-01-01T00:00:00"}
+
+    mock_client, query = mock_async_supabase([record])
+    with patch("db.crud.get_async_supabase", new=AsyncMock(return_value=mock_client)):
+        response = client.get("/history/7?user_id=abc123")
+        assert response.status_code == 200
+        assert response.json()["output"] == record
+        query.eq.assert_any_call("id", 7)
+
+    mock_client, _ = mock_async_supabase([])
+    with patch("db.crud.get_async_supabase", new=AsyncMock(return_value=mock_client)):
+        assert client.get("/history/8?user_id=abc123").status_code == 404
+
+
+def test_history_cache_incremental_sync_and_detail_memoization():
+    from frontend.history_cache import HistoryCache
+
+    server_rows = [{"id": 1, "query": "a", "created_at": "2025-01-01T00:00:00"}]
+    requests_made = []
+
+    def fetch_page(params):
+        requests_made.append(params)
+        rows = [r for r in server_rows if "since" not in params or r["created_at"] > params["since"]]
+        return {"output": sorted(rows, key=lambda r: r["created_at"], reverse=True), "next_cursor": None}
+
+    cache = HistoryCache()
+    cache.sync(fetch_page)
+    assert [r["id"] for r in cache.records] == [1]
+    assert requests_made[-1] == {"limit": 50, "fields": "id,query,created_at"}
+
+    # A write-behind save lands after the first sync: the cache stays stale until it shows up
+    cache.mark_stale()
+    cache.sync(fetch_page)
+    assert cache.stale and [r["id"] for r in cache.records] == [1]
+    assert [cache.next_retry() for _ in range(5)] == [0.5, 1, 2, 4, None]
+    server_rows.append({"id": 2, "query": "b", "created_at": "2025-01-02T00:00:00"})
+    cache.sync(fetch_page)
+    assert not cache.stale and [r["id"] for r in cache.records] == [2, 1]
+    assert requests_made[-1]["since"] == "2025-01-01T00:00:00"
+
+    # A save that never lands stops the retries after `pending_timeout`
+    cache.pending_timeout = 0
+    cache.mark_stale()
+    cache.sync(fetch_page)
+    assert not cache.stale and cache.pending == 0
+
+    fetch_entry = MagicMock(return_value={"id": 1, "query": "a", "casual_response": "c", "formal_response": "f"})
+    assert cache.get_detail(1, fetch_entry)["casual_response"] == "c"
+    cache.get_detail(1, fetch_entry)
+    fetch_entry.assert_called_once_with(1)
+
+
+def test_history_view_buckets_once_and_windows_rows():
+    from datetime import date
+    from frontend import history_view
+    from frontend.history_view import HistoryView
+
+    records = [
+        {"id": 5, "query": "e", "created_at": "2025-03-10T09:00:00.12Z"},
+        {"id": 4, "query": "d", "created_at": "2025-03-09T23:59:59.5"},
+        {"id": 3, "query": "c", "created_at": "2025-03-06T10:00:00"},
+        {"id": 2, "query": "b", "created_at": "2025-03-01T10:00:00.123456"},
+        {"id": 1, "query": "a", "created_at": "2024-12-31T10:00:00"},
+    ]
+    today = date(2025, 3, 10)
+    view = HistoryView(window=3)
+
+    with patch.object(history_view, "parse_date_isoformat", wraps=history_view.parse_date_isoformat) as parse:
+        view.refresh(records, version=1, today=today)
+        assert parse.call_count == 5
+        assert [(label, [c["id"] for c in chats]) for label, chats in view.groups] == [
+            ("Today", [5]), ("Yesterday", [4]), ("This week", [3]), ("Older", [2, 1]),
+        ]
+
+        # Reruns without changes do no work; new chats are the only ones parsed
+        view.refresh(records, version=1, today=today)
+        assert parse.call_count == 5
+        records = [{"id": 6, "query": "f", "created_at": "2025-03-10T10:00:00"}] + records
+        view.refresh(records, version=2, today=today)
+        assert parse.call_count == 6
+
+    assert [(label, [c["id"] for c in chats]) for label, chats in view.visible()] == [("Today", [6, 5]), ("Yesterday", [4])]
+    assert view.has_hidden
+    view.show_more()
+    assert sum(len(chats) for _, chats in view.visible()) == 6 and not view.has_hidden
+    assert history_view.parse_date_isoformat(records[2]["created_at"]).microsecond == 500000
+
+
+def test_history_since_filter():
+    mock_client, query = mock_async_supabase([])
+    with patch("db.crud.get_async_supabase", new=AsyncMock(return_value=mock_client)):
+        response = client.get("/history?user_id=abc123&since=2025-01-01T00:00:00")
+    assert response.status_code == 200
+    query.gt.assert_called_once_with("created_at", "2025-01-01T00:00:00")
+
+
+def test_api_client_pooling_timeouts_and_retries():
+    from frontend.api_client import ApiClient
+
+    with patch.dict(os.environ, {"BACKEND_URL": "http://backend.local/", "API_READ_TIMEOUT": "30", "API_RETRIES": "2"}):
+        api = ApiClient.from_env()
+
+    assert api.base_url == "http://backend.local"
+    assert api.timeout == (5.0, 30.0)
+    adapter = api.session.get_adapter("http://backend.local/history")
+    assert adapter.max_retries.total == 2
+    assert "POST" not in adapter.max_retries.allowed_methods
+
+    with patch.object(api.session, "get") as mock_get:
+        mock_get.return_value.json.return_value = {"output": [], "next_cursor": None}
+        assert api.get_history_page("abc123", {"limit": 10}) == {"output": [], "next_cursor": None}
+        mock_get.assert_called_once_with(
+            "http://backend.local/history", params={"user_id": "abc123", "limit": 10}, timeout=(5.0, 30.0)
+        )
+
+
+def test_model_registry_reuses_and_evicts_clients():
+    from utils.models import ModelRegistry
+
+    factory = MagicMock(side_effect=lambda **kwargs: object())
+    registry = ModelRegistry(max_size=2, idle_ttl=900, factory=factory)
+
+    first = registry.get("key-a", "model")
+    assert registry.get("key-a", "model") is first
+    assert registry.get("key-a", "model", temperature=0.2) is not first
+    registry.get("key-b", "model")  # evicts the least recently used ("key-a", "model")
+    assert registry.get("key-a", "model") is not first
+
+    assert registry.snapshot() == {"hits": 1, "misses": 4, "evictions": 2, "size": 2}
+    assert not any("key-" in key for key in registry._clients)
+
+    idle = ModelRegistry(idle_ttl=-1, factory=factory)
+    client_a = idle.get("key-a", "model")
+    assert idle.get("key-a", "model") is not client_a
+
+
+def test_generate_reuses_model_client_and_drops_rejected_key():
+    import groq
+
+    mock_response = {"casual_response": "c", "formal_response": "f"}
+    from utils.models import ModelRegistry
+
+    registry = ModelRegistry(factory=MagicMock(side_effect=lambda **kwargs: MagicMock()))
+    payload = {"user_id": TEST_USER_ID, "groq_api_key": "mock_key", "strategy": "single"}
+
+    with patch.object(backend, "model_registry", registry), \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)):
+        model = backend.model_registry.get("mock_key", backend.config.MODEL_NAME)
+        model.ainvoke = AsyncMock(return_value=type("MockResponse", (), {"content": json.dumps(mock_response)}))
+        assert client.post("/generate", json={**payload, "query": "Explain AI"}).status_code == 200
+        assert client.post("/generate", json={**payload, "query": "Explain databases"}).status_code == 200
+        assert model.ainvoke.call_count == 2
+
+        model.ainvoke = AsyncMock(side_effect=groq.AuthenticationError("bad key", response=MagicMock(), body=None))
+        assert client.post("/generate", json={**payload, "query": "Explain compilers"}).status_code == 401
+        assert backend.model_registry.get("mock_key", backend.config.MODEL_NAME) is not model
+
+
+def test_generate_batch_reports_per_item_results_and_bulk_inserts():
+    async def fake_ainvoke(self, prompt, *args, **kwargs):
+        if "Break me" in prompt:
+            return type("MockResponse", (), {"content": "not json"})
+        return type("MockResponse", (), {"content": json.dumps({"casual_response": "c", "formal_response": "f"})})
+
+    with patch.object(ChatGroq, "ainvoke", new=fake_ainvoke), \
+         patch("db.crud.add_entries_async", new=AsyncMock(return_value=True)) as mock_add:
+        response = client.post("/generate/batch", json={
+            "user_id": TEST_USER_ID, "groq_api_key": "mock_key", "strategy": "single",
+            "queries": ["Explain AI", "Break me", "Explain databases"],
+        })
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["status"] for item in data["output"]] == ["ok", "error", "ok"]
+    assert data["persisted"] == 2
+    mock_add.assert_called_once_with(TEST_USER_ID, [
+        {"query": "Explain AI", "casual_response": "c", "formal_response": "f", "prompt_version": "draft@3"},
+        {"query": "Explain databases", "casual_response": "c", "formal_response": "f", "prompt_version": "draft@3"},
+    ])
+
+
+def test_generate_batch_streams_ndjson():
+    mock_response = {"casual_response": "c", "formal_response": "f"}
+
+    with patch.object(ChatGroq, "ainvoke", new=AsyncMock(return_value=type("MockResponse", (), {"content": json.dumps(mock_response)}))), \
+         patch("db.crud.add_entries_async", new=AsyncMock(return_value=True)):
+        response = client.post("/generate/batch", json={
+            "user_id": TEST_USER_ID, "groq_api_key": "mock_key", "stream": True,
+            "queries": ["Explain AI", "Explain databases"],
+        })
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["index"] for line in lines[:-1]) == [0, 1]
+    assert lines[-1] == {"persisted": 2}
+
+
+def test_generate_batch_saves_finished_items_when_cut_short():
+    from schemas import BatchInput
+
+    async def fake_ainvoke(self, prompt, *args, **kwargs):
+        if "Slow" in prompt:
+            await asyncio.sleep(5)
+        return type("MockResponse", (), {"content": json.dumps({"casual_response": "c", "formal_response": "f"})})
+
+    async def cut_short():
+        batch = BatchInput(user_id=TEST_USER_ID, groq_api_key="mock_key", strategy="single", queries=["Explain AI", "Slow one"])
+        task = asyncio.create_task(backend.generate_batch(batch))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    with patch.object(ChatGroq, "ainvoke", new=fake_ainvoke), \
+         patch("db.crud.add_entries_async", new=AsyncMock(return_value=True)) as mock_add:
+        asyncio.run(cut_short())
+
+    mock_add.assert_called_once()
+    assert [entry["query"] for entry in mock_add.call_args.args[1]] == ["Explain AI"]
+
+
+def test_generate_batch_charges_every_item_and_shares_pacing_per_key():
+    from utils.store import InMemorySharedStore
+
+    in_flight, peak = 0, 0
+
+    async def fake_ainvoke(self, prompt, *args, **kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        return type("MockResponse", (), {"content": json.dumps({"casual_response": "c", "formal_response": "f"})})
+
+    async def two_batches():
+        from schemas import BatchInput
+        batches = [BatchInput(user_id=f"batcher-{n}", groq_api_key="shared_key", strategy="single", queries=[f"Explain {n}-{i}" for i in range(4)])
+                   for n in range(2)]
+        return await asyncio.gather(*(backend.generate_batch(batch) for batch in batches))
+
+    with patch.object(ChatGroq, "ainvoke", new=fake_ainvoke), \
+         patch("db.crud.add_entries_async", new=AsyncMock(return_value=True)), \
+         patch.object(backend, "batch_pacer", backend.KeyedPacer(2, 0)):
+        asyncio.run(two_batches())
+        assert peak == 2 and not backend.batch_pacer._entries
+
+        # Each of the three items takes a token, so the user's bucket of three is empty afterwards
+        with patch.object(backend.user_limiter, "rate", 1 / 60), patch.object(backend.user_limiter, "burst", 3), \
+             patch.object(backend.user_limiter, "store", InMemorySharedStore()):
+            response = client.post("/generate/batch", json={"user_id": "batch-limited", "groq_api_key": "mock_key", "queries": ["a", "b", "c"]})
+            assert response.status_code == 200
+            assert client.post("/generate", json={"user_id": "batch-limited", "query": "d", "groq_api_key": "mock_key"}).status_code == 429
+
+
+def test_generate_batch_limits():
+    assert client.post("/generate/batch", json={"user_id": TEST_USER_ID, "groq_api_key": "k", "queries": []}).status_code == 422
+    with patch.object(backend.config, "BATCH_MAX_QUERIES", 1):
+        response = client.post("/generate/batch", json={"user_id": TEST_USER_ID, "groq_api_key": "k", "queries": ["a", "b"]})
+    assert response.status_code == 422
+
+
+def test_async_rate_limiter_spaces_acquisitions():
+    from utils.ratelimit import AsyncRateLimiter
+    import time
+
+    async def acquire_all():
+        limiter = AsyncRateLimiter(50)
+        start = time.monotonic()
+        for _ in range(5):
+            await limiter.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(acquire_all()) >= 0.075
+
+
+def test_write_behind_queue_batches_retries_and_spools(tmp_path):
+    from db.writer import WriteBehindQueue
+
+    spool = str(tmp_path / "spool.jsonl")
+    flushed = []
+    outcomes = []
+
+    async def flush(rows):
+        if outcomes and outcomes.pop(0):
+            return RuntimeError("database unreachable")
+        flushed.append(list(rows))
+        return True
+
+    async def scenario():
+        queue = WriteBehindQueue(flush, spool, batch_size=2, flush_interval=0.05, max_retries=1, retry_backoff=0)
+        await queue.start()
+
+        # Size-triggered and time-triggered flushes
+        for i in range(3):
+            await queue.enqueue({"n": i})
+        await asyncio.sleep(0.15)
+        assert flushed == [[{"n": 0}, {"n": 1}], [{"n": 2}]]
+
+        # Both attempts fail -> the row is spooled to disk
+        outcomes.extend([True, True])
+        await queue.enqueue({"n": 3})
+        await asyncio.sleep(0.15)
+        assert queue.snapshot()["spool_rows"] == 1
+
+        # The next successful flush replays the spool; stop() drains the rest
+        await queue.enqueue({"n": 4})
+        await queue.enqueue({"n": 5})
+        await queue.stop()
+        return queue.snapshot()
+
+    stats = asyncio.run(scenario())
+    assert [row["n"] for batch in flushed for row in batch] == [0, 1, 2, 4, 5, 3]
+    assert stats["failed_flushes"] == 2
+    assert stats["replayed"] == 1
+    assert stats["spool_rows"] == 0
+    assert stats["queue_depth"] == 0
+
+
+def _spool_rows(spool, worker):
+    from db.writer import WriteBehindQueue
+
+    queue = WriteBehindQueue(None, spool)
+    for n in range(50):
+        queue._spool([{"worker": worker, "n": n}])
+
+
+def test_write_behind_spool_is_shared_safely_between_processes(tmp_path):
+    import multiprocessing
+    from db.writer import WriteBehindQueue
+
+    spool = str(tmp_path / "spool.jsonl")
+    reader = WriteBehindQueue(None, spool)
+    workers = [multiprocessing.get_context("fork").Process(target=_spool_rows, args=(spool, i)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    taken = []
+    while any(worker.is_alive() for worker in workers):
+        taken.extend(reader._take_spool())
+    for worker in workers:
+        worker.join()
+    taken.extend(reader._take_spool())
+
+    # Every row is taken exactly once, whatever the interleaving of appends and takes
+    assert sorted((row["worker"], row["n"]) for row in taken) == [(w, n) for w in range(4) for n in range(50)]
+
+
+def test_generate_uses_write_behind_queue_when_app_is_running():
+    mock_response = {"casual_response": "c", "formal_response": "f"}
+
+    with patch.object(ChatGroq, "ainvoke", new=AsyncMock(return_value=type("MockResponse", (), {"content": json.dumps(mock_response)}))), \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)) as mock_add, \
+         patch.object(backend.write_queue, "_flush", new=AsyncMock(return_value=True)) as mock_flush:
+        with TestClient(app) as running_client:
+            response = running_client.post("/generate", json={"user_id": TEST_USER_ID, "query": TEST_QUERY, "groq_api_key": "mock_key"})
+            assert response.status_code == 200
+            assert running_client.get("/metrics/persistence").json()["output"]["write_behind"] is True
+
+    mock_add.assert_not_called()
+    mock_flush.assert_called_once_with([{
+        "user_id": TEST_USER_ID, "query": TEST_QUERY, "casual_response": "c", "formal_response": "f", "prompt_version": "draft@3+refine@2",
+    }])
+
+
+MALFORMED_OUTPUTS = json.load(open(os.path.join(os.path.dirname(__file__), "malformed_outputs.json"), encoding="utf-8"))
+
+
+@pytest.mark.parametrize("case", MALFORMED_OUTPUTS, ids=[case["name"] for case in MALFORMED_OUTPUTS])
+def test_parse_model_output_corpus(case):
+    from utils.parsing import parse_model_output
+
+    if case["expected"] is None:
+        with pytest.raises(ValueError):
+            parse_model_output(case["raw"])
+    else:
+        assert parse_model_output(case["raw"]) == case["expected"]
+
+
+@pytest.mark.parametrize("case", [c for c in MALFORMED_OUTPUTS if c["expected"] is not None], ids=lambda c: c["name"])
+def test_incremental_json_parser_matches_one_shot(case):
+    from utils.parsing import IncrementalJSONParser, extract_json
+
+    parser = IncrementalJSONParser()
+    result = None
+    for i in range(0, len(case["raw"]), 7):
+        result = parser.feed(case["raw"][i:i + 7])
+    if result is None:
+        result = parser.close()
+    assert {k: result[k] for k in ("casual_response", "formal_response")} == case["expected"]
+    assert result == extract_json(case["raw"])
+
+
+def test_json_parsing_gives_up_after_a_bounded_number_of_candidates():
+    from utils.parsing import MAX_CANDIDATES, IncrementalJSONParser, extract_json
+
+    parser = IncrementalJSONParser()
+    parser.feed("x {" * 4000)
+    with pytest.raises(ValueError):
+        parser.close()
+    assert parser._candidates == MAX_CANDIDATES
+    with pytest.raises(ValueError):
+        extract_json("x {" * 4000)
+
+
+def test_generate_refines_unparseable_draft():
+    valid = {"casual_response": "c", "formal_response": "f"}
+
+    with patch.object(ChatGroq, "ainvoke", new=AsyncMock()) as mock_model, \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)):
+        mock_model.side_effect = [
+            type("MockResponse", (), {"content": "I'm sorry, I can't do that."}),
+            type("MockResponse", (), {"content": "Here you go:\n" + json.dumps(valid) + "\nHope this helps!"}),
+        ]
+        response = client.post("/generate", json={
+            "user_id": TEST_USER_ID, "query": TEST_QUERY, "groq_api_key": "mock_key", "strategy": "refine-if-invalid"
+        })
+
+    assert response.status_code == 200
+    assert response.json()["output"] == valid
+
+
+def test_stub_llm_streams_and_injects_errors():
+    from benchmarks.stub_llm import create_stub_app, STUB_CONTENT
+
+    body = {"model": "stub", "messages": [{"role": "user", "content": "Explain blockchain"}]}
+    stub_client = TestClient(create_stub_app(latency=0))
+
+    response = stub_client.post("/openai/v1/chat/completions", json=body)
+    assert response.json()["choices"][0]["message"]["content"] == STUB_CONTENT
+
+    response = stub_client.post("/openai/v1/chat/completions", json={**body, "stream": True})
+    events = [line[len("data: "):] for line in response.text.splitlines() if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    assert "".join(json.loads(e)["choices"][0]["delta"].get("content", "") for e in events[:-1]) == STUB_CONTENT
+
+    response = stub_client.post("/openai/v1/chat/completions", json=body, headers={"Authorization": "Bearer invalid-key"})
+    assert response.status_code == 401
+
+    failing = TestClient(create_stub_app(latency=0, error_rate=1, error_status=429))
+    response = failing.post("/openai/v1/chat/completions", json=body)
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+
+
+def test_metrics_registry_renders_prometheus_text():
+    from utils.metrics import MetricsRegistry
+
+    registry = MetricsRegistry()
+    latency = registry.histogram("stage_seconds", "Stage latency.", ("stage",), buckets=(0.1, 1))
+    tokens = registry.counter("tokens_total", "Tokens.", ("kind",))
+    registry.gauge("depth", "Queue depth.", lambda: {(): 3})
+
+    latency.observe(0.05, stage="llm_draft")
+    latency.observe(0.5, stage="llm_draft")
+    tokens.inc(7, kind='in"put')
+    text = registry.render()
+
+    assert 'stage_seconds_bucket{stage="llm_draft",le="0.1"} 1' in text
+    assert 'stage_seconds_bucket{stage="llm_draft",le="+Inf"} 2' in text
+    assert 'stage_seconds_count{stage="llm_draft"} 2' in text
+    assert 'tokens_total{kind="in\\"put"} 7' in text
+    assert "# TYPE depth gauge\ndepth 3" in text
+
+
+def test_generate_records_stage_spans_tokens_and_request_id():
+    from utils.tracing import STAGE_SECONDS, LLM_TOKENS
+
+    content = json.dumps({"casual_response": "c", "formal_response": "f"})
+    usage = {"input_tokens": 11, "output_tokens": 5, "total_tokens": 16}
+    model = backend.config.MODEL_NAME
+    drafts_before = STAGE_SECONDS.count(stage="llm_draft", model=model)
+    input_before = LLM_TOKENS.value(stage="refine", model=model, kind="input")
+
+    with patch.object(ChatGroq, "ainvoke", new=AsyncMock(return_value=MagicMock(content=content, usage_metadata=usage))), \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)):
+        response = client.post(
+            "/generate",
+            json={"user_id": TEST_USER_ID, "query": "Explain tracing", "groq_api_key": "mock_key", "strategy": "refine"},
+            headers={"X-Request-ID": "req-42"},
+        )
+
+    assert response.status_code == 200
+    assert response.headers["x-request-id"] == "req-42"
+    assert STAGE_SECONDS.count(stage="llm_draft", model=model) == drafts_before + 1
+    assert LLM_TOKENS.value(stage="refine", model=model, kind="input") == input_before + 11
+
+    text = client.get("/metrics").text
+    assert f'generate_stage_seconds_count{{stage="parse",model="{model}"}}' in text
+    assert 'http_request_seconds_count{method="POST",route="/generate",status="200"}' in text
+    assert "write_queue_depth" in text
+    assert client.get("/health").headers["x-request-id"]
+
+
+def test_profiler_endpoints_are_gated_and_collect_samples():
+    assert client.post("/debug/profiler/start").status_code == 404
+
+    with patch.object(backend.config, "PROFILER_ENABLED", True):
+        assert client.post("/debug/profiler/start", params={"interval": 0.001}).json()["output"]["running"]
+        time.sleep(0.05)
+        report = client.post("/debug/profiler/stop").json()["output"]
+
+    assert not report["running"]
+    assert report["samples"] > 0
+    assert any("test_profiler_endpoints" in s["stack"] for s in report["stacks"])
+
+
+def test_profiler_report_while_sampling():
+    from utils.profiler import SamplingProfiler
+
+    profiler = SamplingProfiler()
+    profiler.start(interval=0.0005)
+    try:
+        # Threads with changing stacks keep adding new keys while reports are built
+        workers = [threading.Thread(target=lambda: [time.sleep(0.0001) for _ in range(300)]) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        reports = [profiler.report() for _ in range(300)]
+        for worker in workers:
+            worker.join()
+    finally:
+        profiler.stop()
+    totals = [report["samples"] for report in reports] + [profiler.report()["samples"]]
+    assert totals == sorted(totals) and totals[-1] > 0
+
+
+def test_identical_concurrent_queries_share_one_generation():
+    content = json.dumps({"casual_response": "c", "formal_response": "f"})
+    calls = []
+
+    async def fake_ainvoke(self, prompt, *args, **kwargs):
+        calls.append(prompt)
+        await asyncio.sleep(0.02)
+        return type("MockResponse", (), {"content": content})
+
+    async def run_burst():
+        return await asyncio.gather(*[
+            backend.generate(backend.getInput(user_id=f"user{i}", query="Explain  coalescing?", groq_api_key=f"key{i}"))
+            for i in range(5)
+        ])
+
+    with patch.object(ChatGroq, "ainvoke", new=fake_ainvoke), \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)) as mock_add:
+        results = asyncio.run(run_burst())
+
+    assert all(r["output"] == json.loads(content) for r in results)
+    assert len(calls) == 2  # one draft + one refine for all five requests
+    assert mock_add.await_count == 5
+
+
+def test_single_flight_followers_retry_leader_errors_and_wait_across_workers():
+    from utils.singleflight import SingleFlight
+    from utils.store import InMemorySharedStore
+
+    class LeaderError(Exception):
+        pass
+
+    async def scenario():
+        flight = SingleFlight(InMemorySharedStore())
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise LeaderError()
+
+        async def own():
+            return "own"
+
+        leader = asyncio.ensure_future(flight.run("k", failing))
+        await asyncio.sleep(0)
+        follower = await flight.run("k", own, retry_on=(LeaderError,))
+        with pytest.raises(LeaderError):
+            await leader
+
+        # Two "workers" sharing a store: the second polls for the first one's result
+        store, results = InMemorySharedStore(), {}
+        worker_a = SingleFlight(store)
+        worker_b = SingleFlight(store, poll_interval=0.005)
+
+        async def produce_a():
+            await asyncio.sleep(0.03)
+            results["k"] = "from-a"
+            return "from-a"
+
+        async def produce_b():
+            return "from-b"
+
+        async def lookup():
+            return results.get("k")
+
+        first = asyncio.ensure_future(worker_a.run("k", produce_a))
+        await asyncio.sleep(0.005)
+        second = await worker_b.run("k", produce_b, lookup=lookup)
+        return follower, await first, second, worker_b.stats["remote_waits"]
+
+    assert asyncio.run(scenario()) == ("own", "from-a", "from-a", 1)
+
+
+def test_token_bucket_limits_per_key_and_user_with_retry_after():
+    from utils.store import InMemorySharedStore
+    from utils.ratelimit import TokenBucketLimiter
+
+    limiter = TokenBucketLimiter(InMemorySharedStore(), rate=1, burst=2, prefix="user:")
+
+    async def checks():
+        return [await limiter.check(key) for key in ("a", "a", "a", "b")]
+
+    first, second, third, other = asyncio.run(checks())
+    assert first == 0 and second == 0
+    assert 0.9 < third <= 1
+    assert other == 0
+
+    content = json.dumps({"casual_response": "c", "formal_response": "f"})
+    with patch.object(backend.user_limiter, "rate", 1 / 60), patch.object(backend.user_limiter, "burst", 1), \
+         patch.object(backend.user_limiter, "store", InMemorySharedStore()), \
+         patch.object(ChatGroq, "ainvoke", new=AsyncMock(return_value=MagicMock(content=content))), \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)):
+        payload = {"user_id": "limited-user", "query": "Explain limits", "groq_api_key": "mock_key"}
+        assert client.post("/generate", json=payload).status_code == 200
+        response = client.post("/generate/stream", json=payload)
+
+    assert response.status_code == 429
+    assert 55 <= int(response.headers["retry-after"]) <= 60
+
+
+def test_upstream_rate_limit_maps_to_429():
+    import httpx
+
+    error = groq.RateLimitError(
+        "Rate limit reached",
+        response=httpx.Response(429, headers={"retry-after": "7"}, request=httpx.Request("POST", "http://groq")),
+        body=None,
+    )
+    with patch.object(ChatGroq, "ainvoke", new=AsyncMock(side_effect=error)):
+        response = client.post("/generate", json={"user_id": TEST_USER_ID, "query": "Explain 429s", "groq_api_key": "mock_key"})
+
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "7"
+
+
+def test_load_routes_from_env_and_file(tmp_path):
+    from types import SimpleNamespace
+    from utils.router import load_routes
+
+    settings = SimpleNamespace(
+        MODEL_NAME="big", MODEL_FALLBACKS="medium:12, small", REFINE_MODEL_NAME="small:5",
+        MODEL_TIMEOUT=30, MODEL_ROUTES_FILE="",
+    )
+    routes = load_routes(settings)
+    assert routes["draft"] == [{"name": "big", "timeout": 30}, {"name": "medium", "timeout": 12}, {"name": "small", "timeout": 30}]
+    assert [m["name"] for m in routes["refine"]] == ["small", "big", "medium"]
+    assert routes["refine"][0]["timeout"] == 5
+
+    routes_file = tmp_path / "routes.json"
+    routes_file.write_text(json.dumps({"draft": [{"name": "a", "timeout": 3}, "b"]}))
+    settings.MODEL_ROUTES_FILE = str(routes_file)
+    routes = load_routes(settings)
+    assert routes["draft"] == [{"name": "a", "timeout": 3.0}, {"name": "b", "timeout": 30}]
+    assert routes["refine"] == routes["draft"]
+
+
+def test_model_router_orders_by_p95_and_cooldown():
+    from utils.router import ModelRouter
+
+    chain = [{"name": "a", "timeout": 1}, {"name": "b", "timeout": 1}, {"name": "c", "timeout": 1}]
+    router = ModelRouter({"draft": chain, "refine": chain}, latency_aware=True, cooldown=60, min_samples=3)
+    assert [m["name"] for m in router.candidates("draft")] == ["a", "b", "c"]
+
+    for _ in range(3):
+        router.record("draft", "a", "ok", 2.0)
+        router.record("draft", "b", "ok", 0.5)
+    assert [m["name"] for m in router.candidates("draft")] == ["b", "a", "c"]
+    assert [m["name"] for m in router.candidates("refine")] == ["a", "b", "c"]
+
+    router.record("draft", "b", "timeout")
+    assert [m["name"] for m in router.candidates("draft")] == ["a", "c", "b"]
+    assert router.snapshot()["draft"][1]["outcomes"] == {"ok": 3, "timeout": 1}
+
+
+def test_model_router_reprobes_unsampled_primary_and_scopes_rate_limits_per_key():
+    from utils.router import ModelRouter
+
+    chain = [{"name": "primary", "timeout": 1}, {"name": "fallback", "timeout": 1}]
+    router = ModelRouter({"draft": chain, "refine": chain}, latency_aware=True, cooldown=60, min_samples=3)
+    for _ in range(3):
+        router.record("draft", "fallback", "ok", 0.5)
+    # The fallback served while the primary cooled down; the unsampled primary keeps its place
+    assert [m["name"] for m in router.candidates("draft")] == ["primary", "fallback"]
+
+    router.record("draft", "primary", "rate_limited", api_key="key-a")
+    assert [m["name"] for m in router.candidates("draft", "key-a")] == ["fallback", "primary"]
+    assert [m["name"] for m in router.candidates("draft", "key-b")] == ["primary", "fallback"]
+    assert router.snapshot()["draft"][0]["cooling_down"] is False
+
+
+def test_generate_falls_back_to_next_model_on_timeout():
+    from utils.router import ModelRouter
+
+    content = json.dumps({"casual_response": "c", "formal_response": "f"})
+    chain = [{"name": "slow-model", "timeout": 0.05}, {"name": "fast-model", "timeout": 1}]
+    router = ModelRouter({"draft": chain, "refine": chain})
+    used = []
+
+    async def fake_ainvoke(self, prompt, *args, **kwargs):
+        used.append(self.model_name)
+        if self.model_name == "slow-model":
+            await asyncio.sleep(1)
+        return MagicMock(content=content, usage_metadata=None)
+
+    with patch.object(backend, "model_router", router), \
+         patch.object(ChatGroq, "ainvoke", new=fake_ainvoke), \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)):
+        response = client.post("/generate", json={
+            "user_id": TEST_USER_ID, "query": "Explain fallbacks", "groq_api_key": "mock_key", "strategy": "refine"
+        })
+        routing = client.get("/metrics/routing").json()["output"]
+
+    assert response.status_code == 200
+    # The slow model times out on the draft and is cooling down for the refine
+    assert used == ["slow-model", "fast-model", "fast-model"]
+    assert backend.MODEL_FALLBACKS.value(phase="draft", model="slow-model", reason="timeout") >= 1
+    assert routing["order"]["refine"] == ["fast-model", "slow-model"]
+    assert routing["draft"][0]["outcomes"] == {"timeout": 1}
+
+
+def test_generate_stream_falls_back_before_first_token():
+    import httpx
+    from utils.router import ModelRouter
+
+    chain = [{"name": "down-model", "timeout": 1}, {"name": "up-model", "timeout": 1}]
+    content = json.dumps({"casual_response": "c", "formal_response": "f"})
+
+    async def fake_astream(self, prompt, *args, **kwargs):
+        if self.model_name == "down-model":
+            raise groq.InternalServerError(
+                "upstream down", response=httpx.Response(503, request=httpx.Request("POST", "http://groq")), body=None
+            )
+        yield MagicMock(content=content, usage_metadata=None)
+
+    with patch.object(backend, "model_router", ModelRouter({"draft": chain, "refine": chain})), \
+         patch.object(ChatGroq, "astream", new=fake_astream), \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)):
+        response = client.post("/generate/stream", json={
+            "user_id": TEST_USER_ID, "query": "Explain streaming fallback", "groq_api_key": "mock_key", "strategy": "single"
+        })
+
+    events = parse_sse(response.text)
+    assert events[-1] == ("done", {"output": json.loads(content)})
+
+
+def test_conversation_context_budget_ranking_and_summary_cache():
+    from utils.context import ConversationContext, estimate_tokens
+
+    assert 8 <= estimate_tokens("Blockchain is a distributed, append-only ledger.") <= 14
+
+    filler = "Some unrelated details about the weather and gardening. " * 3
+    turns = [
+        {"id": 6, "query": "And who invented it?", "casual_response": "Satoshi Nakamoto, probably."},
+        {"id": 5, "query": "Explain bitcoin", "casual_response": "Digital money on a blockchain. " + filler},
+        {"id": 4, "query": "Tips for growing tomatoes", "casual_response": "Lots of sun. " + filler},
+        {"id": 3, "query": "Best soil for roses", "casual_response": "Loamy soil. " + filler},
+        {"id": 2, "query": "Explain blockchain consensus", "casual_response": "Nodes agree on one history. " + filler},
+        {"id": 1, "query": "What is photosynthesis", "casual_response": "Plants eat light. " + filler},
+    ]
+    context = ConversationContext(token_budget=45, recent_turns=1)
+    block = context.build(turns, "How does blockchain consensus scale?")
+
+    assert estimate_tokens(block) <= 45 + 12  # section headers are outside the budget
+    assert "User: And who invented it?" in block
+    assert "Explain blockchain consensus → Nodes agree on one history." in block
+    assert "photosynthesis" not in block
+    assert block.index("Summary of earlier turns") < block.index("Most recent turns")
+
+    context.build(turns, "How does blockchain consensus scale?")
+    assert context.stats == {"summary_hits": 5, "summary_misses": 5}
+    assert context.build([], "anything") == ""
+
+
+def test_generate_conversation_mode_adds_history_and_skips_cache():
+    content = json.dumps({"casual_response": "c", "formal_response": "f"})
+    rows = [{"id": 1, "query": "Explain bitcoin", "casual_response": "Digital money.", "created_at": "2024-01-01T00:00:00"}]
+    mock_client, query = mock_async_supabase(rows)
+
+    with patch.object(ChatGroq, "ainvoke", new=AsyncMock(return_value=MagicMock(content=content, usage_metadata=None))) as mock_model, \
+         patch("db.crud.get_async_supabase", new=AsyncMock(return_value=mock_client)), \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)):
+        payload = {"user_id": TEST_USER_ID, "query": "Who invented it?", "groq_api_key": "mock_key", "strategy": "single", "conversation": True}
+        assert client.post("/generate", json=payload).status_code == 200
+        assert client.post("/generate", json=payload).status_code == 200
+
+    prompt = mock_model.await_args_list[0].args[0]
+    assert "Earlier in this conversation" in prompt
+    assert "User: Explain bitcoin\nAssistant: Digital money." in prompt
+    assert mock_model.await_count == 2  # context-dependent answers are not cached
+    query.select.assert_called_with("id,created_at,query,casual_response")
+
+
+def test_history_search_index_ranking_and_incremental_rows():
+    from utils.search import HistorySearchIndex, HashingEmbedder, tokenize
+
+    assert tokenize("What are the Blockchains in Bitcoin?") == ["blockchain", "bitcoin"]
+
+    rows = [
+        {"id": 1, "user_id": "u1", "query": "Explain blockchain", "casual_response": "A shared ledger.", "formal_response": "A distributed ledger."},
+        {"id": 2, "user_id": "u1", "query": "Tomato growing tips", "casual_response": "Sun and water; unlike a blockchain.", "formal_response": "Adequate sunlight."},
+        {"id": 3, "user_id": "u1", "query": "Photosynthesis basics", "casual_response": "Plants eat light.", "formal_response": "Light to energy."},
+    ]
+    index = HistorySearchIndex(embedder=HashingEmbedder())
+    index.add_rows(rows)  # no index for u1 yet, so nothing is kept
+    assert index.search("u1", "blockchain") == ([], 0)
+
+    index.load("u1", rows)
+    page, total = index.search("u1", "blockchains")
+    assert total == 2
+    assert [row["id"] for _, row in page] == [1, 2]  # the question counts more than the answer
+
+    index.add_rows([{"id": 4, "user_id": "u1", "query": "Blockchain consensus", "casual_response": "Nodes agree.", "formal_response": "Agreement."}])
+    index.add_rows([{"id": 5, "user_id": "u2", "query": "Blockchain", "casual_response": "x", "formal_response": "x"}])
+    page, total = index.search("u1", "blockchain", limit=1, offset=1)
+    assert total == 3 and len(page) == 1
+
+    page, _ = index.search("u1", "photosynthesi", mode="semantic")
+    assert page[0][1]["id"] == 3
+    page, _ = index.search("u1", "blockchain ledger", mode="hybrid")
+    assert page[0][1]["id"] == 1
+    assert index.snapshot()["documents"] == 4
+
+
+def test_sentence_transformer_embedder_loads_its_model_on_first_use():
+    from utils import search
+
+    package = MagicMock()
+    package.SentenceTransformer.return_value.encode.return_value = [3.0, 4.0]
+    with patch.object(search, "lazy_import", return_value=package):
+        embedder = search.SentenceTransformerEmbedder("tiny-model")
+        package.SentenceTransformer.assert_not_called()
+        assert embedder.embed("a") == {0: 0.6, 1: 0.8}
+        embedder.embed("b")
+    package.SentenceTransformer.assert_called_once_with("tiny-model")
+
+    with patch.object(search, "lazy_import", side_effect=ModuleNotFoundError("sentence_transformers")), \
+         pytest.raises(RuntimeError):
+        search.SentenceTransformerEmbedder("tiny-model")
+
+
+def test_history_search_index_refreshes_rows_saved_elsewhere():
+    from utils.search import HistorySearchIndex, HashingEmbedder
+
+    rows = [{"id": i, "user_id": "u1", "query": f"Blockchain {i}", "casual_response": "c", "formal_response": "f"} for i in range(3)]
+    index = HistorySearchIndex(embedder=HashingEmbedder(), refresh_after=60)
+    index.load("u1", rows[:2])
+    assert index.is_loaded("u1")
+
+    with patch("utils.search.time.monotonic", return_value=time.monotonic() + 61):
+        assert not index.is_loaded("u1")
+        # Another worker saved rows[2]; reloading indexes only what is missing
+        with patch.object(index.embedder, "embed", wraps=index.embedder.embed) as embed:
+            index.load("u1", rows)
+        assert embed.call_count == 1
+        assert index.is_loaded("u1")
+    assert index.search("u1", "blockchain")[1] == 3
+
+
+def test_history_search_endpoint_loads_once_pages_and_indexes_new_rows():
+    from utils.search import HistorySearchIndex, HashingEmbedder
+
+    rows = [
+        {"id": i, "user_id": TEST_USER_ID, "query": f"Question {i} about blockchain", "casual_response": "c",
+         "formal_response": "f", "created_at": f"2024-01-0{i}T00:00:00"}
+        for i in range(1, 4)
+    ]
+    mock_client, query = mock_async_supabase(rows)
+
+    with patch.object(backend, "search_index", HistorySearchIndex(embedder=HashingEmbedder())), \
+         patch("db.crud.get_async_supabase", new=AsyncMock(return_value=mock_client)):
+        response = client.get("/history/search", params={"user_id": TEST_USER_ID, "q": "blockchain", "limit": 2, "fields": "id,query"})
+        assert response.status_code == 200
+        body = response.json()
+        assert body["total"] == 3 and len(body["output"]) == 2
+        assert set(body["output"][0]) == {"id", "created_at", "query", "score"}
+
+        second = client.get("/history/search", params={"user_id": TEST_USER_ID, "q": "blockchain", "limit": 2, "cursor": body["next_cursor"]}).json()
+        assert len(second["output"]) == 1 and second["next_cursor"] is None
+        assert query.execute.await_count == 1  # the index is loaded on the first search only
+
+        # Rows flushed by the write-behind queue are added without reloading
+        query.execute.return_value = MagicMock(data=[{**rows[0], "id": 9, "query": "New blockchain question"}])
+        asyncio.run(backend.flush_history_rows([{"user_id": TEST_USER_ID, "query": "New blockchain question"}]))
+        body = client.get("/history/search", params={"user_id": TEST_USER_ID, "q": "new blockchain"}).json()
+        assert body["total"] == 4 and body["output"][0]["id"] == 9
+
+        assert client.get("/history/search", params={"user_id": TEST_USER_ID, "q": "x", "cursor": "bad"}).status_code == 422
+        with patch.object(backend.search_index, "embedder", None):
+            assert client.get("/history/search", params={"user_id": TEST_USER_ID, "q": "x", "mode": "semantic"}).status_code == 422
+
+
+def test_prompt_registry_versions_and_ab_selection():
+    from utils.prompts import PromptRegistry, parse_prompt_versions, prompt_version
+
+    registry = PromptRegistry(selection=parse_prompt_versions("draft=1:50,2:50;refine=1"))
+    v1, v2 = registry.get("draft", "1"), registry.get("draft", "2")
+    assert registry.get("draft") is registry.get("draft", "3")  # latest by default
+    assert v1.fingerprint != v2.fingerprint
+
+    # The static prefix of version 2 is identical whatever the query or context
+    prompt = v2.render(query='Explain {braces} and "quotes"', context="User: hi")
+    assert prompt.startswith(v2.prefix) and "Output ONLY the JSON dictionary" in v2.prefix
+    assert 'Topic: "Explain {braces} and "quotes""' in prompt
+    assert "Earlier in this conversation" not in v2.render(query="AI")
+
+    chosen = {registry.select("draft", f"user{i}").version for i in range(200)}
+    assert chosen == {"1", "2"}
+    assert all(registry.select("draft", "user7") is registry.select("draft", "user7") for _ in range(5))
+    assert prompt_version(registry.select_all("user7"), "single") in ("draft@1", "draft@2")
+    assert prompt_version(registry.select_all("user7"), "refine").endswith("+refine@1")
+
+    with pytest.raises(ValueError):
+        PromptRegistry(selection=parse_prompt_versions("draft=9"))
+
+
+def test_generate_records_prompt_version_and_scopes_cache_per_version():
+    from utils.prompts import PromptRegistry, parse_prompt_versions
+
+    content = json.dumps({"casual_response": "c", "formal_response": "f"})
+    with patch.object(ChatGroq, "ainvoke", new=AsyncMock(return_value=MagicMock(content=content, usage_metadata=None))) as mock_model, \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)) as mock_add:
+        for version in ("1", "2", "1"):
+            with patch.object(backend, "prompt_registry", PromptRegistry(selection=parse_prompt_versions(f"draft={version}"))):
+                response = client.post("/generate", json={
+                    "user_id": TEST_USER_ID, "query": "Explain prompt caching", "groq_api_key": "mock_key", "strategy": "single"
+                })
+                assert response.status_code == 200
+
+    assert mock_model.await_count == 2  # the third request is a cache hit for version 1
+    assert mock_model.await_args_list[0].args[0].startswith("\n    You are an expert assistant.\n")
+    assert mock_model.await_args_list[1].args[0].startswith("You are an expert assistant. For the topic")
+    assert [c.args[4] for c in mock_add.await_args_list] == ["draft@1", "draft@2", "draft@1"]
+
+
+def test_backend_import_defers_heavy_dependencies():
+    """Import-time benchmark: `python -X importtime -c "import backend"` in a fresh interpreter."""
+    import subprocess
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    imported = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, module = line.split("|")
+            if cumulative.strip().isdigit():
+                imported[module.strip()] = int(cumulative)
+
+    print(f"import backend: {imported['backend'] / 1000:.0f} ms")
+    for heavy in ("langchain_groq", "langchain_core", "supabase", "groq"):
+        assert heavy not in imported, f"{heavy} is imported eagerly"
+
+
+def test_lazy_import_materialises_once_across_threads():
+    """Concurrent first use from several threads sees the fully imported module."""
+    import subprocess
+
+    script = (
+        "import concurrent.futures, sys; from utils.lazy import lazy_import, is_loaded\n"
+        "mod = lazy_import('groq'); assert not is_loaded('groq')\n"
+        "with concurrent.futures.ThreadPoolExecutor(16) as pool:\n"
+        "    names = list(pool.map(lambda _: mod.Groq.__name__, range(64)))\n"
+        "assert set(names) == {'Groq'} and is_loaded('groq')\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+
+
+def test_ready_reports_warm_up_while_health_answers_immediately():
+    from db import database
+
+    with patch.object(backend, "readiness", {"warmup": "pending", "error": None}):
+        assert client.get("/health").status_code == 200
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "starting"
+
+        with patch.object(database, "_async_supabase", MagicMock()), TestClient(app) as running_client:
+            for _ in range(100):
+                response = running_client.get("/ready")
+                if response.status_code == 200:
+                    break
+                time.sleep(0.01)
+            assert response.json() == {
+                "status": "ready", "warmup": "done", "checks": {"model_client": True, "database": True, "write_queue": True},
+            }
+
+
+def test_sqlite_history_store(tmp_path):
+    from db.sqlite_store import SQLiteHistoryStore
+
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"), pool_size=2)
+
+    async def scenario():
+        assert await store.add_entry("u1", "Explain blockchain", "A ledger.", "A distributed ledger.", "draft@2") is True
+        rows = await store.add_entries("u1", [
+            {"query": f"Question {i} about bitcoin", "casual_response": "c", "formal_response": "f"} for i in range(5)
+        ])
+        await store.add_rows([{"user_id": "u2", "query": "Other user's bitcoin", "casual_response": "c", "formal_response": "f"}])
+
+        first = await store.get_history_page("u1", 4, fields=("id", "query"))
+        rest = await store.get_history_page("u1", 4, before=(first[-1]["created_at"], first[-1]["id"]), fields=("query",))
+        newer = await store.get_history_page("u1", 10, since=rows[2]["created_at"])
+        return rows, first, rest, newer, await store.get_entry("u1", 1), await store.get_entry("u2", 1), \
+            await store.search("u1", "bitcoins", 2, 1, ("query",)), await store.get_history_page("u1", 1, fields=("bogus",))
+
+    rows, first, rest, newer, entry, other_user, found, invalid = asyncio.run(scenario())
+    assert [row["id"] for row in rows] == [2, 3, 4, 5, 6] and rows[0]["user_id"] == "u1"
+    assert [row["id"] for row in first] == [6, 5, 4, 3] and set(first[0]) == {"id", "created_at", "query"}
+    assert [row["query"] for row in rest] == ["Question 0 about bitcoin", "Explain blockchain"]
+    assert [row["id"] for row in newer] == [6, 5]
+    assert entry["prompt_version"] == "draft@2" and other_user is None
+    assert [row["query"] for row in found] == ["Question 3 about bitcoin", "Question 2 about bitcoin"]
+    assert isinstance(invalid, ValueError)
+
+    connection = store._pool.get()
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    store._pool.put(connection)
+    asyncio.run(store.close())
+
+
+def test_endpoints_with_sqlite_history_store(tmp_path):
+    from db.sqlite_store import SQLiteHistoryStore
+
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    content = json.dumps({"casual_response": "c", "formal_response": "f"})
+    with patch.object(backend, "history_store", store), patch.object(backend.config, "SEARCH_BACKEND", "database"), \
+         patch.object(ChatGroq, "ainvoke", new=AsyncMock(return_value=MagicMock(content=content, usage_metadata=None))):
+        for query in ("Explain SQLite", "Explain WAL mode"):
+            payload = {"user_id": TEST_USER_ID, "query": query, "groq_api_key": "mock_key", "strategy": "single"}
+            assert client.post("/generate", json=payload).status_code == 200
+
+        page = client.get("/history", params={"user_id": TEST_USER_ID, "limit": 1}).json()
+        assert page["output"][0]["query"] == "Explain WAL mode" and page["next_cursor"]
+        older = client.get("/history", params={"user_id": TEST_USER_ID, "cursor": page["next_cursor"]}).json()
+        assert [row["query"] for row in older["output"]] == ["Explain SQLite"]
+
+        entry = client.get(f"/history/{older['output'][0]['id']}", params={"user_id": TEST_USER_ID}).json()["output"]
+        assert entry["prompt_version"] == "draft@3"
+        found = client.get("/history/search", params={"user_id": TEST_USER_ID, "q": "wal"}).json()
+        assert [row["query"] for row in found["output"]] == ["Explain WAL mode"]
+    asyncio.run(store.close())
+
+
+def test_admission_middleware_sheds_load_and_enforces_deadlines():
+    import httpx
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+    from utils.admission import AdmissionController, AdmissionMiddleware
+
+    inner = FastAPI()
+    cancelled = []
+
+    @inner.post("/work")
+    async def work(seconds: float):
+        try:
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            cancelled.append(seconds)
+            raise
+        return {"slept": seconds}
+
+    @inner.post("/stream")
+    async def stream():
+        async def events():
+            yield backend.sse_event("token", {"text": "partial"})
+            await asyncio.sleep(5)
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=1)
+    wrapped = AdmissionMiddleware(inner, controller, paths=("/work", "/stream"), deadline=0.2)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=wrapped), base_url="http://test") as http:
+            # One request runs, one waits for its slot and the third is turned away at once
+            running = asyncio.create_task(http.post("/work", params={"seconds": 0.05}))
+            await asyncio.sleep(0.01)
+            queued = asyncio.create_task(http.post("/work", params={"seconds": 0.05}))
+            await asyncio.sleep(0.01)
+            rejected = await http.post("/work", params={"seconds": 0.05})
+            responses = [await running, await queued, rejected]
+            responses.append(await http.post("/work", params={"seconds": 5}))
+            responses.append(await http.post("/stream"))
+            controller.start_drain()
+            responses.append(await http.post("/work", params={"seconds": 0}))
+            return responses
+
+    running, queued, rejected, late, stream, draining = asyncio.run(scenario())
+    assert running.status_code == queued.status_code == 200
+    assert rejected.status_code == 503 and int(rejected.headers["retry-after"]) >= 1
+    assert late.status_code == 504 and cancelled == [5]
+    assert stream.text.endswith(backend.sse_event("error", {"status": 504, "detail": "Request deadline of 0.2s exceeded."}))
+    assert draining.status_code == 503 and draining.json()["detail"] == "Server is shutting down."
+    snapshot = controller.snapshot()
+    assert (snapshot["in_flight"], snapshot["queued"], snapshot["rejected_saturated"], snapshot["deadline_exceeded"]) == (0, 1, 1, 2)
+
+
+def test_single_flight_cancels_generation_once_every_caller_is_gone():
+    from utils.singleflight import SingleFlight
+    from utils.store import InMemorySharedStore
+
+    flight = SingleFlight(InMemorySharedStore())
+    cancelled = []
+
+    async def producer():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        callers = [asyncio.create_task(flight.run("key", producer)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        still_running = not cancelled
+        callers[1].cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        return still_running
+
+    assert asyncio.run(scenario()) and cancelled == [True]
+    assert flight.snapshot()["in_flight"] == 0
+
+
+def test_serve_drains_in_flight_requests_on_sigterm(tmp_path):
+    """End to end against the stub LLM: SIGTERM mid-request lets it finish and flushes its history row."""
+    import signal
+    import socket
+    import sqlite3
+    import subprocess
+    import threading
+    import requests
+    from benchmarks.stub_llm import StubLLMServer
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    with StubLLMServer(latency=0.5) as stub:
+        env = {
+            **os.environ, "GROQ_BASE_URL": stub.url, "STORAGE_BACKEND": "sqlite", "SQLITE_PATH": str(tmp_path / "history.db"),
+            "PERSISTENCE_SPOOL_PATH": str(tmp_path / "spool.jsonl"), "JOBS_SQLITE_PATH": str(tmp_path / "jobs.db"), "LOG_LEVEL": "WARNING", "MODEL_FALLBACKS": "",
+        }
+        server = subprocess.Popen(
+            [sys.executable, "serve.py", "--workers", "2", "--port", str(port), "--drain-timeout", "10"],
+            cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            url = f"http://127.0.0.1:{port}"
+            for _ in range(300):
+                try:
+                    if requests.get(f"{url}/ready", timeout=1).status_code == 200:
+                        break
+                except requests.exceptions.ConnectionError:
+                    pass
+                time.sleep(0.05)
+
+            result = {}
+            payload = {"user_id": TEST_USER_ID, "query": TEST_QUERY, "groq_api_key": "stub-key", "strategy": "single"}
+            request = threading.Thread(target=lambda: result.update(response=requests.post(f"{url}/generate", json=payload, timeout=10)))
+            request.start()
+            time.sleep(0.25)
+            server.send_signal(signal.SIGTERM)
+            request.join()
+            assert server.wait(timeout=15) == 0
+        finally:
+            server.kill()
+
+    assert result["response"].status_code == 200
+    assert result["response"].json()["output"]["casual_response"].startswith("Blockchain")
+    with sqlite3.connect(tmp_path / "history.db") as db:
+        assert db.execute("SELECT query FROM prompts").fetchall() == [(TEST_QUERY,)]
+
+
+@pytest.mark.parametrize("backend_name", ["memory", "sqlite"])
+def test_job_runner_queue_bounds_failures_and_timeouts(tmp_path, backend_name):
+    from db.jobs import InMemoryJobStore, SQLiteJobStore
+    from utils.admission import Overloaded
+    from utils.jobs import JobRunner, JobError
+
+    store = InMemoryJobStore() if backend_name == "memory" else SQLiteJobStore(str(tmp_path / "jobs.db"))
+    keys = []
+    gate = asyncio.Event()
+
+    async def execute(job, api_key):
+        keys.append(api_key)
+        if job["query"] == "bad":
+            raise JobError(401, "Invalid Groq API Key. Please check and try again.")
+        await (asyncio.sleep(5) if job["query"] == "slow" else gate.wait())
+        return {"casual_response": "c", "formal_response": job["query"]}
+
+    async def scenario():
+        runner = JobRunner(store, execute, workers=1, max_queue=2, timeout=0.2)
+        await runner.start()
+        jobs = [await runner.submit(TEST_USER_ID, "ok", "single", "secret-key")]
+        while not runner.snapshot()["running"]:
+            await asyncio.sleep(0.005)
+        # One job runs and two wait, so the queue is full
+        jobs += [await runner.submit(TEST_USER_ID, query, "single", "secret-key") for query in ("bad", "slow")]
+        with pytest.raises(Overloaded):
+            await runner.submit(TEST_USER_ID, "one too many", "single", "secret-key")
+        gate.set()
+        await runner.stop(timeout=5)
+        finished = [await store.get(job["id"]) for job in jobs]
+        assert await store.purge(time.time() + 1) == 3
+        await store.close()
+        return finished, runner.snapshot()
+
+    (ok, bad, slow), snapshot = asyncio.run(scenario())
+    assert ok["status"] == "succeeded" and ok["output"]["formal_response"] == "ok"
+    assert ok["created_at"] <= ok["started_at"] <= ok["finished_at"]
+    assert bad["status"] == "failed" and bad["error"]["status"] == 401
+    assert slow["status"] == "failed" and slow["error"]["status"] == 504
+    assert keys == ["secret-key"] * 3 and all("secret-key" not in json.dumps(job) for job in (ok, bad, slow))
+    assert (snapshot["submitted"], snapshot["succeeded"], snapshot["failed"]) == (3, 1, 2)
+
+
+def test_jobs_endpoints_poll_and_deliver_signed_callback():
+    import hashlib
+    import hmac
+    import httpx
+
+    content = json.dumps({"casual_response": "c", "formal_response": "f"})
+    deliveries = []
+
+    def receiver(request):
+        deliveries.append(request)
+        # The first delivery fails, so the callback is retried
+        return httpx.Response(503 if len(deliveries) == 1 else 200)
+
+    with patch.object(ChatGroq, "ainvoke", new=AsyncMock(return_value=MagicMock(content=content, usage_metadata=None))), \
+         patch("db.crud.add_rows_async", new=AsyncMock(return_value=[])) as mock_add, \
+         patch.object(backend.job_runner, "callback_secret", "shh"), \
+         patch.object(backend.job_runner, "callback_retries", 1), \
+         patch.object(backend.job_runner, "callback_hosts", frozenset({"client.example"})), \
+         TestClient(app) as running_client:
+        backend.job_runner._http = httpx.AsyncClient(transport=httpx.MockTransport(receiver))
+        payload = {"user_id": TEST_USER_ID, "query": TEST_QUERY, "groq_api_key": "mock_key", "strategy": "single",
+                   "callback_url": "https://client.example/hooks/job"}
+        response = running_client.post("/jobs", json=payload)
+        assert response.status_code == 202
+        job = response.json()["output"]
+        assert job["status"] in ("queued", "running", "succeeded") and response.headers["location"] == f"/jobs/{job['id']}"
+
+        for _ in range(200):
+            job = running_client.get(f"/jobs/{job['id']}", params={"user_id": TEST_USER_ID}).json()["output"]
+            if job["callback"]:
+                break
+            time.sleep(0.01)
+        assert job["status"] == "succeeded" and job["output"] == json.loads(content)
+        assert job["callback"] == {"delivered": True, "attempts": 2, "status_code": 200}
+        assert running_client.get(f"/jobs/{job['id']}", params={"user_id": "someone-else"}).status_code == 404
+        assert running_client.get("/metrics/jobs").json()["output"]["succeeded"] >= 1
+        assert "jobs_in_progress" in running_client.get("/metrics").text
+
+        assert running_client.post("/jobs", json={**payload, "callback_url": "not a url"}).status_code == 422
+        assert running_client.post("/jobs", json={**payload, "callback_url": "https://other.example/hook"}).status_code == 400
+
+    request = deliveries[-1]
+    assert str(request.url) == "https://client.example/hooks/job" and request.headers["x-job-id"] == job["id"]
+    expected = "sha256=" + hmac.new(b"shh", request.content, hashlib.sha256).hexdigest()
+    assert request.headers["x-signature-256"] == expected
+    assert json.loads(request.content)["output"] == json.loads(content)
+    # The history row went through the write-behind queue, flushed on shutdown
+    assert mock_add.await_args.args[0][0]["query"] == TEST_QUERY
+
+
+def test_callback_urls_must_resolve_to_public_addresses():
+    from utils.jobs import check_callback_url, pinned_request
+
+    async def refused(url, allowed_hosts=()):
+        try:
+            await check_callback_url(url, allowed_hosts)
+        except ValueError:
+            return True
+        return False
+
+    async def scenario():
+        internal = ["http://127.0.0.1/hook", "http://169.254.169.254/latest/meta-data", "http://10.0.0.5/hook",
+                    "http://[::1]/hook", "http://[::ffff:192.168.1.1]/hook", "ftp://8.8.8.8/hook"]
+        return (
+            [await refused(url) for url in internal],
+            await refused("https://8.8.8.8/hook"),
+            await refused("http://127.0.0.1/hook", {"127.0.0.1"}),
+            await check_callback_url("https://8.8.8.8/hook"),
+        )
+
+    internal, public, allowlisted, address = asyncio.run(scenario())
+    assert all(internal) and not public and not allowlisted
+    # Delivery connects to the checked address rather than resolving the host again
+    assert address == "8.8.8.8"
+    assert pinned_request("https://hooks.example:8443/job?x=1", "2606:4700::1111") == (
+        "https://[2606:4700::1111]:8443/job?x=1", {"Host": "hooks.example:8443"}, {"sni_hostname": "hooks.example"},
+    )
+
+
+def test_compression_middleware_negotiates_and_skips_small_and_streamed_bodies():
+    import gzip
+    import zstandard
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse, StreamingResponse
+    from utils.compression import CompressionMiddleware, negotiate
+
+    assert negotiate("gzip, deflate, br, zstd", ("zstd", "br", "gzip")) == "zstd"
+    assert negotiate("gzip;q=1, zstd;q=0.5", ("zstd", "gzip")) == "gzip"
+    assert negotiate("zstd;q=0, *;q=0.1", ("zstd", "gzip")) == "gzip"
+    assert negotiate("identity", ("zstd", "gzip")) is None
+
+    big = {"rows": ["the same sentence, over and over"] * 200}
+    mini = FastAPI()
+    mini.add_middleware(CompressionMiddleware, minimum_size=500, encodings=("zstd", "gzip"), thread_size=4096)
+    mini.get("/big")(lambda: big)
+    mini.get("/small")(lambda: {"ok": True})
+    mini.get("/stream")(lambda: StreamingResponse(iter(["data: a\n\n", "data: b\n\n"] * 300), media_type="text/event-stream"))
+    mini.get("/text")(lambda: PlainTextResponse("x" * 1000, headers={"Content-Encoding": "identity"}))
+    mini_client = TestClient(mini)
+
+    def raw(path, accept):
+        # Read the body as sent, without httpx decoding it
+        with mini_client.stream("GET", path, headers={"Accept-Encoding": accept}) as response:
+            return response, b"".join(response.iter_raw())
+
+    response, body = raw("/big", "gzip, zstd")
+    assert response.headers["content-encoding"] == "zstd" and response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) == len(body) < 500
+    assert json.loads(zstandard.ZstdDecompressor().decompressobj().decompress(body)) == big
+
+    response, body = raw("/big", "gzip")
+    assert response.headers["content-encoding"] == "gzip" and json.loads(gzip.decompress(body)) == big
+
+    response, body = raw("/big", "identity")
+    assert "content-encoding" not in response.headers and json.loads(body) == big
+
+    response, body = raw("/small", "gzip")
+    assert "content-encoding" not in response.headers and response.headers["vary"] == "Accept-Encoding"
+
+    response, body = raw("/stream", "gzip")
+    assert "content-encoding" not in response.headers and body.startswith(b"data: a")
+
+    response, body = raw("/text", "gzip")
+    assert response.headers["content-encoding"] == "identity" and body == b"x" * 1000
+
+
+def test_history_etag_returns_304_and_client_reuses_its_copy():
+    from frontend.api_client import ApiClient
+    from utils.responses import FastJSONResponse, etag_matches
+
+    assert FastJSONResponse({"a": [1, "é"]}).body == '{"a":[1,"é"]}'.encode()
+    assert etag_matches('"x", W/"abc"', 'W/"abc"') and etag_matches("*", 'W/"abc"') and not etag_matches('"x"', 'W/"abc"')
+
+    rows = [{"id": 2, "query": "b", "created_at": "2025-01-02T00:00:00"}, {"id": 1, "query": "a", "created_at": "2025-01-01T00:00:00"}]
+    mock_client, _ = mock_async_supabase(rows)
+    with patch("db.crud.get_async_supabase", new=AsyncMock(return_value=mock_client)):
+        response = client.get("/history?user_id=abc123")
+        tag = response.headers["etag"]
+        assert response.status_code == 200 and tag.startswith('W/"')
+
+        response = client.get("/history?user_id=abc123", headers={"If-None-Match": tag})
+        assert response.status_code == 304 and response.content == b"" and response.headers["etag"] == tag
+        assert client.get("/history?user_id=abc123&limit=1", headers={"If-None-Match": tag}).status_code == 200
+
+        statuses = []
+
+        class RecordingSession:
+            def get(self, *args, timeout=None, **kwargs):
+                response = client.get(*args, **kwargs)
+                statuses.append(response.status_code)
+                return response
+
+        api = ApiClient("http://testserver")
+        api.session = RecordingSession()
+        first = api.get_history_page("abc123", {"limit": 50})
+        assert api.get_history_page("abc123", {"limit": 50}) == first == {"output": rows, "next_cursor": None}
+        assert statuses == [200, 304]
+
+
+def test_prompt_compaction_and_output_budget():
+    from utils.budget import OutputBudget
+    from utils.prompts import PromptRegistry, compact_prompt
+
+    assert compact_prompt("\n    Answer in JSON.\n\n    {query}\n      answer   in json.\n    {query}\n") == "Answer in JSON.\n{query}\n{query}\n"
+
+    registry = PromptRegistry()
+    for name, old in (("draft", "2"), ("refine", "1")):
+        compacted = registry.get(name)
+        assert compacted.version != old and "  " not in compacted.text and "\n\n" not in compacted.text
+        values = {"query": "Explain AI", "input_json": "{}", "context": ""}
+        assert len(compacted.render(**values)) < len(registry.get(name, old).render(**values))
+
+    budget = OutputBudget(casual_tokens=100, formal_tokens=400)
+    assert budget.max_tokens == 574 and budget.instruction() == "the casual summary under 75 words and the formal explanation under 300 words"
+    assert "Keep the casual summary under 75 words" in registry.get("draft").render(query="AI", length=budget.instruction())
+    assert "Keep" not in registry.get("draft").render(query="AI")
+    assert OutputBudget(casual_tokens=100).max_tokens is None and OutputBudget().instruction() == ""
+
+
+def test_generate_passes_max_tokens_compacts_refine_input_and_accounts_tokens():
+    from utils.budget import OutputBudget, TRUNCATED
+
+    draft = '```json\n{\n  "casual_response": "c",\n  "formal_response": "f"\n}\n```'
+    usage = {"input_tokens": 90, "output_tokens": 40, "total_tokens": 130}
+    responses = [
+        MagicMock(content=draft, usage_metadata=usage, response_metadata={"finish_reason": "stop"}),
+        MagicMock(content='{"casual_response": "c", "formal_response": "f trunc', usage_metadata=usage,
+                  response_metadata={"finish_reason": "length"}),
+    ]
+    truncated_before = TRUNCATED.value(phase="refine", model=backend.config.MODEL_NAME)
+
+    with patch.object(backend, "output_budget", OutputBudget(casual_tokens=100, formal_tokens=400)), \
+         patch.object(ChatGroq, "ainvoke", new=AsyncMock(side_effect=responses)) as mock_model, \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)):
+        response = client.post("/generate", json={
+            "user_id": TEST_USER_ID, "query": "Explain output budgets", "groq_api_key": "mock_key", "strategy": "refine"
+        })
+
+    assert response.status_code == 200 and response.json()["output"] == {"casual_response": "c", "formal_response": "f trunc"}
+    draft_call, refine_call = mock_model.await_args_list
+    assert draft_call.kwargs == refine_call.kwargs == {"max_tokens": 574}
+    assert "under 75 words" in draft_call.args[0] and "under 300 words" in refine_call.args[0]
+    assert 'Input JSON: {"casual_response":"c","formal_response":"f"}\n' in refine_call.args[0]
+    assert TRUNCATED.value(phase="refine", model=backend.config.MODEL_NAME) == truncated_before + 1
+    # The truncated answer was served but not cached
+    assert client.get("/metrics/cache").json()["output"]["indexed_queries"] == 0
+
+    stats = client.get("/metrics/generation").json()["output"]["refine"]
+    assert stats["truncated"] >= 1 and stats["avg_output_tokens"] > 0
+    assert 'generate_request_tokens_count{strategy="refine",kind="output"}' in client.get("/metrics").text
+
+    # Without budgets no max_tokens is sent, and unreported usage is estimated
+    streamed = {}
+
+    async def fake_astream(self, prompt, *args, **kwargs):
+        streamed.update(kwargs)
+        yield MagicMock(content='{"casual_response": "c", "formal_response": "f"}', usage_metadata=None)
+
+    with patch.object(backend, "output_budget", OutputBudget()), \
+         patch.object(ChatGroq, "astream", new=fake_astream), \
+         patch.object(backend, "record_usage", wraps=backend.record_usage) as record, \
+         patch("db.crud.add_entry_async", new=AsyncMock(return_value=True)):
+        response = client.post("/generate/stream", json={
+            "user_id": TEST_USER_ID, "query": "Explain unbounded answers", "groq_api_key": "mock_key", "strategy": "single"
+        })
+
+    assert parse_sse(response.text)[-1][0] == "done" and streamed == {}
+    recorded = record.call_args.args[2]
+    assert recorded.estimated and recorded.calls == 1 and recorded.input_tokens > 50 and recorded.output_tokens > 0
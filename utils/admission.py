@@ -0,0 +1,213 @@
+from collections import deque
+import asyncio
+import json
+import math
+import signal
+import threading
+import time
+
+
+class Overloaded(Exception):
+    """Raised by `AdmissionController.acquire` when a request is turned away."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds the generation work a worker process accepts.
+
+    At most `max_in_flight` requests hold a slot at once (0 = unlimited).
+    Up to `max_queue` more wait for a slot, each for at most `queue_timeout`
+    seconds. Anything beyond that is rejected immediately, so under overload
+    callers get a fast 503 instead of queueing until memory runs out. A
+    released slot is handed to the oldest waiter directly.
+
+    `retry_after()` estimates when a slot frees up. The estimate uses a moving
+    average of how long requests hold their slot.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int = 0, queue_timeout: float = 0.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.draining = False
+        self.service_time = 1.0  # moving average of seconds a slot is held
+        self._waiters = deque()
+        self.stats = {"admitted": 0, "queued": 0, "rejected_saturated": 0, "rejected_queue_timeout": 0,
+                      "rejected_draining": 0, "deadline_exceeded": 0}
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up, between 1 and 60."""
+        slots = max(1, self.max_in_flight)
+        return min(60, max(1, math.ceil(self.service_time * (self.waiting + 1) / slots)))
+
+    async def acquire(self):
+        """
+        Takes a slot, waiting in the queue if there is room.
+
+        Raises:
+            Overloaded: When draining, when the queue is full, or after `queue_timeout`.
+        """
+
+        if self.draining:
+            self.stats["rejected_draining"] += 1
+            raise Overloaded("draining", self.retry_after())
+        if self.max_in_flight <= 0 or (self.in_flight < self.max_in_flight and not self.waiting):
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            return
+        if self.waiting >= self.max_queue:
+            self.stats["rejected_saturated"] += 1
+            raise Overloaded("saturated", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats["queued"] += 1
+        try:
+            done, _ = await asyncio.wait((waiter,), timeout=self.queue_timeout or None)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        if not done:
+            self._abandon(waiter)
+            self.stats["rejected_queue_timeout"] += 1
+            raise Overloaded("queue timeout", self.retry_after())
+        self.stats["admitted"] += 1
+
+    def release(self, held: float = None):
+        """Frees a slot, handing it to the oldest waiter; `held` is how long it was used."""
+        if held is not None:
+            self.service_time = 0.8 * self.service_time + 0.2 * held
+        if self._waiters:
+            self._waiters.popleft().set_result(None)
+            return
+        self.in_flight -= 1
+
+    def _abandon(self, waiter):
+        if waiter.done():
+            # The slot was handed over just as the waiter gave up; pass it on
+            self.release()
+        else:
+            self._waiters.remove(waiter)
+
+    def start_drain(self):
+        """Rejects new requests from now on; the ones already admitted finish."""
+        self.draining = True
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "draining": self.draining,
+            "service_time_seconds": round(self.service_time, 3),
+        }
+
+
+def drain_on_signals(controller: AdmissionController, signals=(signal.SIGTERM, signal.SIGINT)):
+    """
+    Makes SIGTERM/SIGINT start draining `controller` before the server's own
+    handler runs. Call it from the app's startup. uvicorn (and gunicorn's
+    uvicorn worker) have installed their handlers by then. They stop accepting
+    connections and wait for open requests. This adds two things: any new
+    generate request, e.g. on a kept-alive connection, gets a 503 with
+    `Retry-After`, and `/ready` turns 503. Does nothing off the main thread,
+    e.g. under the test client.
+    """
+
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in signals:
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            controller.start_drain()
+            previous(signum, frame)
+
+        signal.signal(sig, handler)
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that puts `POST` requests to `paths` through an
+    `AdmissionController` and a deadline.
+
+    A request holds its slot until the last byte of its response is sent.
+    Streamed responses therefore count for as long as they stream. Rejected
+    requests get a 503 JSON response with `Retry-After`.
+
+    When a request to `deadline_paths` (default: all of `paths`) runs longer
+    than `deadline` seconds (0 = none), its task is cancelled. This also cancels its upstream model calls. If nothing has
+    been sent yet, the client gets a 504. A `text/event-stream` response
+    already in progress ends with an `error` event carrying status 504. Any
+    other streamed response is just closed.
+    """
+
+    def __init__(self, app, controller: AdmissionController, paths=(), deadline: float = 0, deadline_paths=None):
+        self.app = app
+        self.controller = controller
+        self.paths = frozenset(paths)
+        self.deadline = deadline
+        self.deadline_paths = self.paths if deadline_paths is None else frozenset(deadline_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        try:
+            await self.controller.acquire()
+        except Overloaded as e:
+            detail = "Server is shutting down." if e.reason == "draining" else "Server is busy. Please retry shortly."
+            return await self._send_json(send, 503, {"detail": detail}, [(b"retry-after", str(e.retry_after).encode())])
+
+        start = time.perf_counter()
+        response_headers = None
+
+        async def tracked_send(message):
+            nonlocal response_headers
+            if message["type"] == "http.response.start":
+                response_headers = dict(message.get("headers") or [])
+            await send(message)
+
+        deadline = self.deadline if scope["path"] in self.deadline_paths else 0
+        try:
+            await asyncio.wait_for(self.app(scope, receive, tracked_send), deadline or None)
+        except asyncio.TimeoutError:
+            self.controller.stats["deadline_exceeded"] += 1
+            await self._deadline_exceeded(send, response_headers)
+        finally:
+            self.controller.release(time.perf_counter() - start)
+
+    async def _deadline_exceeded(self, send, response_headers):
+        detail = f"Request deadline of {self.deadline:g}s exceeded."
+        if response_headers is None:
+            await self._send_json(send, 504, {"detail": detail})
+            return
+
+        body = b""
+        if response_headers.get(b"content-type", b"").startswith(b"text/event-stream"):
+            body = f"event: error\ndata: {json.dumps({'status': 504, 'detail': detail})}\n\n".encode()
+        await send({"type": "http.response.body", "body": body, "more_body": False})
+
+    @staticmethod
+    async def _send_json(send, status: int, content: dict, headers=()):
+        body = json.dumps(content).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,114 @@
+import math
+
+from utils.context import estimate_tokens
+from utils.tracing import metrics
+
+
+# Tokens of JSON structure around the two answers: braces, keys, quotes and escapes
+JSON_OVERHEAD_TOKENS = 24
+# Slack on top of the budgets before the hard stop, since models overshoot word limits a little
+MAX_TOKENS_SLACK = 1.1
+# Words per token of English prose, for stating a token budget as a word limit
+WORDS_PER_TOKEN = 0.75
+
+REQUEST_TOKENS = metrics.histogram(
+    "generate_request_tokens", "Tokens used per generated response across its model calls, by strategy and direction.",
+    ("strategy", "kind"), buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192),
+)
+TRUNCATED = metrics.counter("llm_truncated_total", "Model calls cut off by max_tokens, by phase and model.", ("phase", "model"))
+
+
+class OutputBudget:
+    """
+    Output length budgets per answer style, in tokens; 0 leaves a style unbounded.
+
+    The budgets reach the model twice. `instruction` states them in the prompt
+    as word limits, so the model plans answers of that length. `max_tokens`
+    (both budgets, 10% slack and the JSON structure) is a hard stop for a
+    model that overruns. A stopped answer still parses, since the parser
+    closes truncated JSON (see utils/parsing.py), but it ends mid-sentence.
+    """
+
+    def __init__(self, casual_tokens: int = 0, formal_tokens: int = 0):
+        self.casual_tokens = casual_tokens
+        self.formal_tokens = formal_tokens
+
+    @property
+    def max_tokens(self):
+        """The model's `max_tokens`, or None when either style is unbounded."""
+        if not (self.casual_tokens and self.formal_tokens):
+            return None
+        return math.ceil((self.casual_tokens + self.formal_tokens) * MAX_TOKENS_SLACK) + JSON_OVERHEAD_TOKENS
+
+    @property
+    def key(self) -> str:
+        """Identifies the budgets in cache keys, since they change the answers."""
+        return f"{self.casual_tokens}/{self.formal_tokens}"
+
+    def instruction(self) -> str:
+        """The limits as prompt text, e.g. `"the casual summary under 110 words"`; empty when unbounded."""
+        limits = [
+            f"the {name} under {max(1, int(tokens * WORDS_PER_TOKEN))} words"
+            for name, tokens in (("casual summary", self.casual_tokens), ("formal explanation", self.formal_tokens))
+            if tokens
+        ]
+        return " and ".join(limits)
+
+
+def create_output_budget(config) -> OutputBudget:
+    return OutputBudget(config.CASUAL_MAX_TOKENS, config.FORMAL_MAX_TOKENS)
+
+
+def finish_reason(response):
+    """Why the model stopped (`"stop"`, or `"length"` at `max_tokens`), when LangChain reports it."""
+    metadata = getattr(response, "response_metadata", None)
+    return metadata.get("finish_reason") if isinstance(metadata, dict) else None
+
+
+class TokenUsage:
+    """
+    Token accounting for one generated response, across its model calls.
+
+    Counts are the ones the provider reported. A call without usage metadata
+    is estimated from its prompt and output text, and `estimated` is set.
+    """
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.calls = 0
+        self.truncated = 0
+        self.estimated = False
+        self.phases = {}
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    @property
+    def final_truncated(self) -> bool:
+        """Whether the last call, the one whose output became the answer, was cut off at `max_tokens`."""
+        return bool(self.phases) and list(self.phases.values())[-1]["truncated"]
+
+    def add(self, phase: str, counts: dict, prompt: str, output: str, truncated: bool = False):
+        """Adds one model call, given the counts returned by `record_tokens`."""
+        if isinstance(counts.get("total_tokens"), int) and counts["total_tokens"]:
+            input_tokens, output_tokens = counts["input_tokens"], counts["output_tokens"]
+        else:
+            input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(output)
+            self.estimated = True
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.calls += 1
+        self.truncated += bool(truncated)
+        self.phases[phase] = {"input_tokens": input_tokens, "output_tokens": output_tokens, "truncated": bool(truncated)}
+
+    def observe(self, strategy: str):
+        REQUEST_TOKENS.observe(self.input_tokens, strategy=strategy, kind="input")
+        REQUEST_TOKENS.observe(self.output_tokens, strategy=strategy, kind="output")
+
+    def fields(self) -> dict:
+        return {
+            "input_tokens": self.input_tokens, "output_tokens": self.output_tokens, "total_tokens": self.total_tokens,
+            "llm_calls": self.calls, "truncated": self.truncated, "estimated": self.estimated, "phases": self.phases,
+        }
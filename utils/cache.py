@@ -0,0 +1,268 @@
+from collections import OrderedDict
+import json
+import re
+import threading
+import time
+
+
+def normalize_query(query: str) -> str:
+    """
+    Lowercases a query, strips punctuation and collapses whitespace so trivial
+    variations ("Explain blockchain?" vs "explain  blockchain") share a key.
+    """
+
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
+
+
+def stem(token: str) -> str:
+    """Drops a plural "s" from longer words, so "blockchains" and "blockchain" compare equal."""
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+# Words that phrase a request without changing what is asked
+FILLER_WORDS = frozenset(
+    "a an the is are was were what whats s do does can could would will you please tell me us about "
+    "explain describe define give i we want to know".split()
+)
+NEGATIONS = frozenset("not no never nor without".split())
+
+
+def content_terms(normalized: str) -> list:
+    """The words of a normalized query that carry its meaning: fillers dropped, plurals folded."""
+    return [stem(token) for token in normalized.split() if token not in FILLER_WORDS]
+
+
+def compatible_terms(a: str, b: str) -> bool:
+    """
+    Whether two normalized queries can share an answer by their words alone.
+
+    Filler words and plurals are ignored, so "What is a blockchain?" and
+    "Explain blockchains" are compatible. Otherwise the content words of the
+    shorter query must appear in the longer one in the same order, with the
+    same negations: "causes of WWI" vs "causes of WWII" (a word substituted),
+    "is TCP faster than UDP" vs its reverse (reordered) and a query vs its
+    negation are not, even though trigram similarity scores them above 0.85.
+    How many extra words the longer query may add is left to the trigram
+    threshold.
+    """
+
+    a_terms, b_terms = content_terms(a), content_terms(b)
+    if not a_terms or not b_terms:
+        return a == b
+    if NEGATIONS.intersection(a_terms) != NEGATIONS.intersection(b_terms):
+        return False
+    shorter, longer = sorted((a_terms, b_terms), key=len)
+    remaining = iter(longer)
+    return all(term in remaining for term in shorter)
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class InMemoryCacheBackend:
+    """
+    Process-local key/value store with per-entry TTL and LRU eviction once
+    `max_entries` is reached.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: dict, ttl: int):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCacheBackend:
+    """
+    Shared store backed by Redis, so every worker sees the same cached responses.
+
+    Expiry uses Redis TTLs; size-bound eviction is left to the server's
+    `maxmemory-policy` (e.g. `allkeys-lru`). Uses the asyncio client, so a
+    lookup does not block the event loop. Requires the optional `redis` package.
+    """
+
+    def __init__(self, url: str, prefix: str = "response-cache:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package") from e
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    async def get(self, key: str):
+        raw = await self._client.get(self._prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: dict, ttl: int):
+        await self._client.set(self._prefix + key, json.dumps(value), ex=ttl)
+
+    async def clear(self):
+        async for key in self._client.scan_iter(self._prefix + "*"):
+            await self._client.delete(key)
+
+
+class ResponseCache:
+    """
+    Two-tier cache for generated responses.
+
+    1. Exact tier: key is the namespace (prompt version, model, strategy) plus
+       the normalized query.
+    2. Similarity tier, off unless `similarity_threshold` is set: a local
+       trigram index over the content words of cached queries (see
+       `content_terms`); the closest query in the same namespace whose
+       Jaccard similarity reaches the threshold, and whose words are
+       compatible (see `compatible_terms`), is served instead.
+
+    Values live in the pluggable backend, which owns TTL and eviction. The
+    similarity index is bounded to the same size and drops keys whose value
+    has expired from the backend.
+    """
+
+    def __init__(self, backend, ttl: int = 86400, similarity_threshold: float = 0, max_index: int = 1000):
+        self.backend = backend
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.max_index = max_index
+        self._index = OrderedDict()   # key -> (namespace, trigram set)
+        self._postings = {}           # trigram -> set of keys
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0}
+
+    @staticmethod
+    def make_key(namespace: str, normalized_query: str) -> str:
+        return f"{namespace}|{normalized_query}"
+
+    async def get(self, query: str, namespace: str):
+        """
+        Looks up a cached response.
+
+        Returns:
+            tuple: (response dict, tier) where tier is "exact" or "similar", or (None, None) on a miss.
+        """
+
+        normalized = normalize_query(query)
+        value = await self.backend.get(self.make_key(namespace, normalized))
+        if value is not None:
+            self._count("exact_hits")
+            return value, "exact"
+
+        if self.similarity_threshold > 0:
+            for key in self._similar_keys(namespace, normalized):
+                value = await self.backend.get(key)
+                if value is not None:
+                    self._count("similar_hits")
+                    return value, "similar"
+                self._unindex(key)
+
+        self._count("misses")
+        return None, None
+
+    async def set(self, query: str, namespace: str, value: dict):
+        normalized = normalize_query(query)
+        key = self.make_key(namespace, normalized)
+        await self.backend.set(key, value, self.ttl)
+
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+                return
+            grams = trigrams(" ".join(content_terms(normalized)))
+            self._index[key] = (namespace, grams)
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(key)
+            while len(self._index) > self.max_index:
+                self._unindex_locked(next(iter(self._index)))
+
+    async def clear(self):
+        await self.backend.clear()
+        with self._lock:
+            self._index.clear()
+            self._postings.clear()
+            self.stats = {key: 0 for key in self.stats}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = sum(self.stats.values())
+            hits = self.stats["exact_hits"] + self.stats["similar_hits"]
+            return {
+                **self.stats,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "indexed_queries": len(self._index),
+            }
+
+    def _similar_keys(self, namespace: str, normalized: str):
+        """Returns indexed keys in `namespace` at or above the threshold with compatible terms, best match first."""
+        grams = trigrams(" ".join(content_terms(normalized)))
+        with self._lock:
+            overlap = {}
+            for gram in grams:
+                for key in self._postings.get(gram, ()):
+                    overlap[key] = overlap.get(key, 0) + 1
+
+            scored = []
+            for key, shared in overlap.items():
+                key_namespace, key_grams = self._index[key]
+                if key_namespace != namespace:
+                    continue
+                score = shared / (len(grams) + len(key_grams) - shared)
+                if score >= self.similarity_threshold and compatible_terms(normalized, key.rpartition("|")[2]):
+                    scored.append((score, key))
+        return [key for _, key in sorted(scored, reverse=True)]
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _unindex(self, key: str):
+        with self._lock:
+            self._unindex_locked(key)
+
+    def _unindex_locked(self, key: str):
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return
+        for gram in entry[1]:
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+
+def create_response_cache(config) -> ResponseCache:
+    """
+    Builds the response cache described by the `CACHE_*` settings in `config`.
+    """
+
+    if config.CACHE_BACKEND == "redis":
+        backend = RedisCacheBackend(config.CACHE_REDIS_URL)
+    else:
+        backend = InMemoryCacheBackend(config.CACHE_MAX_ENTRIES)
+    return ResponseCache(backend, config.CACHE_TTL, config.CACHE_SIMILARITY_THRESHOLD, config.CACHE_MAX_ENTRIES)
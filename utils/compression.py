@@ -0,0 +1,123 @@
+import asyncio
+import gzip
+import importlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+
+# Content types worth compressing; everything else (images, already-compressed data) passes through.
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript", "application/xml", "image/svg+xml")
+
+
+def _optional(*names):
+    for name in names:
+        try:
+            return importlib.import_module(name)
+        except ImportError:
+            pass
+    return None
+
+
+def available_encoders() -> dict:
+    """
+    Compressors by content coding, for the codings whose library is installed:
+    `gzip` always, `br` with `brotli` (or `brotlicffi`), `zstd` with `zstandard`.
+    Levels favour speed, since every response is compressed on the fly; each
+    compressor can run in any thread.
+    """
+
+    encoders = {"gzip": lambda body: gzip.compress(body, compresslevel=4, mtime=0)}
+    brotli = _optional("brotli", "brotlicffi")
+    if brotli is not None:
+        encoders["br"] = lambda body: brotli.compress(body, quality=4)
+    zstandard = _optional("zstandard")
+    if zstandard is not None:
+        encoders["zstd"] = lambda body: zstandard.ZstdCompressor(level=3).compress(body)
+    return encoders
+
+
+def negotiate(accept_encoding: str, preference) -> str:
+    """
+    Picks the content coding for an `Accept-Encoding` header: the highest
+    q-value among `preference`, ties going to the earlier one. Returns None
+    when the client accepts none of them.
+    """
+
+    weights = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip()] = q
+
+    best, best_q = None, 0.0
+    for name in preference:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing response bodies with the best coding the
+    client accepts among `encodings`, in server preference order. Codings
+    whose library is not installed are skipped.
+
+    Only complete bodies of at least `minimum_size` bytes with a compressible
+    content type are compressed. Streamed responses (`/generate/stream`, NDJSON
+    batches) pass through untouched, so their chunks still reach the client as
+    they are produced. A compressible response always gets
+    `Vary: Accept-Encoding`. Bodies of `thread_size` bytes or more are
+    compressed in a thread, so a large history page does not stall the event loop.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, encodings=("zstd", "br", "gzip"), thread_size: int = 64 * 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.thread_size = thread_size
+        encoders = available_encoders()
+        self.encoders = {name: encoders[name] for name in encodings if name in encoders}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""), self.encoders)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start_message = None
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether the body is complete
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            start, start_message, passthrough = start_message, None, True
+            start["headers"] = list(start.get("headers") or [])
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            compressible = "content-encoding" not in headers and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+            if compressible:
+                headers.add_vary_header("Accept-Encoding")
+            if compressible and not message.get("more_body") and len(body) >= self.minimum_size:
+                encode = self.encoders[encoding]
+                body = await asyncio.to_thread(encode, body) if len(body) >= self.thread_size else encode(body)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                message = {"type": "http.response.body", "body": body}
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, compressing_send)
@@ -0,0 +1,130 @@
+from collections import OrderedDict
+import re
+import threading
+
+from utils.cache import normalize_query, trigrams
+
+
+# Pre-tokenizer in the style of GPT/Llama BPE: words (with a leading space),
+# numbers, runs of punctuation and line breaks.
+_PIECES = re.compile(r" ?[A-Za-z]+| ?\d{1,3}| ?[^\sA-Za-z\d]+|\s+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of model tokens in `text` without loading a tokenizer.
+
+    Text is split with the same kind of pre-tokenizer regex BPE tokenizers use;
+    each piece counts as one token, plus one per extra four letters for long
+    words, which BPE splits into sub-words. Close enough for budgeting English
+    prose, and a single regex pass over the text.
+    """
+
+    tokens = 0
+    for piece in _PIECES.findall(text):
+        tokens += 1 + max(0, len(piece.strip()) - 5) // 4
+    return tokens
+
+
+def condense(text: str, max_chars: int = 200) -> str:
+    """First sentence of `text`, cut at a word boundary if longer than `max_chars`."""
+    text = " ".join(text.split())
+    sentence = _SENTENCE_END.split(text, maxsplit=1)[0]
+    if len(sentence) <= max_chars:
+        return sentence
+    return sentence[:max_chars].rsplit(" ", 1)[0] + "…"
+
+
+class ConversationContext:
+    """
+    Assembles earlier turns of a user's conversation into prompt context under
+    a token budget.
+
+    The newest `recent_turns` turns are included verbatim (question and casual
+    answer), newest first, as long as they fit. Older turns are reduced to a
+    one-line summary each and ranked by relevance to the new query (trigram
+    overlap) plus recency; the best ones are added until the budget is spent.
+    Summaries and token estimates are computed once per history entry and kept
+    in an LRU cache, so a growing history is summarized incrementally rather
+    than on every request.
+    """
+
+    def __init__(self, token_budget: int = 1500, recent_turns: int = 2, relevance_weight: float = 2.0, max_cached: int = 10000):
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.relevance_weight = relevance_weight
+        self.max_cached = max_cached
+        self._summaries = OrderedDict()  # entry id -> (summary line, tokens, query trigrams)
+        self._lock = threading.Lock()
+        self.stats = {"summary_hits": 0, "summary_misses": 0}
+
+    def build(self, turns: list, query: str) -> str:
+        """
+        Returns the context block for `query`, or "" if there is no history.
+
+        Args:
+            turns (list): History rows, newest first, with `id`, `query` and `casual_response`.
+            query (str): The new question.
+        """
+
+        if not turns or self.token_budget <= 0:
+            return ""
+
+        budget = self.token_budget
+        recent, summarized = [], []
+
+        for turn in turns[:self.recent_turns]:
+            block = f"User: {turn['query']}\nAssistant: {turn['casual_response']}"
+            cost = estimate_tokens(block)
+            if cost > budget:
+                break
+            recent.append(block)
+            budget -= cost
+
+        older = turns[len(recent):]
+        if older and budget > 0:
+            query_grams = trigrams(normalize_query(query))
+            scored = []
+            for position, turn in enumerate(older):
+                line, cost, grams = self._summary(turn)
+                overlap = len(query_grams & grams) / len(query_grams | grams) if grams else 0.0
+                recency = 1 / (1 + position)
+                scored.append((self.relevance_weight * overlap + recency, position, line, cost))
+
+            chosen = []
+            for _, position, line, cost in sorted(scored, reverse=True):
+                if cost <= budget:
+                    chosen.append((position, line))
+                    budget -= cost
+            # Back to chronological order, oldest first
+            summarized = [line for _, line in sorted(chosen, reverse=True)]
+
+        sections = []
+        if summarized:
+            sections.append("Summary of earlier turns:\n" + "\n".join(summarized))
+        if recent:
+            sections.append("Most recent turns:\n" + "\n\n".join(reversed(recent)))
+        return "\n\n".join(sections)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "cached_summaries": len(self._summaries)}
+
+    def _summary(self, turn: dict) -> tuple:
+        key = turn["id"]
+        with self._lock:
+            entry = self._summaries.get(key)
+            if entry is not None:
+                self._summaries.move_to_end(key)
+                self.stats["summary_hits"] += 1
+                return entry
+            self.stats["summary_misses"] += 1
+
+        line = f"- {condense(turn['query'], 120)} → {condense(turn['casual_response'])}"
+        entry = (line, estimate_tokens(line) + 1, trigrams(normalize_query(turn["query"])))
+        with self._lock:
+            self._summaries[key] = entry
+            while len(self._summaries) > self.max_cached:
+                self._summaries.popitem(last=False)
+        return entry
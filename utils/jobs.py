@@ -0,0 +1,312 @@
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import math
+import socket
+import time
+import uuid
+
+from db.jobs import RUNNING, SUCCEEDED, FAILED, new_job
+from utils.admission import Overloaded
+from utils.lazy import lazy_import
+from utils.tracing import metrics, logger
+
+
+httpx = lazy_import("httpx")
+
+
+JOB_SECONDS = metrics.histogram(
+    "job_seconds", "Background generation jobs: time queued and time running.", ("phase",),
+)
+JOBS_FINISHED = metrics.counter("jobs_finished_total", "Background generation jobs finished, by status.", ("status",))
+
+
+class JobError(Exception):
+    """Raised by a job's `execute` function to fail it with an HTTP-style `status` and `detail`."""
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def job_view(job: dict) -> dict:
+    """The public representation of a job, as returned by `GET /jobs/{id}` and sent to callbacks."""
+    view = {key: job[key] for key in ("id", "status", "query", "strategy", "output", "error", "callback")}
+    for key in ("created_at", "started_at", "finished_at"):
+        view[key] = datetime.fromtimestamp(job[key], timezone.utc).isoformat() if job[key] is not None else None
+    return view
+
+
+def sign(body: bytes, secret: str) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+async def check_callback_url(url: str, allowed_hosts=()):
+    """
+    Refuses callback URLs that would make the server call into its own network.
+
+    With `allowed_hosts`, the host must be one of them. Otherwise the host must
+    resolve to public addresses only: loopback, private, link-local (e.g. the
+    cloud metadata service at 169.254.169.254) and reserved ranges are refused.
+
+    Returns:
+        str | None: The checked address to connect to, so the host is not
+            resolved a second time (and possibly differently) by the HTTP
+            client; None for an allow-listed host.
+
+    Raises:
+        ValueError: If the URL is not allowed.
+    """
+
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise ValueError("callback_url must be an http(s) URL")
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise ValueError(f"callback_url host {host!r} is not allowed")
+        return None
+
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, parts.port or 443, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise ValueError(f"callback_url host {host!r} cannot be resolved")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"callback_url host {host!r} is not a public address")
+    return infos[0][4][0].split("%")[0]
+
+
+def pinned_request(url: str, address: str) -> tuple:
+    """
+    Points `url` at the already checked `address` instead of its host name.
+
+    Returns:
+        tuple: (URL with the address as host, `Host` header, httpx request
+            extensions). The original host still goes out as the `Host` header
+            and as the TLS server name, so virtual hosting and certificate
+            checks work as before.
+    """
+
+    parts = urlsplit(url)
+    netloc = f"[{address}]" if ":" in address else address
+    if parts.port:
+        netloc += f":{parts.port}"
+    host = parts.hostname + (f":{parts.port}" if parts.port else "")
+    return parts._replace(netloc=netloc).geturl(), {"Host": host}, {"sni_hostname": parts.hostname}
+
+
+class JobRunner:
+    """
+    Runs generation jobs in the background.
+
+    `submit` records the job in the store and puts it on a bounded in-process
+    queue, which `workers` tasks drain. Each job runs `execute(job, api_key)`
+    with a timeout of `timeout` seconds. The API key travels only through the
+    queue and is never stored. The job's outcome is written back to the store.
+    If the job has a `callback_url`, the result (see `job_view`) is then
+    POSTed there in the background. That POST is retried up to
+    `callback_retries` times and signed with `callback_secret` when one is
+    set. Callback URLs are checked by `check_callback_url` against
+    `callback_hosts` on submission, and again before delivery, since DNS may
+    have changed in between. Delivery then connects to the address that was
+    checked (see `pinned_request`), not to a fresh lookup of the host. Jobs are
+    deleted `ttl` seconds after creation.
+
+    A crash loses the queued jobs. A graceful `stop` waits for them and
+    marks any left unfinished as failed.
+
+    Args:
+        store (db.jobs.JobStore): Where job state lives.
+        execute: `async execute(job, api_key) -> dict`; raises `JobError` to fail the job.
+    """
+
+    def __init__(self, store, execute, workers: int = 4, max_queue: int = 1000, timeout: float = 300, ttl: float = 86400,
+                 callback_timeout: float = 10, callback_retries: int = 3, callback_secret: str = "", callback_hosts=()):
+        self.store = store
+        self.execute = execute
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.ttl = ttl
+        self.callback_timeout = callback_timeout
+        self.callback_retries = callback_retries
+        self.callback_secret = callback_secret
+        self.callback_hosts = frozenset(host.lower() for host in callback_hosts)
+        self._queue = None
+        self._tasks = []
+        self._callbacks = set()
+        self._active = set()
+        self._stopping = False
+        self._http = None
+        self.run_time = 1.0  # moving average of seconds a job runs
+        self.stats = {"submitted": 0, "succeeded": 0, "failed": 0, "callbacks_delivered": 0, "callbacks_failed": 0}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        await self.store.connect()
+        self._stopping = False
+        self._queue = asyncio.Queue(self.max_queue)
+        self._http = httpx.AsyncClient(timeout=self.callback_timeout)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge_expired()))
+
+    async def stop(self, timeout: float = 30):
+        """Waits up to `timeout` seconds for queued and running jobs, then fails whatever is left."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        unfinished = list(self._active)
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        while not self._queue.empty():
+            unfinished.append(self._queue.get_nowait()[0])
+        for job_id in unfinished:
+            await self._finish(job_id, FAILED, error={"status": 503, "detail": "Server shut down before the job finished. Please resubmit."})
+        if self._callbacks:
+            await asyncio.wait(self._callbacks, timeout=self.callback_timeout)
+        await self._http.aclose()
+        await self.store.close()
+
+    async def submit(self, user_id: str, query: str, strategy: str, api_key: str, conversation: bool = False,
+                     callback_url: str = None) -> dict:
+        """
+        Records a new job and queues it.
+
+        Raises:
+            Overloaded: When the queue is full or the runner is not running.
+            ValueError: When `callback_url` is not allowed (see `check_callback_url`).
+        """
+
+        if not self.running:
+            raise Overloaded("not running", 1)
+        if self._queue.full():
+            raise Overloaded("jobs queue full", self._retry_after())
+        if callback_url:
+            await check_callback_url(callback_url, self.callback_hosts)
+
+        job = new_job(uuid.uuid4().hex, user_id, query, strategy, conversation, callback_url)
+        await self.store.create(job)
+        self._queue.put_nowait((job["id"], job, api_key))
+        self.stats["submitted"] += 1
+        return job
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "queue_depth": self.queue_depth, "running": len(self._active), "workers": self.workers}
+
+    def _retry_after(self) -> int:
+        # Roughly the time for the workers to get through the queue at the recent pace
+        return max(1, min(60, math.ceil(self.run_time * self.queue_depth / max(1, self.workers))))
+
+    async def _work(self):
+        # The flag backs up cancellation, which `wait_for` swallows if the job finishes at that moment
+        while not self._stopping:
+            job_id, job, api_key = await self._queue.get()
+            self._active.add(job_id)
+            try:
+                await self._run(job, api_key)
+            except Exception as e:
+                logger.warning("job failed to update", extra={"fields": {"job_id": job_id, "error": str(e)}})
+            finally:
+                self._active.discard(job_id)
+                self._queue.task_done()
+
+    async def _run(self, job: dict, api_key: str):
+        started = time.time()
+        JOB_SECONDS.observe(started - job["created_at"], phase="queue")
+        await self.store.update(job["id"], status=RUNNING, started_at=started)
+        try:
+            output = await asyncio.wait_for(self.execute({**job, "status": RUNNING}, api_key), self.timeout)
+        except JobError as e:
+            await self._finish(job["id"], FAILED, error={"status": e.status, "detail": e.detail})
+        except asyncio.TimeoutError:
+            await self._finish(job["id"], FAILED, error={"status": 504, "detail": f"Job did not finish within {self.timeout:g}s."})
+        except Exception as e:
+            await self._finish(job["id"], FAILED, error={"status": 500, "detail": f"Unexpected error: {str(e)}"})
+        else:
+            await self._finish(job["id"], SUCCEEDED, output=output)
+        finally:
+            elapsed = time.time() - started
+            self.run_time = 0.8 * self.run_time + 0.2 * elapsed
+            JOB_SECONDS.observe(elapsed, phase="run")
+
+    async def _finish(self, job_id: str, status: str, **fields):
+        await self.store.update(job_id, status=status, finished_at=time.time(), **fields)
+        self.stats[status] += 1
+        JOBS_FINISHED.inc(status=status)
+        job = await self.store.get(job_id)
+        if job is not None and job["callback_url"]:
+            task = asyncio.create_task(self._deliver(job))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+
+    async def _deliver(self, job: dict):
+        body = json.dumps(job_view(job)).encode()
+        headers = {"Content-Type": "application/json", "X-Job-Id": job["id"]}
+        if self.callback_secret:
+            headers["X-Signature-256"] = sign(body, self.callback_secret)
+
+        result = {"delivered": False, "attempts": 0, "status_code": None}
+        url, extensions = job["callback_url"], {}
+        try:
+            address = await check_callback_url(url, self.callback_hosts)
+        except ValueError as e:
+            logger.warning("callback refused", extra={"fields": {"job_id": job["id"], "error": str(e)}})
+            self.stats["callbacks_failed"] += 1
+            await self._record_callback(job["id"], result)
+            return
+        if address is not None:
+            url, host_header, extensions = pinned_request(url, address)
+            headers.update(host_header)
+
+        for attempt in range(self.callback_retries + 1):
+            if attempt:
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            result["attempts"] += 1
+            try:
+                response = await self._http.post(url, content=body, headers=headers, extensions=extensions)
+                result["status_code"] = response.status_code
+                if response.status_code < 400:
+                    result["delivered"] = True
+                    break
+                if response.status_code < 500 and response.status_code != 429:
+                    break  # the receiver rejected it; retrying will not help
+            except httpx.HTTPError:
+                pass
+
+        self.stats["callbacks_delivered" if result["delivered"] else "callbacks_failed"] += 1
+        await self._record_callback(job["id"], result)
+
+    async def _record_callback(self, job_id: str, result: dict):
+        try:
+            await self.store.update(job_id, callback=result)
+        except Exception:
+            pass  # purged meanwhile
+
+    async def _purge_expired(self):
+        while True:
+            try:
+                await self.store.purge(time.time() - self.ttl)
+            except Exception as e:
+                logger.warning("job purge failed", extra={"fields": {"error": str(e)}})
+            await asyncio.sleep(min(self.ttl, 300))
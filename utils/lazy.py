@@ -0,0 +1,51 @@
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that imports it on first attribute access.
+
+    The import runs under a lock, so threads touching the module at the same
+    time (e.g. `asyncio.to_thread` workers) all see the fully executed module.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lazy_lock = threading.Lock()
+        self._lazy_module = None
+
+    def __getattr__(self, attr: str):
+        # Only called for attributes the stand-in itself does not have
+        module = self._lazy_module
+        if module is None:
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    self._lazy_module = importlib.import_module(self.__name__)
+                module = self._lazy_module
+        return getattr(module, attr)
+
+
+def lazy_import(name: str):
+    """
+    Returns module `name` without executing it until one of its attributes is
+    first used.
+
+    Lets modules keep `import x`-style references, including in `except x.Error`
+    clauses, to heavy dependencies that a cold process may never need. Returns
+    the real module if it is already imported.
+    """
+
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    return LazyModule(name)
+
+
+def is_loaded(name: str) -> bool:
+    """True once module `name` has actually been imported, not just referenced through `lazy_import`."""
+    return name in sys.modules
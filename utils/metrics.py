@@ -0,0 +1,172 @@
+from collections import deque
+import threading
+
+
+class StrategyMetrics:
+    """
+    In-process latency and token counters per generation strategy, including
+    output tokens and the responses cut off by `max_tokens`.
+
+    Latencies are kept in a bounded window so percentiles reflect recent traffic
+    without growing memory over the lifetime of the worker.
+    """
+
+    def __init__(self, window: int = 1000):
+        self._window = window
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, strategy: str, latency: float, tokens: int, llm_calls: int, output_tokens: int = 0, truncated: int = 0):
+        with self._lock:
+            stats = self._stats.setdefault(strategy, {
+                "requests": 0,
+                "llm_calls": 0,
+                "total_tokens": 0,
+                "output_tokens": 0,
+                "truncated": 0,
+                "latencies": deque(maxlen=self._window),
+            })
+            stats["requests"] += 1
+            stats["llm_calls"] += llm_calls
+            stats["total_tokens"] += tokens
+            stats["output_tokens"] += output_tokens
+            stats["truncated"] += truncated
+            stats["latencies"].append(latency)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            result = {}
+            for strategy, stats in self._stats.items():
+                latencies = sorted(stats["latencies"])
+                result[strategy] = {
+                    "requests": stats["requests"],
+                    "llm_calls": stats["llm_calls"],
+                    "total_tokens": stats["total_tokens"],
+                    "avg_tokens": stats["total_tokens"] / stats["requests"],
+                    "avg_output_tokens": stats["output_tokens"] / stats["requests"],
+                    "truncated": stats["truncated"],
+                    "latency_p50": _percentile(latencies, 0.50),
+                    "latency_p95": _percentile(latencies, 0.95),
+                }
+            return result
+
+
+def _percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    """Monotonic counter with labels, rendered in Prometheus text format."""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in Prometheus text format."""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(labels.get(name, "") for name in self.labelnames))
+        return series[-1] if series else 0
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(names, key + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds metrics and gauge callbacks and renders them for `/metrics`.
+
+    Gauges are read at scrape time from `callback() -> {labels tuple: value}`,
+    so existing in-process stats (cache, queue, registry) need no extra bookkeeping.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._gauges = []
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, callback, labelnames=()):
+        self._gauges.append((name, documentation, tuple(labelnames), callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, documentation, labelnames, callback in self._gauges:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in sorted(callback().items()):
+                lines.append(f"{name}{_format_labels(labelnames, key)} {value}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,79 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+
+
+def client_key(api_key: str, model_name: str, params: dict) -> str:
+    """
+    Registry key for a model client: a SHA-256 digest, so the raw API key is
+    never stored in the registry's keys, logs or metrics.
+    """
+
+    material = json.dumps([api_key, model_name, sorted(params.items())], default=str)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class ModelRegistry:
+    """
+    Bounded LRU registry of `ChatGroq` clients keyed by (API key, model, params).
+
+    Constructing a `ChatGroq` builds new Groq/httpx clients (~50 ms of CPU) and
+    discards their connection pools, so clients are reused across requests from
+    the same key. Entries unused for `idle_ttl` seconds are evicted, as is the
+    least recently used one once `max_size` is exceeded.
+
+    The default `factory` is `ChatGroq`, imported on the first miss so that
+    `langchain_groq` stays out of the backend's import time.
+    """
+
+    def __init__(self, max_size: int = 256, idle_ttl: float = 900, factory=None):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._factory = factory
+        self._clients = OrderedDict()  # key -> (last_used, client)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, api_key: str, model_name: str, **params):
+        key = client_key(api_key, model_name, params)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                self._clients[key] = (now, entry[1])
+                self._clients.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+
+        if self._factory is None:
+            from langchain_groq import ChatGroq
+            self._factory = ChatGroq
+        client = self._factory(model_name=model_name, api_key=api_key, **params)
+        with self._lock:
+            self._clients[key] = (now, client)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.stats["evictions"] += 1
+        return client
+
+    def discard(self, api_key: str, model_name: str, **params):
+        """Drops a client, e.g. after its key was rejected by Groq."""
+        with self._lock:
+            self._clients.pop(client_key(api_key, model_name, params), None)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "size": len(self._clients)}
+
+    def _evict_idle(self, now: float):
+        while self._clients:
+            key, (last_used, _) = next(iter(self._clients.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            del self._clients[key]
+            self.stats["evictions"] += 1
@@ -0,0 +1,330 @@
+import json
+
+from pydantic import ValidationError
+
+from schemas import ModelOutput
+
+
+SECTION_KEYS = {"casual_response": "casual", "formal_response": "formal"}
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class SectionStreamParser:
+    """
+    Incrementally scans streamed model output shaped like
+    `{"casual_response": "...", "formal_response": "..."}` and reports which
+    section each piece of decoded string text belongs to.
+
+    Feed raw chunks as they arrive; `feed` returns a list of `(section, text)`
+    pairs where section is "casual" or "formal". JSON structure, keys and any
+    text outside the two response values are dropped. Escape sequences split
+    across chunk boundaries are handled. The raw text is kept in `buffer` so
+    the complete output can be parsed once the stream ends.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._in_string = False
+        self._is_key = True
+        self._token = []
+        self._last_key = None
+        self._escape = None
+
+    def feed(self, chunk: str) -> list:
+        self.buffer += chunk
+        pieces = []
+        for char in chunk:
+            text = self._step(char)
+            if text:
+                section = SECTION_KEYS.get(self._last_key)
+                if section is not None:
+                    if pieces and pieces[-1][0] == section:
+                        pieces[-1] = (section, pieces[-1][1] + text)
+                    else:
+                        pieces.append((section, text))
+        return pieces
+
+    def _step(self, char: str):
+        if not self._in_string:
+            if char == '"':
+                self._in_string = True
+                self._token = []
+            elif char == ":":
+                self._is_key = False
+            elif char in ",{":
+                self._is_key = True
+            return None
+
+        if self._escape is not None:
+            self._escape += char
+            if self._escape.startswith("u"):
+                if len(self._escape) < 5:
+                    return None
+                try:
+                    decoded = chr(int(self._escape[1:], 16))
+                except ValueError:
+                    decoded = ""
+            else:
+                decoded = _ESCAPES.get(self._escape, self._escape)
+            self._escape = None
+            return self._emit(decoded)
+
+        if char == "\\":
+            self._escape = ""
+            return None
+        if char == '"':
+            self._in_string = False
+            if self._is_key:
+                self._last_key = "".join(self._token)
+            return None
+        return self._emit(char)
+
+    def _emit(self, text: str):
+        if self._is_key:
+            self._token.append(text)
+            return None
+        return text
+
+
+_SMART_QUOTES = "“”„‟″"
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+_AFTER_STRING = ":,}]"
+_DECODER = json.JSONDecoder()
+# Each candidate `{` can cost a scan to the end of the text, so stop trying after
+# this many; real replies rarely have more than one or two stray braces up front
+MAX_CANDIDATES = 16
+
+
+class IncrementalJSONParser:
+    """
+    Scanner that extracts and repairs the first JSON object in model output,
+    fed either all at once or chunk by chunk.
+
+    Anything before the object (preamble, code fences) and after its matching
+    `}` is ignored. A candidate starting at a `{` that does not parse, such as
+    the `{json}` in "Here is the answer in {json} form:", is dropped and the
+    scan resumes from the next `{`, for at most `MAX_CANDIDATES` candidates,
+    which bounds the work to a fixed number of passes over the text. While scanning, common model faults are
+    repaired:
+
+    - smart quotes used as string delimiters are turned into `"`
+    - raw newlines, tabs and other control characters inside strings are escaped
+    - unescaped `"` inside a string is escaped unless it is followed by `:`, `,`,
+      `}` or `]` (i.e. unless it plausibly ends the string)
+    - trailing commas before `}` or `]` are dropped
+
+    `feed` returns the parsed dict once the object closes, otherwise None.
+    `close` ends the input; for truncated output it closes the open string,
+    arrays and objects so whatever was generated can still be parsed.
+    """
+
+    def __init__(self):
+        self.result = None
+        self._text = ""   # everything fed so far, for rescanning after a failed candidate
+        self._pos = 0
+        self._start = 0
+        self._candidates = 0
+        self._reset()
+
+    def _reset(self):
+        self._out = []
+        self._stack = []
+        self._started = False
+        self._in_string = False
+        self._smart_string = False
+        self._escape = False
+        self._pending_quote = None   # whitespace seen after a possible closing quote
+        self._pending_comma = None   # whitespace seen after a comma outside strings
+
+    def feed(self, chunk: str):
+        if self.result is not None:
+            return self.result
+        self._text += chunk
+        self._scan()
+        return self.result
+
+    def close(self):
+        """Ends the input; returns the parsed dict or raises ValueError."""
+        while self.result is None:
+            if not self._started or self._exhausted():
+                raise ValueError("Invalid JSON response from model")
+            try:
+                self._close_truncated()
+            except ValueError:
+                self._restart()
+                self._scan()
+        return self.result
+
+    def _scan(self):
+        while self._pos < len(self._text) and self.result is None and not self._exhausted():
+            char = self._text[self._pos]
+            self._pos += 1
+            try:
+                self._step(char)
+            except ValueError:
+                self._restart()
+
+    def _restart(self):
+        """Drops the current candidate and rescans from the next `{` after its start."""
+        self._reset()
+        self._candidates += 1
+        next_start = self._text.find("{", self._start + 1)
+        self._pos = len(self._text) if next_start == -1 else next_start
+
+    def _exhausted(self) -> bool:
+        return self._candidates >= MAX_CANDIDATES
+
+    def _close_truncated(self):
+        if self._pending_quote is not None:
+            self._close_string()
+        elif self._in_string:
+            if self._escape:
+                self._out.pop()
+            self._out.append('"')
+            self._in_string = False
+        self._pending_comma = None
+        text = "".join(self._out).rstrip()
+        if text.endswith(":"):
+            text += " null"
+        self._out = [text] + ["}" if opener == "{" else "]" for opener in reversed(self._stack)]
+        self._finish()
+
+    def _step(self, char: str):
+        if not self._started:
+            if char == "{":
+                self._started = True
+                self._start = self._pos - 1
+                self._open(char)
+            return
+
+        if self._pending_quote is not None:
+            if char.isspace():
+                self._pending_quote += char
+                return
+            if char in _AFTER_STRING:
+                self._close_string()
+            else:
+                # The quote was part of the text, not the end of the string
+                self._out.append('\\"' + self._pending_quote)
+                self._pending_quote = None
+
+        if self._in_string:
+            self._string_char(char)
+            return
+
+        if self._pending_comma is not None:
+            if char.isspace():
+                self._pending_comma += char
+                return
+            if char not in "}]":
+                self._out.append("," + self._pending_comma)
+            self._pending_comma = None
+
+        if char == ",":
+            self._pending_comma = ""
+        elif char == '"' or char in _SMART_QUOTES:
+            self._in_string = True
+            self._smart_string = char != '"'
+            self._out.append('"')
+        elif char in "{[":
+            self._open(char)
+        elif char in "}]":
+            self._out.append(char)
+            self._stack.pop()
+            if not self._stack:
+                self._finish()
+        else:
+            self._out.append(char)
+
+    def _string_char(self, char: str):
+        if self._escape:
+            self._escape = False
+            self._out.append(char)
+        elif char == "\\":
+            self._escape = True
+            self._out.append(char)
+        elif self._smart_string and char in _SMART_QUOTES:
+            self._out.append('"')
+            self._in_string = False
+        elif char == '"':
+            if self._smart_string:
+                self._out.append('\\"')
+            else:
+                self._pending_quote = ""
+        elif char in _CONTROL_ESCAPES:
+            self._out.append(_CONTROL_ESCAPES[char])
+        elif ord(char) < 0x20:
+            self._out.append(f"\\u{ord(char):04x}")
+        else:
+            self._out.append(char)
+
+    def _close_string(self):
+        self._out.append('"' + self._pending_quote)
+        self._pending_quote = None
+        self._in_string = False
+
+    def _open(self, char: str):
+        self._out.append(char)
+        self._stack.append(char)
+
+    def _finish(self):
+        try:
+            self.result = json.loads("".join(self._out))
+        except json.JSONDecodeError:
+            raise ValueError("Invalid JSON response from model")
+        if not isinstance(self.result, dict):
+            raise ValueError("Invalid JSON response from model")
+
+
+def extract_json(text: str) -> dict:
+    """
+    Parses the first JSON object in a model response.
+
+    Well-formed output (optionally wrapped in code fences or surrounded by
+    text) is decoded directly with `json`, trying up to `MAX_CANDIDATES` `{`s
+    in turn until one starts an object; anything else goes through the
+    repairing `IncrementalJSONParser`.
+
+    Args:
+        text (str): The raw string response from the model containing JSON.
+
+    Returns:
+        dict: Parsed JSON content as a dictionary.
+
+    Raises:
+        ValueError: If no valid (or repairable) JSON object is found.
+    """
+
+    start = text.find("{")
+    for _ in range(MAX_CANDIDATES):
+        if start == -1:
+            break
+        try:
+            result, _ = _DECODER.raw_decode(text, start)
+            if isinstance(result, dict):
+                return result
+        except json.JSONDecodeError:
+            pass
+        start = text.find("{", start + 1)
+
+    parser = IncrementalJSONParser()
+    result = parser.feed(text)
+    return result if result is not None else parser.close()
+
+
+def parse_model_output(text: str) -> dict:
+    """
+    Extracts the model's JSON and validates it against `schemas.ModelOutput`.
+
+    Returns:
+        dict: `{"casual_response": str, "formal_response": str}`.
+
+    Raises:
+        ValueError: If the output cannot be parsed or fails validation.
+    """
+
+    try:
+        return ModelOutput.model_validate(extract_json(text)).model_dump()
+    except ValidationError as e:
+        raise ValueError(f"Model response failed validation: {e.error_count()} error(s)")
@@ -1,7 +1,100 @@
-def build_prompt(query: str) -> str:
-    return f"""
-    You are an expert assistant.
+import hashlib
+from string import Formatter
+
+
+def compact_prompt(text: str) -> str:
+    """
+    Normalizes a template's whitespace and drops repeated instructions: lines
+    lose their indentation and runs of spaces, blank lines go, and a line that
+    repeats an earlier one (ignoring case and spacing) is dropped unless it
+    holds a field. Every line still ends with a newline.
+    """
+
+    seen = set()
+    lines = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if not line:
+            continue
+        has_field = any(field is not None for _, field, _, _ in Formatter().parse(line))
+        if line.lower() in seen and not has_field:
+            continue
+        seen.add(line.lower())
+        lines.append(line)
+    return "".join(line + "\n" for line in lines)
+
+
+class PromptTemplate:
+    """
+    A named, versioned prompt, compiled once into literal and field segments.
+
+    `text` uses `str.format` placeholders (`{{` and `}}` for literal braces).
+    Rendering joins the precompiled segments, so user input is never parsed
+    as a format string. `sections` maps a field to a wrapper template that is
+    rendered around its value, or left out entirely when the value is empty
+    (e.g. the conversation context block). With `compact`, the text and the
+    wrappers go through `compact_prompt` once, when the template is compiled.
+
+    The wording of a version must never change once it is in use: responses
+    are cached and stored under `id`, and `fingerprint` changes with any edit
+    to the text, so an unversioned edit still invalidates the response cache.
+    """
+
+    def __init__(self, name: str, version: str, text: str, sections: dict = None, compact: bool = False):
+        self.name = name
+        self.version = version
+        self.text = compact_prompt(text) if compact else text
+        # Literal runs split by escaped braces are merged, so each segment ends at a field
+        self._segments = []
+        pending = ""
+        for literal, field, _, _ in Formatter().parse(self.text):
+            pending += literal
+            if field is not None:
+                self._segments.append((pending, field))
+                pending = ""
+        if pending:
+            self._segments.append((pending, None))
+        self.fields = tuple(field for _, field in self._segments if field is not None)
+        self.sections = {
+            field: PromptTemplate(f"{name}.{field}", version, wrapper, compact=compact)
+            for field, wrapper in (sections or {}).items()
+        }
+        source = self.text + "".join(section.text for section in self.sections.values())
+        self.fingerprint = hashlib.sha256(source.encode()).hexdigest()[:12]
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    @property
+    def prefix(self) -> str:
+        """The static text before the first field; identical for every request."""
+        return self._segments[0][0] if self._segments else ""
+
+    def render(self, **values) -> str:
+        parts = []
+        for literal, field in self._segments:
+            parts.append(literal)
+            if field is None:
+                continue
+            value = values.get(field, "")
+            if field in self.sections:
+                value = self.sections[field].render(**{field: value}) if value else ""
+            parts.append(str(value))
+        return "".join(parts)
+
 
+# Version 1 keeps the original wording. Version 2 moves the instructions, which
+# are the same for every request, ahead of the context and topic, so the
+# prompt starts with a byte-stable prefix that provider prompt caching can reuse.
+# Version 3 (and refine version 2) are compacted: one line per instruction,
+# without the repeated "JSON only" instructions. They also state the output
+# length budgets (see utils/budget.py) as word limits. The refine step gets the
+# draft as minified JSON.
+TEMPLATES = (
+    PromptTemplate("draft", "1", """
+    You are an expert assistant.
+{context}
     Given the topic: "{query}", respond with:
     1. A casual summary (as if explaining to a friend).
     2. A formal academic explanation (detailed, like a scholarly article).
@@ -15,16 +108,202 @@ def build_prompt(query: str) -> str:
     - Do NOT include markdown formatting or extra text.
 
     Output ONLY the JSON dictionary.
-"""
+""", sections={"context": """
+    Earlier in this conversation:
+    {context}
+
+    Use it only to understand what the new topic refers to.
+"""}),
+    PromptTemplate("draft", "2", """You are an expert assistant. For the topic at the end of this message, respond with:
+1. A casual summary (as if explaining to a friend).
+2. A formal academic explanation (detailed, like a scholarly article).
 
+Respond exactly as a JSON dictionary with two keys:
+{{"casual_response": "...", "formal_response": "..."}}
 
+Make sure:
+- Use double quotes for keys and string values (valid JSON).
+- Escape any special characters properly.
+- Do NOT include markdown formatting or extra text.
 
-def build_refine_prompt(input_json: str) -> str:
-    return f"""
+Output ONLY the JSON dictionary.
+{context}
+Topic: "{query}"
+""", sections={"context": """
+Earlier in this conversation:
+{context}
+
+Use it only to understand what the topic refers to.
+"""}),
+    PromptTemplate("draft", "3", """
+    You are an expert assistant. For the topic at the end of this message, write:
+    1. A casual summary (as if explaining to a friend).
+    2. A formal academic explanation (detailed, like a scholarly article).
+    Output ONLY the JSON dictionary {{"casual_response": "...", "formal_response": "..."}},
+    as valid JSON: double quotes, special characters escaped, no markdown or extra text.
+    {length}{context}Topic: "{query}"
+""", sections={
+        "length": """
+    Keep {length}.
+""",
+        "context": """
+    Earlier in this conversation:
+    {context}
+    Use it only to understand what the topic refers to.
+"""}, compact=True),
+    PromptTemplate("refine", "1", """
     You will receive a JSON dictionary with two fields. Refine and polish the texts for clarity and style, then return ONLY the refined JSON dictionary with the same keys.
 
     Input JSON:
     {input_json}
 
     Output only the refined JSON dictionary, no extra text.
+    """),
+    PromptTemplate("refine", "2", """
+    Refine the texts of this JSON dictionary for clarity and style, keeping its keys.
+    {length}Input JSON: {input_json}
+    Output only the refined JSON dictionary, no extra text.
+""", sections={"length": """
+    Keep {length}.
+"""}, compact=True),
+)
+
+
+def parse_prompt_versions(value: str) -> dict:
     """
+    Parses `"name=version[:weight],...;..."` (e.g. `"draft=1:20,2:80;refine=1"`)
+    into `{name: [(version, weight)]}`. A version without a weight counts as 1.
+    """
+
+    selection = {}
+    for item in value.split(";"):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, versions = item.partition("=")
+        choices = []
+        for version in versions.split(","):
+            version, _, weight = version.strip().partition(":")
+            if version:
+                choices.append((version, float(weight) if weight else 1.0))
+        selection[name.strip()] = choices
+    return selection
+
+
+class PromptRegistry:
+    """
+    The prompt templates available to the backend, by name and version.
+
+    Without a selection, each name uses its latest registered version. A
+    selection pins a version or splits traffic between several by weight for
+    A/B tests; the choice is a hash of the subject (the user id), so a user
+    keeps getting the same variant.
+    """
+
+    def __init__(self, templates=TEMPLATES, selection: dict = None):
+        self._templates = {}
+        for template in templates:
+            self._templates.setdefault(template.name, {})[template.version] = template
+        self.selection = selection or {}
+        for name, choices in self.selection.items():
+            for version, weight in choices:
+                self.get(name, version)
+                if weight < 0:
+                    raise ValueError(f"Negative weight for prompt {name}@{version}")
+            if not sum(weight for _, weight in choices):
+                raise ValueError(f"No weight given to any version of prompt {name!r}")
+
+    @property
+    def names(self) -> list:
+        return list(self._templates)
+
+    def get(self, name: str, version: str = None) -> PromptTemplate:
+        """
+        Returns a template; the latest registered version when `version` is None.
+
+        Raises:
+            ValueError: If the template or version is unknown.
+        """
+
+        versions = self._templates.get(name)
+        if not versions:
+            raise ValueError(f"Unknown prompt template {name!r}")
+        if version is None:
+            return list(versions.values())[-1]
+        if version not in versions:
+            raise ValueError(f"Unknown version {version!r} of prompt template {name!r}")
+        return versions[version]
+
+    def select(self, name: str, subject: str = "") -> PromptTemplate:
+        """Returns the version of `name` to use for `subject`."""
+        choices = self.selection.get(name)
+        if not choices:
+            return self.get(name)
+        if len(choices) == 1:
+            return self.get(name, choices[0][0])
+
+        digest = hashlib.sha256(f"{name}:{subject}".encode()).digest()
+        point = int.from_bytes(digest[:8], "big") / 2 ** 64 * sum(weight for _, weight in choices)
+        for version, weight in choices:
+            point -= weight
+            if point < 0:
+                return self.get(name, version)
+        return self.get(name, choices[-1][0])
+
+    def select_all(self, subject: str = "") -> dict:
+        """Returns `{name: template}` with the version of every template to use for `subject`."""
+        return {name: self.select(name, subject) for name in self._templates}
+
+    def snapshot(self) -> dict:
+        return {
+            name: {
+                "versions": {version: template.fingerprint for version, template in versions.items()},
+                "selection": dict(self.selection.get(name) or [(self.get(name).version, 1.0)]),
+            }
+            for name, versions in self._templates.items()
+        }
+
+
+def prompt_version(prompts: dict, strategy: str) -> str:
+    """
+    Identifies the templates a response under `strategy` was generated with,
+    e.g. `"draft@2+refine@1"`; stored with history rows and used in cache keys.
+    """
+
+    return "+".join(template.id for template in _used(prompts, strategy))
+
+
+def prompt_fingerprint(prompts: dict, strategy: str) -> str:
+    """Fingerprint of the exact template texts behind `prompt_version`."""
+    return "+".join(template.fingerprint for template in _used(prompts, strategy))
+
+
+def _used(prompts: dict, strategy: str) -> list:
+    names = ("draft",) if strategy == "single" else ("draft", "refine")
+    return [prompts[name] for name in names]
+
+
+def create_prompt_registry(config) -> PromptRegistry:
+    """
+    Builds the registry with the template versions selected by `PROMPT_VERSIONS` in `config`.
+    """
+
+    return PromptRegistry(TEMPLATES, parse_prompt_versions(config.PROMPT_VERSIONS))
+
+
+default_registry = PromptRegistry()
+
+
+def build_prompt(query: str, context: str = "", version: str = None, length: str = "") -> str:
+    """
+    Builds the draft prompt. `context` (earlier turns, see utils/context.py)
+    is included when given, so follow-up questions can be interpreted.
+    `length` is the output budget instruction (`OutputBudget.instruction`).
+    """
+
+    return default_registry.get("draft", version).render(query=query, context=context, length=length)
+
+
+
+def build_refine_prompt(input_json: str, version: str = None, length: str = "") -> str:
+    return default_registry.get("refine", version).render(input_json=input_json, length=length)
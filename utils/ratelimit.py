@@ -0,0 +1,86 @@
+from contextlib import asynccontextmanager
+import asyncio
+import time
+
+
+class AsyncRateLimiter:
+    """
+    Paces callers to at most `rate` acquisitions per second by spacing them
+    evenly; a rate of 0 disables pacing.
+
+    Usage:
+        limiter = AsyncRateLimiter(5)
+        await limiter.acquire()
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class KeyedPacer:
+    """
+    A concurrency cap and an `AsyncRateLimiter` per key (e.g. per API key),
+    shared by every caller using that key, so concurrent callers split the
+    allowance instead of each getting their own. A key's entry is dropped
+    once no caller holds or waits for a slot.
+
+    Usage:
+        pacer = KeyedPacer(concurrency=4, rate=5)
+        async with pacer.slot(key):
+            ...
+    """
+
+    def __init__(self, concurrency: int, rate: float):
+        self.concurrency = concurrency
+        self.rate = rate
+        self._entries = {}   # key -> [semaphore, limiter, callers]
+
+    @asynccontextmanager
+    async def slot(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [asyncio.Semaphore(self.concurrency), AsyncRateLimiter(self.rate), 0]
+        entry[2] += 1
+        try:
+            async with entry[0]:
+                await entry[1].acquire()
+                yield
+        finally:
+            entry[2] -= 1
+            if not entry[2] and self._entries.get(key) is entry:
+                del self._entries[key]
+
+
+class TokenBucketLimiter:
+    """
+    Token-bucket limit per key (e.g. per API key or per user) kept in a shared
+    store (see utils/store.py), so the limit holds across workers when the
+    store is shared. `rate` is tokens per second; 0 disables the limit.
+
+    Usage:
+        limiter = TokenBucketLimiter(store, rate=0.5, burst=10, prefix="user:")
+        retry_after = await limiter.check(user_id)   # 0 when allowed
+    """
+
+    def __init__(self, store, rate: float, burst: float, prefix: str):
+        self.store = store
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.prefix = prefix
+
+    async def check(self, key: str) -> float:
+        if self.rate <= 0:
+            return 0.0
+        return await self.store.take_token(self.prefix + key, self.rate, self.burst)
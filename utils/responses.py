@@ -0,0 +1,43 @@
+import hashlib
+import json
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content) -> bytes:
+    """Compact JSON bytes, via `orjson` when installed and the standard library otherwise."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with `dumps`. It is the app's default response
+    class; handlers returning large payloads build it themselves, which also
+    skips FastAPI's `jsonable_encoder` pass over content that is already plain
+    JSON.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def etag(body: bytes) -> str:
+    """A weak validator for a rendered body; weak, since compression changes the bytes on the wire."""
+    return 'W/"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, tag: str) -> bool:
+    """Weak comparison of `tag` against an `If-None-Match` header value."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = tag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
@@ -0,0 +1,167 @@
+from collections import deque
+import hashlib
+import json
+import threading
+import time
+
+from utils.metrics import _percentile
+
+
+PHASES = ("draft", "refine")
+
+
+def parse_model_list(value: str, default_timeout: float) -> list:
+    """
+    Parses `"name[:timeout],..."` (e.g. `"Gemma2-9b-It:20,llama-3.1-8b-instant"`)
+    into `[{"name", "timeout"}]`.
+    """
+
+    models = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, timeout = item.partition(":")
+        models.append({"name": name.strip(), "timeout": float(timeout) if timeout else default_timeout})
+    return models
+
+
+def load_routes(config) -> dict:
+    """
+    Builds `{"draft": [...], "refine": [...]}` model chains from `config`.
+
+    `MODEL_ROUTES_FILE`, when set, is a JSON file with `draft` and optional
+    `refine` lists of `{"name", "timeout"}` (or plain names). Otherwise the
+    draft chain is `MODEL_NAME` followed by `MODEL_FALLBACKS`, and the refine
+    chain is `REFINE_MODEL_NAME` (if set) followed by the draft chain.
+    """
+
+    if config.MODEL_ROUTES_FILE:
+        with open(config.MODEL_ROUTES_FILE) as f:
+            spec = json.load(f)
+
+        def chain(items):
+            return [
+                {"name": item, "timeout": config.MODEL_TIMEOUT} if isinstance(item, str)
+                else {"name": item["name"], "timeout": float(item.get("timeout", config.MODEL_TIMEOUT))}
+                for item in items
+            ]
+
+        draft = chain(spec["draft"])
+        refine = chain(spec.get("refine", []))
+    else:
+        draft = parse_model_list(f"{config.MODEL_NAME},{config.MODEL_FALLBACKS}", config.MODEL_TIMEOUT)
+        refine = parse_model_list(config.REFINE_MODEL_NAME, config.MODEL_TIMEOUT)
+
+    if not draft:
+        raise ValueError("At least one draft model must be configured")
+    refine_names = {model["name"] for model in refine}
+    return {
+        "draft": _dedupe(draft),
+        "refine": _dedupe(refine + [model for model in draft if model["name"] not in refine_names]),
+    }
+
+
+def _dedupe(models: list) -> list:
+    seen = set()
+    return [m for m in models if not (m["name"] in seen or seen.add(m["name"]))]
+
+
+class ModelRouter:
+    """
+    Chooses the order in which models are tried for each phase of generation.
+
+    Each phase has a configured chain of models. A model that fails with a
+    retryable error (timeout, 5xx, unavailable) is put on `cooldown` for a few
+    seconds and moved to the back of the chain. A rate limit belongs to the
+    caller's API key rather than the model, so it only cools the model down
+    for that key. With `latency_aware` set, models with at least `min_samples`
+    recent successes are ordered by their p95 latency among the positions
+    they hold in the chain; models without enough samples keep their
+    configured position, so a primary that was skipped while it cooled down
+    is tried again and can earn back its place.
+    """
+
+    def __init__(self, routes: dict, latency_aware: bool = True, cooldown: float = 30, window: int = 200, min_samples: int = 20):
+        self.routes = routes
+        self.latency_aware = latency_aware
+        self.cooldown = cooldown
+        self.min_samples = min_samples
+        self._latencies = {(phase, m["name"]): deque(maxlen=window) for phase in PHASES for m in routes[phase]}
+        self._cooldown_until = {}  # (name, hashed API key or None) -> monotonic time
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def model_names(self) -> list:
+        return [m["name"] for m in _dedupe(self.routes["draft"] + self.routes["refine"])]
+
+    def candidates(self, phase: str, api_key: str = None) -> list:
+        """Returns the phase's models, `{"name", "timeout"}`, in the order to try them for `api_key`."""
+        now = time.monotonic()
+        scopes = (None, _scope(api_key)) if api_key else (None,)
+        with self._lock:
+            def sampled(model):
+                return self.latency_aware and len(self._latencies[(phase, model["name"])]) >= self.min_samples
+
+            def cooling(model):
+                return any(self._cooldown_until.get((model["name"], scope), 0) > now for scope in scopes)
+
+            chain = self.routes[phase]
+            fastest = iter(sorted(
+                (model for model in chain if sampled(model)),
+                key=lambda model: _percentile(sorted(self._latencies[(phase, model["name"])]), 0.95),
+            ))
+            ordered = [next(fastest) if sampled(model) else model for model in chain]
+            return sorted(ordered, key=cooling)
+
+    def record(self, phase: str, name: str, outcome: str, latency: float = None, api_key: str = None):
+        """
+        Records a call outcome: `ok` (with its latency) or a failure reason,
+        which starts the model's cooldown; for `rate_limited`, only for `api_key`.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            key = (phase, name, outcome)
+            self._counts[key] = self._counts.get(key, 0) + 1
+            if outcome == "ok":
+                self._latencies[(phase, name)].append(latency)
+                return
+            scope = _scope(api_key) if outcome == "rate_limited" and api_key else None
+            self._cooldown_until[(name, scope)] = now + self.cooldown
+            for expired in [k for k, until in self._cooldown_until.items() if until <= now]:
+                del self._cooldown_until[expired]
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for phase in PHASES:
+                result[phase] = []
+                for model in self.routes[phase]:
+                    latencies = sorted(self._latencies[(phase, model["name"])])
+                    result[phase].append({
+                        **model,
+                        "p95": _percentile(latencies, 0.95),
+                        "samples": len(latencies),
+                        "cooling_down": self._cooldown_until.get((model["name"], None), 0) > now,
+                        "outcomes": {
+                            outcome: count for (p, name, outcome), count in self._counts.items()
+                            if p == phase and name == model["name"]
+                        },
+                    })
+            return result
+
+
+def _scope(api_key: str) -> str:
+    """Keys per-key cooldowns by a digest, so API keys are not kept in memory."""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def create_model_router(config) -> ModelRouter:
+    """
+    Builds the router described by the `MODEL_*` routing settings in `config`.
+    """
+
+    return ModelRouter(load_routes(config), config.MODEL_ROUTING == "latency", config.MODEL_COOLDOWN)
@@ -0,0 +1,272 @@
+from collections import OrderedDict
+import math
+import re
+import threading
+import time
+import zlib
+
+from utils.lazy import lazy_import
+
+
+_WORD = re.compile(r"\w+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by do does for from how i in is it its me my of on or that the this to was what "
+    "when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> list:
+    """Lowercased word tokens without stopwords; a trailing plural `s` is dropped."""
+    tokens = []
+    for word in _WORD.findall(text.lower()):
+        if word in STOPWORDS or len(word) < 2:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def _normalize(vector: dict) -> dict:
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {k: v / norm for k, v in vector.items()} if norm else {}
+
+
+def cosine(a: dict, b: dict) -> float:
+    """Dot product of two normalized sparse vectors."""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(index, 0.0) for index, weight in a.items())
+
+
+class HashingEmbedder:
+    """
+    Dependency-free text vectors: word and character-trigram features hashed
+    into `dim` buckets. Catches paraphrases that share stems or spelling
+    ("blockchains", "block chain") but not synonyms; use
+    `SentenceTransformerEmbedder` for real semantic similarity.
+    """
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def embed(self, text: str) -> dict:
+        vector = {}
+        for word in tokenize(text):
+            features = [word] + [word[i:i + 3] for i in range(len(word) - 2)]
+            for feature in features:
+                index = zlib.crc32(feature.encode()) % self.dim
+                vector[index] = vector.get(index, 0.0) + 1.0
+        return _normalize(vector)
+
+
+class SentenceTransformerEmbedder:
+    """
+    Dense embeddings from a `sentence-transformers` model. Requires the
+    optional `sentence-transformers` package, which is checked for up front
+    but only imported, and the model only loaded, on the first `embed`.
+    """
+
+    def __init__(self, model_name: str):
+        try:
+            self._package = lazy_import("sentence_transformers")
+        except ImportError as e:
+            raise RuntimeError("SEARCH_EMBEDDER=sentence-transformers requires the 'sentence-transformers' package") from e
+        self.model_name = model_name
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    def embed(self, text: str) -> dict:
+        model = self._model
+        if model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._package.SentenceTransformer(self.model_name)
+                model = self._model
+        return _normalize(dict(enumerate(float(v) for v in model.encode(text))))
+
+
+class _UserIndex:
+    def __init__(self):
+        self.docs = {}       # id -> row
+        self.postings = {}   # term -> {id: term frequency}
+        self.lengths = {}    # id -> number of indexed terms
+        self.vectors = {}    # id -> embedding
+        self.total_length = 0
+        self.complete = False
+        self.loaded_at = 0.0
+
+
+class HistorySearchIndex:
+    """
+    In-process inverted index over users' chat history, with BM25 keyword
+    ranking and optional embedding similarity.
+
+    A user's index is built from the database on their first search (`load`)
+    and then kept current by `add_rows` as this process inserts new records.
+    Records inserted by other worker processes are only seen by loading
+    again: once `refresh_after` seconds (0 = never) have passed since the last
+    load, `is_loaded` is False and another `load` adds the rows the index does
+    not have yet. Terms from the question count twice, since it is what users
+    remember a chat by. Indexes for the least recently searched users are
+    dropped beyond `max_users`.
+
+    Embeddings for a load are computed before the lock is taken, so searches
+    by other users are not held up while a large history is indexed.
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, max_users: int = 1000, embedder=None, refresh_after: float = 0):
+        self.max_users = max_users
+        self.embedder = embedder
+        self.refresh_after = refresh_after
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_loaded(self, user_id: str) -> bool:
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None or not index.complete:
+                return False
+            return not self.refresh_after or time.monotonic() - index.loaded_at < self.refresh_after
+
+    def begin_load(self, user_id: str):
+        """Starts collecting rows for `user_id`, so inserts during `load` are not lost."""
+        with self._lock:
+            if user_id not in self._users:
+                self._users[user_id] = _UserIndex()
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def load(self, user_id: str, rows: list):
+        """Indexes the user's existing history and marks the index complete."""
+        self.begin_load(user_id)
+        vectors = {}
+        if self.embedder is not None:
+            with self._lock:
+                index = self._users.get(user_id)
+                indexed = set(index.docs) if index is not None else set()
+            vectors = {row["id"]: self._embed(row) for row in rows if row["id"] not in indexed}
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                return
+            for row in rows:
+                self._add_locked(index, row, vectors.get(row["id"]))
+            index.complete = True
+            index.loaded_at = time.monotonic()
+
+    def add_rows(self, rows: list):
+        """Indexes newly inserted rows (with `id` and `user_id`) for users whose index exists."""
+        with self._lock:
+            for row in rows:
+                index = self._users.get(row.get("user_id"))
+                if index is not None and "id" in row:
+                    self._add_locked(index, row)
+
+    def invalidate(self, user_id: str):
+        """Drops a user's index, e.g. after an insert whose new `id` is unknown."""
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def search(self, user_id: str, query: str, mode: str = "keyword", limit: int = 20, offset: int = 0) -> tuple:
+        """
+        Ranks the user's records against `query`.
+
+        Args:
+            mode (str): `keyword` (BM25), `semantic` (embedding cosine) or
+                `hybrid` (the two scores, each scaled to [0, 1], averaged).
+
+        Returns:
+            tuple: (list of `(score, row)` for the requested page, total number of matches).
+        """
+
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None or not index.docs:
+                return [], 0
+            self._users.move_to_end(user_id)
+
+            scores = {}
+            if mode in ("keyword", "hybrid"):
+                scores = self._bm25(index, tokenize(query))
+            if mode in ("semantic", "hybrid") and self.embedder is not None:
+                query_vector = self.embedder.embed(query)
+                similarities = {
+                    doc_id: similarity for doc_id, vector in index.vectors.items()
+                    if (similarity := cosine(query_vector, vector)) > 0.1
+                }
+                if mode == "semantic":
+                    scores = similarities
+                else:
+                    top = max(scores.values(), default=0) or 1
+                    scores = {
+                        doc_id: (scores.get(doc_id, 0) / top + similarities.get(doc_id, 0)) / 2
+                        for doc_id in scores.keys() | similarities.keys()
+                    }
+
+            # Ties go to the newer record
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+            page = [(score, index.docs[doc_id]) for doc_id, score in ranked[offset:offset + limit]]
+            return page, len(ranked)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "documents": sum(len(index.docs) for index in self._users.values()),
+                "terms": sum(len(index.postings) for index in self._users.values()),
+            }
+
+    def _bm25(self, index: _UserIndex, terms: list) -> dict:
+        count = len(index.docs)
+        average_length = index.total_length / count if count else 0
+        scores = {}
+        for term in set(terms):
+            postings = index.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = 1 - self.b + self.b * index.lengths[doc_id] / (average_length or 1)
+                scores[doc_id] = scores.get(doc_id, 0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return scores
+
+    def _embed(self, row: dict) -> dict:
+        return self.embedder.embed(f"{row.get('query') or ''} {row.get('casual_response') or ''}")
+
+    def _add_locked(self, index: _UserIndex, row: dict, vector: dict = None):
+        doc_id = row["id"]
+        if doc_id in index.docs:
+            return
+        text = " ".join(row.get(field) or "" for field in ("casual_response", "formal_response"))
+        terms = tokenize(row.get("query") or "") * 2 + tokenize(text)
+
+        index.docs[doc_id] = row
+        index.lengths[doc_id] = len(terms)
+        index.total_length += len(terms)
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, tf in frequencies.items():
+            index.postings.setdefault(term, {})[doc_id] = tf
+        if self.embedder is not None:
+            index.vectors[doc_id] = vector if vector is not None else self._embed(row)
+
+
+def create_search_index(config) -> HistorySearchIndex:
+    """
+    Builds the local history search index described by the `SEARCH_*` settings in `config`.
+    """
+
+    if config.SEARCH_EMBEDDER == "sentence-transformers":
+        embedder = SentenceTransformerEmbedder(config.SEARCH_EMBEDDING_MODEL)
+    elif config.SEARCH_EMBEDDER == "hashing":
+        embedder = HashingEmbedder()
+    else:
+        embedder = None
+    return HistorySearchIndex(config.SEARCH_INDEX_MAX_USERS, embedder, config.SEARCH_INDEX_REFRESH)
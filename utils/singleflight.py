@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent work on the same key so it runs once.
+
+    Within a process, callers of `run` with a key already in flight await the
+    same task instead of starting their own; the task is shielded, so a caller
+    disconnecting (or hitting its deadline) does not cancel it for the others.
+    Once every caller awaiting it has gone, the task is cancelled, so no
+    upstream work is left running for nobody.
+
+    Across workers, the leader also takes a short lock in the shared store
+    (see utils/store.py). A worker that finds the lock taken polls `lookup`
+    (normally the shared response cache, which the leader fills before
+    releasing) and only generates itself if nothing appears within
+    `wait_timeout` seconds.
+    """
+
+    def __init__(self, store, lock_ttl: float = 60, wait_timeout: float = 30, poll_interval: float = 0.1):
+        self.store = store
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._inflight = {}
+        self._waiters = {}  # task -> callers awaiting it
+        self.stats = {"leaders": 0, "coalesced": 0, "remote_waits": 0}
+
+    def in_flight(self, key: str):
+        """Returns the in-process task for `key`, or None."""
+        return self._inflight.get(key)
+
+    async def run(self, key: str, producer, lookup=None, retry_on=()):
+        """
+        Returns the result of `producer()` for `key`, sharing one call among
+        concurrent callers.
+
+        Args:
+            key (str): Coalescing key, e.g. the cache key of the query.
+            producer: Coroutine function doing the work.
+            lookup: Optional coroutine function returning another worker's result (or None).
+            retry_on: Exception types tied to the leader's own call (e.g. its
+                credentials); a follower seeing one runs `producer` itself.
+        """
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["leaders"] += 1
+            task = asyncio.ensure_future(self._lead(key, producer, lookup))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+            return await self.follow(task)
+
+        self.stats["coalesced"] += 1
+        try:
+            return await self.follow(task)
+        except retry_on:
+            return await producer()
+
+    async def follow(self, task):
+        """Awaits an in-flight task as one of its callers; see `in_flight`."""
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    task.cancel()
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "in_flight": len(self._inflight)}
+
+    async def _lead(self, key: str, producer, lookup):
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            if waited and lookup is not None:
+                # Checked before retrying the lock, which frees up once the other worker is done
+                result = await lookup()
+                if result is not None:
+                    return result
+
+            if await self.store.acquire_lock(key, self.lock_ttl):
+                try:
+                    return await producer()
+                finally:
+                    await self.store.release_lock(key)
+
+            if not waited:
+                waited = True
+                self.stats["remote_waits"] += 1
+            if time.monotonic() >= deadline:
+                return await producer()
+            await asyncio.sleep(self.poll_interval)
+
+    def _done(self, key: str, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark the exception retrieved even if every caller went away
+            task.exception()
@@ -0,0 +1,130 @@
+import threading
+import time
+import uuid
+
+
+class InMemorySharedStore:
+    """
+    Process-local coordination state: token buckets for rate limiting and
+    short-lived locks for single-flight generation.
+
+    Only coordinates requests handled by this process; use `RedisSharedStore`
+    when running several workers.
+    """
+
+    def __init__(self, max_buckets: int = 10000):
+        self.max_buckets = max_buckets
+        self._buckets = {}   # key -> (tokens, updated, full_at)
+        self._locks = {}     # key -> expires_at
+        self._lock = threading.Lock()
+
+    async def take_token(self, key: str, rate: float, burst: float) -> float:
+        """
+        Takes one token from the bucket at `key`, which refills at `rate` tokens
+        per second up to `burst`.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one is available.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if len(self._buckets) > self.max_buckets:
+                self._prune(now)
+        return wait
+
+    async def acquire_lock(self, key: str, ttl: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self._locks.get(key, 0) > now:
+                return False
+            self._locks[key] = now + ttl
+            return True
+
+    async def release_lock(self, key: str):
+        with self._lock:
+            self._locks.pop(key, None)
+
+    def _prune(self, now: float):
+        # A bucket that has refilled completely is the same as a missing one
+        for key in [key for key, (_, _, full_at) in self._buckets.items() if full_at <= now]:
+            del self._buckets[key]
+        for key in [key for key, expires_at in self._locks.items() if expires_at <= now]:
+            del self._locks[key]
+
+
+# Refill and take one token atomically; returns the wait in seconds as a string.
+_TAKE_TOKEN = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+# Delete the lock only if this process still owns it.
+_RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisSharedStore:
+    """
+    Coordination state shared by every worker through Redis. Token buckets are
+    updated by a Lua script using the server clock, so workers never race or
+    disagree on time. Uses the asyncio client, so a rate-limit check does not
+    block the event loop. Requires the optional `redis` package.
+    """
+
+    def __init__(self, url: str, prefix: str = "coordination:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("SHARED_STORE_BACKEND=redis requires the 'redis' package") from e
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._owner = uuid.uuid4().hex
+        self._take_token = self._client.register_script(_TAKE_TOKEN)
+        self._release_lock = self._client.register_script(_RELEASE_LOCK)
+
+    async def take_token(self, key: str, rate: float, burst: float) -> float:
+        return float(await self._take_token(keys=[self._prefix + "bucket:" + key], args=[rate, burst]))
+
+    async def acquire_lock(self, key: str, ttl: float) -> bool:
+        return bool(await self._client.set(self._prefix + "lock:" + key, self._owner, nx=True, px=int(ttl * 1000)))
+
+    async def release_lock(self, key: str):
+        await self._release_lock(keys=[self._prefix + "lock:" + key], args=[self._owner])
+
+
+def create_shared_store(config):
+    """
+    Builds the coordination store described by the `SHARED_STORE_*` settings in `config`.
+    """
+
+    if config.SHARED_STORE_BACKEND == "redis":
+        return RedisSharedStore(config.SHARED_STORE_URL)
+    return InMemorySharedStore()
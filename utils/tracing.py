@@ -0,0 +1,158 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import logging
+import logging.handlers
+import queue
+import time
+import uuid
+
+from utils.metrics import MetricsRegistry
+
+
+# Request ID of the request being handled, set by the middleware in backend.py
+request_id_var = ContextVar("request_id", default="-")
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "generate_stage_seconds", "Time spent in each stage of the generate pipeline.", ("stage", "model"),
+)
+LLM_TOKENS = metrics.counter(
+    "llm_tokens_total", "Tokens reported by the model, by call stage and direction.", ("stage", "model", "kind"),
+)
+HTTP_SECONDS = metrics.histogram(
+    "http_request_seconds", "HTTP request latency by route and status code.", ("method", "route", "status"),
+)
+
+logger = logging.getLogger("yoliday")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+@contextmanager
+def span(stage: str, model: str = "", **attributes):
+    """
+    Times a pipeline stage, recording it in `generate_stage_seconds` and as a
+    structured `span` log line tagged with the current request ID.
+
+    Extra attributes (e.g. token counts) can be added to the yielded dict
+    before the block exits.
+    """
+
+    fields = dict(attributes)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield fields
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=stage, model=model)
+        logger.info("span", extra={"fields": {"stage": stage, "model": model, "duration_ms": round(duration * 1000, 3), "status": status, **fields}})
+
+
+def record_tokens(response, stage: str, model: str) -> dict:
+    """
+    Records the token usage LangChain reports on a model response (or the final
+    streamed chunk) and returns it as `{"input_tokens", "output_tokens", "total_tokens"}`.
+    """
+
+    usage = getattr(response, "usage_metadata", None) or {}
+    counts = {key: usage.get(key, 0) for key in ("input_tokens", "output_tokens", "total_tokens")}
+    if counts["input_tokens"]:
+        LLM_TOKENS.inc(counts["input_tokens"], stage=stage, model=model, kind="input")
+    if counts["output_tokens"]:
+        LLM_TOKENS.inc(counts["output_tokens"], stage=stage, model=model, kind="output")
+    return counts
+
+
+class RequestTracingMiddleware:
+    """
+    ASGI middleware that assigns each HTTP request an ID (the incoming
+    `X-Request-ID` header, or a new one), echoes it on the response and records
+    the latency in `http_request_seconds` by route template and status.
+
+    Latency is measured until the last body chunk is sent, so streaming
+    endpoints are timed end to end rather than to the first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or new_request_id()
+        token = request_id_var.set(request_id)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            route = scope.get("route")
+            HTTP_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope["method"], route=getattr(route, "path", "unmatched"), status=str(status),
+            )
+            request_id_var.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including the request ID and any `extra={"fields": {...}}`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _RequestIdQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Capture the request ID on the calling task before the record changes threads
+        record.request_id = request_id_var.get()
+        return super().prepare(record)
+
+
+def configure_logging(level: str = "INFO") -> logging.handlers.QueueListener:
+    """
+    Routes the `yoliday` logger through a queue so that formatting and writing
+    happen on a background thread and never block the event loop.
+
+    Returns:
+        QueueListener: already started; call `stop()` on shutdown to flush.
+    """
+
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+
+    logger.handlers = [_RequestIdQueueHandler(log_queue)]
+    logger.setLevel(level)
+    logger.propagate = False
+    listener.start()
+    return listener